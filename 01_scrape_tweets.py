@@ -1,13 +1,21 @@
 from twikit import Client, TooManyRequests, Forbidden
 import asyncio
 from datetime import datetime
-import csv
 import io
-import random
 import time
 import os
 import glob
 import argparse
+import sqlite3
+
+import metrics
+from build import use_raw_tweets
+from config import SCRAPE_CONFIG
+from pacing import RequestScheduler
+from sinks import CsvSink, TeeSink
+
+MINIMUM_TWEETS = 20
+CSV_HEADER = ['Tweet_count', 'Username', 'Text', 'Created At', 'Retweets', 'Likes']
 
 def get_available_queries():
     """Get list of available query files"""
@@ -45,8 +53,30 @@ async def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Scrape tweets based on a query')
     parser.add_argument('--query-file', type=str, help='Name of the query file to use')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Append only tweets not scraped by earlier runs (keyed by tweet id)')
+    parser.add_argument('--all-queries', action='store_true',
+                        help='Scrape every query_*.txt file concurrently')
+    parser.add_argument('--query-glob', type=str,
+                        help='Scrape every query file matching this pattern concurrently')
+    parser.add_argument('--fake-client', action='store_true',
+                        help='Use a local fake Twitter client instead of the cookies (offline runs)')
     args = parser.parse_args()
 
+    client = None
+    if args.fake_client:
+        from fakes import FakeTwitterClient
+        client = FakeTwitterClient()
+
+    # Batch mode: several query files over one shared client and request budget
+    if args.all_queries or args.query_glob:
+        query_files = sorted(glob.glob(args.query_glob or 'query_*.txt'))
+        if not query_files:
+            print(f"No query files match {args.query_glob or 'query_*.txt'}")
+            return
+        await scrape_queries(query_files, incremental=args.incremental, client=client)
+        return
+
     # Get query file either from command line or interactive selection
     if args.query_file:
         query_file = args.query_file
@@ -58,91 +88,181 @@ async def main():
         if not query_file:
             return
     
-    # Load the selected query
-    QUERY = load_query(query_file)
-    print(f"\nSelected query from {query_file}:")
-    print(f"Query: {QUERY}")
-    
-    # Initialize client and load cookies
+    await scrape_tweets(query_file, incremental=args.incremental, client=client)
+
+def load_client():
+    """Creates a twikit client from the saved cookies. Returns None if that fails"""
     client = Client(language='en-US')
     try:
         client.load_cookies('cookies.json')
         print("Cookies loaded successfully.")
+        return client
     except FileNotFoundError:
         print("Error: cookies.json file not found. Please login first using the login script.")
-        return
     except Exception as e:
         print(f"Error loading cookies: {str(e)}")
+    return None
+
+class SeenTweets:
+    """
+    Per-query SQLite index of every tweet id scraped so far, plus the highest id seen
+    (the since-id watermark), so repeated runs only append tweets they haven't stored.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS watermark (id INTEGER)")
+        self.conn.commit()
+
+    def __contains__(self, tweet_id):
+        return self.conn.execute("SELECT 1 FROM seen WHERE id = ?", (str(tweet_id),)).fetchone() is not None
+
+    @property
+    def watermark(self):
+        row = self.conn.execute("SELECT MAX(id) FROM watermark").fetchone()
+        return row[0] if row else None
+
+    def add(self, tweet_id):
+        self.conn.execute("INSERT OR IGNORE INTO seen (id) VALUES (?)", (str(tweet_id),))
+        if str(tweet_id).isdigit():
+            self.conn.execute("INSERT INTO watermark (id) VALUES (?)", (int(tweet_id),))
+
+    def discard(self):
+        """Closes the index without recording the ids added since it was opened"""
+        self.conn.rollback()
+        self.conn.close()
+
+    def close(self):
+        # Only the highest watermark matters; keep the table to a single row
+        self.conn.execute("DELETE FROM watermark WHERE id < (SELECT MAX(id) FROM watermark)")
+        self.conn.commit()
+        self.conn.close()
+
+async def iter_tweets(client, query, minimum_tweets=MINIMUM_TWEETS, product='Top', seen=None, scheduler=None):
+    """
+    Searches for query and yields one CSV row per tweet as soon as it is available,
+    fetching further pages until minimum_tweets rows have been produced.
+    With a SeenTweets index, rows are keyed by the real tweet id and tweets already in
+    the index are skipped (and not counted).
+    Only the network calls are paced, by `scheduler` (a pacing.RequestScheduler).
+    Twikit errors (TooManyRequests, Forbidden, ...) propagate to the caller.
+    """
+    scheduler = scheduler or RequestScheduler()
+    tweet_count = 0
+    print(f"\nSearching for tweets with query: {query}")
+    print("This may take a moment...")
+    
+    tweets = await scheduler.call(client.search_tweet, query, product=product)
+    if not tweets:
+        print("No tweets found for this query. Try a different query or check your search terms.")
         return
+        
+    print(f"\nStarting tweet collection...")
+    print(f"Target: {minimum_tweets} tweets")
+
+    while tweet_count < minimum_tweets and tweets:
+        print(f"\nProcessing batch of tweets...")
+        for tweet in tweets:
+            if seen is not None and tweet.id in seen:
+                continue
+
+            tweet_count += 1
 
-    # Create CSV file with UTF-8 encoding
-    output_file = f"01_tweets_{os.path.splitext(query_file)[0]}.csv"
-    with open(output_file, 'w', newline='', encoding='utf-8') as file:
-        writer = csv.writer(file)
-        writer.writerow(['Tweet_count', 'Username', 'Text', 'Created At', 'Retweets', 'Likes'])
+            # Handle text that might contain problematic characters
+            try:
+                clean_text = tweet.text
+            except:
+                # If text can't be processed, replace with a placeholder
+                clean_text = "[Text contains unsupported characters]"
+
+            yield [
+                tweet.id if seen is not None else tweet_count,
+                clean_username(tweet.user.name),
+                clean_text,
+                tweet.created_at,
+                tweet.retweet_count,
+                tweet.favorite_count
+            ]
+
+            if tweet_count >= minimum_tweets:
+                break
+
+        if tweet_count < minimum_tweets:
+            print(f"\nGot {tweet_count} tweets so far. Getting more...")
+            # The scheduler paces this request (SCRAPE_CONFIG["pacing"]); writing the page above never waits
+            print("Fetching next batch of tweets...")
+            tweets = await scheduler.call(tweets.next)
+            if not tweets:
+                print("\nNo more tweets available for this query.")
+                break
+
+async def scrape_tweets(query_file, minimum_tweets=MINIMUM_TWEETS, incremental=False, extra_sinks=(),
+                        client=None, scheduler=None):
+    """
+    Scrapes tweets for the query in query_file into 01_tweets_<query>.csv.
+    With incremental=True the file is appended to instead of replaced: rows are keyed by
+    the real tweet id, only tweets newer than the query's since-id watermark are
+    searched, ids already stored are skipped, and this run's new rows are also written
+    to 01_delta_<query>.csv for the downstream steps. A file left by a full scrape is
+    not appended to (its rows are not keyed by tweet id), and a full scrape drops the
+    query's index of seen ids.
+    Rows also go to any extra_sinks (see sinks.py), e.g. a JsonlSink or a QueueSink.
+    Files are written through a .part file and only renamed into place once the scrape
+    has finished; a run that crashes leaves the .part file behind.
+    A client and RequestScheduler can be passed in to share them between queries.
+    Returns the output file name, or None if nothing could be scraped.
+    """
+    # Load the selected query
+    QUERY = load_query(query_file)
+    print(f"\nSelected query from {query_file}:")
+    print(f"Query: {QUERY}")
+    
+    # Initialize client and load cookies
+    client = client or load_client()
+    if not client:
+        return None
+
+    query_name = os.path.splitext(os.path.basename(query_file))[0]
+    output_file = f"01_tweets_{query_name}.csv"
+    seen_file = f"01_seen_{query_name}.sqlite"
+    seen = None
+    product = 'Top'
+    if incremental:
+        if os.path.exists(output_file) and not os.path.exists(seen_file):
+            # Rows of a full scrape are keyed by position, so new tweets can't be matched against them
+            print(f"\nError: {output_file} was not scraped with --incremental, so appending to it would "
+                  "duplicate tweets. Move it away (or delete it) to start an incremental scrape.")
+            return None
+        seen = SeenTweets(seen_file)
+        if seen.watermark:
+            QUERY = f"{QUERY} since_id:{seen.watermark}"
+            print(f"Incremental mode: only fetching tweets newer than {seen.watermark}")
+        # Newest-first results make the watermark effective
+        product = 'Latest'
+
+    # One buffered UTF-8 CSV writer per output file (the main file is appended to when incremental)
+    sink = TeeSink(CsvSink(output_file, CSV_HEADER, append=incremental), *extra_sinks)
+    if incremental:
+        sink.sinks.append(CsvSink(f"01_delta_{query_name}.csv", CSV_HEADER))
     
+    # A scheduler passed in is shared with other queries and reported by the caller
+    own_scheduler = scheduler is None
+    scheduler = scheduler or RequestScheduler()
+
     # Search for tweets
+    tweet_count = 0
     try:
-        tweet_count = 0
-        print(f"\nSearching for tweets with query: {QUERY}")
-        print("This may take a moment...")
-        
-        tweets = await client.search_tweet(QUERY, product='Top')
-        if not tweets:
-            print("No tweets found for this query. Try a different query or check your search terms.")
-            return
-            
-        print(f"\nStarting tweet collection...")
-        print(f"Target: {MINIMUM_TWEETS} tweets")
-
-        while tweet_count < MINIMUM_TWEETS and tweets:
-            print(f"\nProcessing batch of tweets...")
-            for tweet in tweets:
-                # Add random delay between processing each tweet (1-2 seconds)
-                await asyncio.sleep(random.uniform(1, 2))
-
-                tweet_count += 1
-
-                # Handle text that might contain problematic characters
-                try:
-                    clean_text = tweet.text
-                except:
-                    # If text can't be processed, replace with a placeholder
-                    clean_text = "[Text contains unsupported characters]"
-
-                tweet_data = [
-                    tweet_count,
-                    clean_username(tweet.user.name),
-                    clean_text,
-                    tweet.created_at,
-                    tweet.retweet_count,
-                    tweet.favorite_count
-                ]
-
-                # Write to CSV with UTF-8 encoding
-                with open(output_file, 'a', newline='', encoding='utf-8') as file:
-                    writer = csv.writer(file)
-                    writer.writerow(tweet_data)
-
-                # Show progress
-                progress = (tweet_count / MINIMUM_TWEETS) * 100
-                print(f"\rProgress: {tweet_count}/{MINIMUM_TWEETS} tweets ({progress:.1f}%) - Latest: {clean_username(tweet.user.name)}", end="")
-
-                if tweet_count >= MINIMUM_TWEETS:
-                    break
-
-            if tweet_count < MINIMUM_TWEETS:
-                print(f"\nGot {tweet_count} tweets so far. Getting more...")
-                # Add longer random delay between batches (3-7 seconds)
-                await asyncio.sleep(random.uniform(3, 7))
-                print("Fetching next batch of tweets...")
-                tweets = await tweets.next()
-                if not tweets:
-                    print("\nNo more tweets available for this query.")
-                    break
+        async for tweet_data in iter_tweets(client, QUERY, minimum_tweets, product=product, seen=seen,
+                                            scheduler=scheduler):
+            tweet_count += 1
+            sink.write_row(tweet_data)
+            if seen is not None:
+                seen.add(tweet_data[0])
 
-        print(f"\n\nDone! Collected {tweet_count} tweets in total.")
-        print(f"Results saved to: {output_file}")
+            # Show progress
+            progress = (tweet_count / minimum_tweets) * 100
+            print(f"\rProgress: {tweet_count}/{minimum_tweets} tweets ({progress:.1f}%) - Latest: {tweet_data[1]}", end="")
 
     except TooManyRequests:
         print("\nError: Rate limit exceeded. Please wait and try again later.")
@@ -150,6 +270,62 @@ async def main():
         print("\nError: Access forbidden. Your cookies might be invalid or expired.")
     except Exception as e:
         print(f"\nError: {type(e).__name__}: {str(e)}")
+    except BaseException:
+        # Interrupted (e.g. Ctrl+C): leave the .part files so the partial output is detectable,
+        # and forget the ids of the tweets that were not saved
+        sink.abort()
+        if seen is not None:
+            seen.discard()
+        raise
+    else:
+        print(f"\n\nDone! Collected {tweet_count} tweets in total.")
+        if own_scheduler:
+            print(f"Twitter requests: {scheduler.summary()}")
+
+    # The tweets collected before a handled error are kept, as before
+    sink.close()
+    if seen is not None:
+        seen.close()
+    elif os.path.exists(seen_file):
+        # The file the index described has just been replaced
+        os.remove(seen_file)
+    metrics.add_rows(rows_out=tweet_count)
+    if not tweet_count:
+        return None
+    print(f"Results saved to: {output_file}")
+    # Steps 2 and 4 read the file scraped last
+    use_raw_tweets(output_file)
+    return output_file
+
+async def scrape_queries(query_files, minimum_tweets=MINIMUM_TWEETS, incremental=False, client=None):
+    """
+    Scrapes several query files concurrently as asyncio tasks over one shared client,
+    with SCRAPE_CONFIG["max_concurrent_queries"] running at a time and a single
+    RequestScheduler enforcing the account's request budget across all of them.
+    Returns {query_file: output file or None}.
+    """
+    client = client or load_client()
+    if not client:
+        return {}
+
+    scheduler = RequestScheduler()
+    slots = asyncio.Semaphore(SCRAPE_CONFIG["max_concurrent_queries"])
+    print(f"\nScraping {len(query_files)} queries ({SCRAPE_CONFIG['max_concurrent_queries']} at a time)...")
+
+    async def scrape_one(query_file):
+        async with slots:
+            return await scrape_tweets(query_file, minimum_tweets, incremental=incremental,
+                                       client=client, scheduler=scheduler)
+
+    started = time.monotonic()
+    outputs = await asyncio.gather(*(scrape_one(query_file) for query_file in query_files))
+    elapsed = time.monotonic() - started
+
+    results = dict(zip(query_files, outputs))
+    print(f"\n\n📋 Batch summary ({elapsed:.0f}s, {scheduler.summary()}):")
+    for query_file, output_file in results.items():
+        print(f"  {'✓' if output_file else '✗'} {query_file} -> {output_file or 'no tweets'}")
+    return results
 
 def clean_username(text):
     """Clean username text to avoid encoding issues"""
@@ -162,5 +338,4 @@ def clean_username(text):
         return "[Username contains unsupported characters]"
 
 if __name__ == "__main__":
-    MINIMUM_TWEETS = 20
-    asyncio.run(main())
\ No newline at end of file
+    exit(metrics.run_stage('scrape', lambda: asyncio.run(main())))
\ No newline at end of file
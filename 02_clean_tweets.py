@@ -1,78 +1,196 @@
 import pandas as pd
-import re
-import emoji
 import sys
-import glob
+import io
 import os
+import argparse
+import json
+import metrics
+from build import delta_file, file_state, raw_tweets_file
+from config import FILE_PATHS
+from text_cleaning import clean_series, find_mismatches
+from storage import TableWriter, append_table, artifact_exists, artifact_path, write_table
 
-def clean_text(text):
-    """Clean tweet text by removing URLs, mentions, emojis, and special characters"""
-    if pd.isna(text):
-        return ""
-        
-    # Convert to string if not already
-    text = str(text)
-    
-    # Remove URLs
-    text = re.sub(r'http\S+|www\S+|https\S+', '', text, flags=re.MULTILINE)
-    
-    # Remove mentions
-    text = re.sub(r'@\w+', '', text)
-    
-    # Remove hashtags but keep the text
-    text = re.sub(r'#', '', text)
-    
-    # Remove emojis
-    text = emoji.replace_emoji(text, '')
-    
-    # Remove special characters but keep basic punctuation
-    text = re.sub(r'[^\w\s.,!?-]', '', text)
+# Deltas remembered as appended (older ones are forgotten)
+MAX_APPLIED_DELTAS = 1000
+
+def read_appended(input_file, offset):
+    """The header line of a CSV file followed by everything after byte `offset`"""
+    with open(input_file, 'rb') as file:
+        header = file.readline()
+        file.seek(max(offset, len(header)))
+        return header + file.read()
+
+def load_tweets(input_file, offset=0):
+    """
+    Reads a raw tweets CSV, falling back to ISO-8859-1 if it is not valid UTF-8.
+    With an offset only the rows after that byte position are read.
+    """
+    data = read_appended(input_file, offset) if offset else None
+    source = lambda: io.BytesIO(data) if data is not None else input_file
+    try:
+        # Read CSV with UTF-8 encoding
+        return pd.read_csv(source(), encoding='utf-8')
+    except UnicodeDecodeError:
+        # If UTF-8 fails, try with different encoding
+        print("UTF-8 encoding failed, trying with ISO-8859-1...")
+        return pd.read_csv(source(), encoding='ISO-8859-1')
+
+def clean_tweets(df, workers=1):
+    """Returns a copy of the tweets DataFrame with cleaned text and empty tweets removed"""
+    df = df.copy()
     
-    # Normalize whitespace
-    text = re.sub(r'\s+', ' ', text)
-    text = text.strip()
+    # Clean the tweet text (vectorized, optionally across worker processes)
+    df['Text'] = clean_series(df['Text'], workers=workers)
     
-    return text
+    # Remove empty tweets
+    df = df.dropna(subset=['Text'])
+    df = df[df['Text'].str.strip() != '']
+    return df
+
+def clean_file_chunked(input_file, chunksize, workers=1):
+    """
+    Cleans input_file into the cleaned tweets artifact `chunksize` rows at a time, so
+    memory use is bounded by the chunk size rather than the file size.
+    Returns (rows_read, rows_written).
+    """
+    for encoding in ('utf-8', 'ISO-8859-1'):
+        rows_read = rows_written = 0
+        writer = None
+        try:
+            for chunk in pd.read_csv(input_file, encoding=encoding, chunksize=chunksize):
+                rows_read += len(chunk)
+                cleaned = clean_tweets(chunk, workers=workers)
+                if writer is None:
+                    writer = TableWriter('cleaned_tweets', list(cleaned.columns))
+                writer.write_frame(cleaned)
+                rows_written += len(cleaned)
+                print(f"\rCleaned {rows_read} tweets...", end="")
+            if writer:
+                writer.close()
+            print()
+            return rows_read, rows_written
+        except UnicodeDecodeError:
+            if writer:
+                writer.close()
+            # Start over: earlier chunks may already have been decoded wrongly
+            print("\nUTF-8 encoding failed, trying with ISO-8859-1...")
+    raise UnicodeDecodeError('ISO-8859-1', b'', 0, 1, f"could not decode {input_file}")
+
+def load_applied_deltas(path=FILE_PATHS["applied_deltas"]):
+    """Keys (see clean_delta) of the deltas already appended to the cleaned tweets"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+def record_applied_delta(key, path=FILE_PATHS["applied_deltas"]):
+    metrics.write_json(path, (load_applied_deltas(path) + [key])[-MAX_APPLIED_DELTAS:])
+
+def clean_delta(input_file, offset=0, workers=1):
+    """
+    Cleans new tweets and appends them to the cleaned tweets artifact: the whole of
+    input_file (an incremental scrape's 01_delta_<query>.csv), or with an offset only
+    its rows after that byte position (the rows appended since the last build).
+    The content hash and offset of every delta appended are recorded, so cleaning
+    the same delta again does not append its rows twice.
+    Returns 0 on success, 1 on failure.
+    """
+    state = file_state(input_file)
+    if not state:
+        print(f"Error cleaning new tweets: {input_file} not found")
+        return 1
+    key = f"{state['sha256']}:{offset}"
+    if artifact_exists('cleaned_tweets') and key in load_applied_deltas():
+        print(f"{input_file} was already appended to {artifact_path('cleaned_tweets')}, nothing to do")
+        metrics.rows(rows_in=0, rows_out=0)
+        return 0
+
+    print(f"Processing new tweets from {input_file}" + (f" after byte {offset}..." if offset else "..."))
+    try:
+        delta_df = load_tweets(input_file, offset)
+        df = clean_tweets(delta_df, workers=workers)
+        append_table(df, 'cleaned_tweets')
+        record_applied_delta(key)
+        metrics.rows(rows_in=len(delta_df), rows_out=len(df))
+    except Exception as e:
+        print(f"Error cleaning new tweets: {str(e)}")
+        return 1
+
+    print(f"Appended {len(df)} cleaned tweets to {artifact_path('cleaned_tweets')}")
+    return 0
 
 def main():
-    # Find the most recent tweets file
-    tweet_files = glob.glob('01_tweets_*.csv')
-    if not tweet_files:
+    parser = argparse.ArgumentParser(description='Clean scraped tweet text')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes used to clean very large files')
+    parser.add_argument('--verify', action='store_true',
+                        help='Check that the vectorized cleaner matches clean_text on every row')
+    parser.add_argument('--chunksize', type=int, default=0,
+                        help='Clean the file this many rows at a time to bound memory (0 = load it all)')
+    parser.add_argument('--incremental', action='store_true',
+                        help="Clean only the latest incremental scrape's new tweets and append them")
+    parser.add_argument('--input', type=str,
+                        help='Raw tweets file to clean (default: the current one, see build.raw_tweets_file)')
+    parser.add_argument('--append-from', type=int, default=None,
+                        help='Clean only the rows after this byte offset of the input and append them')
+    args = parser.parse_args()
+
+    input_file = raw_tweets_file(args.input)
+    if not input_file:
         print("No tweet files found. Please run the scraping step first.")
         return 1
+
+    if args.incremental:
+        if not os.path.exists(delta_file(input_file)):
+            print("No incremental scrape found. Please run the scraping step with --incremental first.")
+            return 1
+        return clean_delta(delta_file(input_file), workers=args.workers)
+    if args.append_from is not None:
+        return clean_delta(input_file, args.append_from, args.workers)
     
-    input_file = max(tweet_files, key=os.path.getctime)
-    output_file = '02_cleaned_tweets.csv'
+    output_file = artifact_path('cleaned_tweets')
     
     print(f"Processing {input_file}...")
     
+    if args.chunksize > 0:
+        print(f"Cleaning in chunks of {args.chunksize} rows...")
+        try:
+            rows_read, rows_written = clean_file_chunked(input_file, args.chunksize, args.workers)
+        except Exception as e:
+            print(f"Error cleaning file: {str(e)}")
+            return 1
+        metrics.rows(rows_in=rows_read, rows_out=rows_written)
+        print(f"Saved {rows_written} of {rows_read} tweets to {output_file}")
+        return 0
+    
     print("Loading tweets.csv...")
     try:
-        # Read CSV with UTF-8 encoding
-        df = pd.read_csv(input_file, encoding='utf-8')
-    except UnicodeDecodeError:
-        # If UTF-8 fails, try with different encoding
-        print("UTF-8 encoding failed, trying with ISO-8859-1...")
-        df = pd.read_csv(input_file, encoding='ISO-8859-1')
+        df = load_tweets(input_file)
     except FileNotFoundError:
         print("Error: tweets.csv not found!")
         return 1
     
     print(f"Processing {len(df)} tweets...")
+    metrics.rows(rows_in=len(df))
     
-    # Clean the tweet text
-    df['Text'] = df['Text'].apply(clean_text)
+    if args.verify:
+        mismatches = find_mismatches(df['Text'])
+        if mismatches:
+            print(f"✗ Vectorized cleaning differs from clean_text on {len(mismatches)}+ rows:")
+            for index, original, expected, actual in mismatches:
+                print(f"  row {index}: {original!r} -> expected {expected!r}, got {actual!r}")
+            return 1
+        print("✓ Vectorized cleaning matches clean_text on every row")
     
-    # Remove empty tweets
-    df = df.dropna(subset=['Text'])
-    df = df[df['Text'].str.strip() != '']
+    df = clean_tweets(df, workers=args.workers)
+    metrics.rows(rows_out=len(df))
     
     print(f"Saving {len(df)} cleaned tweets...")
     
     try:
-        # Save to cleaned_tweets.csv with UTF-8 encoding
-        df.to_csv(output_file, index=False, encoding='utf-8')
-        print("Successfully saved cleaned_tweets.csv")
+        # Save the cleaned tweets (CSV with UTF-8 encoding, or Parquet)
+        write_table(df, 'cleaned_tweets')
+        print(f"Successfully saved {output_file}")
     except Exception as e:
         print(f"Error saving file: {str(e)}")
         return 1
@@ -89,4 +207,4 @@ if __name__ == "__main__":
     except:
         pass
     
-    exit(main()) 
\ No newline at end of file
+    exit(metrics.run_stage('clean', main)) 
\ No newline at end of file
@@ -1,33 +1,77 @@
 import os
 import csv
 import json
-import google.generativeai as genai
 from dotenv import load_dotenv
-import emoji
 import sys
-import glob
-import time
-from tqdm import tqdm
+import argparse
+import asyncio
+from datetime import datetime
+import metrics
+from config import ANALYSIS_CONFIG, CACHE_CONFIG, DEDUP_CONFIG, FILE_PATHS, LOCAL_SCORER_CONFIG
+from dedup import group_near_duplicates
+from local_scorer import (LOCAL_EXPLANATION_PREFIX, SklearnScorer, evaluate, format_metrics, load_scorer,
+                          split_confident)
+from rate_limiter import RateLimiter, backoff_delay, estimate_tokens
+from response_cache import ResponseCache, make_cache_key
+from result_log import ResultLog, read_results
+from storage import TableWriter, artifact_exists, artifact_path, read_table, use_parquet
 
 # Load environment variables from the .env file
 load_dotenv(dotenv_path='api_keys.env')
 
-# Configure Gemini API
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
-model = genai.GenerativeModel('gemini-1.5-flash')
+MODEL_NAME = 'gemini-1.5-flash'
+
+# The Gemini SDK is slow to import; it is loaded and configured on first use (get_model)
+_genai = None
+_model = None
+
+# Bump whenever a prompt template changes so cached responses from the old prompt are not reused
+PROMPT_VERSION = 1
+COMPACT_PROMPT_VERSION = 1
+
+# Compact mode: the rubric is sent once per request as the model's system instruction
+# (not repeated inside every prompt) and the answer is constrained to JSON by a schema
+SCORING_RUBRIC = """You are a sentiment analysis assistant. You evaluate tweets about food prices and classify each one on a satisfaction scale where:
+
+1 = Very unsatisfied (strong anger, frustration, or outrage about food prices)
+2 = Unsatisfied (disappointment or complaints about food prices)
+3 = Neutral (observational, balanced or mixed feelings about food prices)
+4 = Satisfied (approval or mild praise, noting price improvements)
+5 = Very satisfied (enthusiastic approval or strong praise regarding affordability)
+
+You receive tweets as JSON objects, one per line. Return a JSON array with exactly one object per tweet, using the tweet's id unchanged."""
 
 # Set console encoding to UTF-8 on Windows
 if sys.platform == 'win32':
     sys.stdout.reconfigure(encoding='utf-8')
 
-def remove_emojis(text):
-    """Remove emojis from text"""
-    return emoji.replace_emoji(text, replace='')
+def genai_module():
+    """google.generativeai, imported and configured with GEMINI_API_KEY on first use"""
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+        _genai = genai
+    return _genai
+
+def get_model():
+    """The shared full-prompt Gemini model, created on first use"""
+    global _model
+    if _model is None:
+        _model = genai_module().GenerativeModel(MODEL_NAME)
+    return _model
 
 def get_tweet_texts(csv_filename):
     """
-    Reads the CSV file and returns a list of tuples containing (id, tweet_text)
+    Reads the cleaned tweets file (CSV or Parquet) and returns a list of tuples
+    containing (id, tweet_text)
     """
+    if csv_filename.endswith('.parquet'):
+        df = read_table('cleaned_tweets', columns=['Tweet_count', 'Text'])
+        tweets = list(zip(df['Tweet_count'].astype(str), df['Text'].astype(str)))
+        print(f"Loaded {len(tweets)} tweets from Parquet")
+        return tweets
+    
     tweets = []
     with open(csv_filename, 'r', encoding='utf-8') as file:
         csv_reader = csv.reader(file)
@@ -45,51 +89,132 @@ def get_tweet_texts(csv_filename):
     print(f"Loaded {len(tweets)} tweets from CSV")
     return tweets
 
-def get_insights_from_gemini(tweet_id, tweet_text):
+def build_batch_prompt(batch):
     """
-    Sends a single tweet to Google Gemini AI to analyze and generate sentiment insights.
-    Uses Gemini-1.5-flash model for fast and accurate sentiment classification.
+    Builds a single prompt asking Gemini to score every (id, tweet_text) pair in the batch.
     """
-    print(f"\nAnalyzing tweet {tweet_id}:")
-    # Remove emojis and clean text for display
-    clean_text = remove_emojis(tweet_text)
-    print(f"Tweet text: {clean_text[:100]}...")  # Print first 100 chars of cleaned tweet
-    
-    # Prepare prompt (input) with the tweet data
-    prompt = f"""
-You are a sentiment analysis assistant. Your task is to evaluate a tweet about food prices and classify it on a satisfaction scale where:
-    
+    tweet_lines = "\n".join(
+        json.dumps({"id": str(tweet_id), "text": tweet_text}, ensure_ascii=False)
+        for tweet_id, tweet_text in batch
+    )
+    return f"""
+You are a sentiment analysis assistant. Your task is to evaluate tweets about food prices and classify each one on a satisfaction scale where:
+
 1 = Very unsatisfied (strong anger, frustration, or outrage about food prices)
 2 = Unsatisfied (disappointment or complaints about food prices)
 3 = Neutral (observational, balanced or mixed feelings about food prices)
 4 = Satisfied (approval or mild praise, noting price improvements)
 5 = Very satisfied (enthusiastic approval or strong praise regarding affordability)
 
-Analyze the following tweet and return: - 1. the stance score along - 2. a brief explanation for your classification
+You will receive {len(batch)} tweets, one JSON object per line. For every tweet return: - 1. the stance score along - 2. a brief explanation for your classification
 
-Your output should be in the following JSON format:
+Your output must be a single JSON array with exactly one object per tweet, using the tweet's id unchanged:
 
-{{
-  "id": "{tweet_id}",
-  "stance_score": 3,
-  "explanation": "brief rationale"
-}}
+[
+  {{
+    "id": "<tweet id>",
+    "stance_score": 3,
+    "explanation": "brief rationale"
+  }}
+]
 
-Here is the tweet: {tweet_text}
+Here are the tweets:
+{tweet_lines}
     """
-    
+
+def build_compact_prompt(batch):
+    """
+    Compact-mode prompt: just the tweets, one minimal JSON object per line
+    (the rubric lives in the model's system instruction)
+    """
+    return "\n".join(
+        json.dumps({"id": str(tweet_id), "text": tweet_text}, ensure_ascii=False, separators=(',', ':'))
+        for tweet_id, tweet_text in batch
+    )
+
+def system_instruction(explanations=True):
+    """System instruction for compact mode"""
+    if explanations:
+        return SCORING_RUBRIC + " Give its stance_score and a brief explanation (at most 15 words)."
+    return SCORING_RUBRIC + " Give only its stance_score."
+
+def response_schema(explanations=True):
+    """JSON schema the compact-mode answer must follow"""
+    properties = {"id": {"type": "string"}, "stance_score": {"type": "integer"}}
+    if explanations:
+        properties["explanation"] = {"type": "string"}
+    return {
+        "type": "array",
+        "items": {"type": "object", "properties": properties, "required": list(properties)}
+    }
+
+def prompt_version(compact, explanations=True):
+    """Identifies the prompt template in cache keys, so modes never share cached answers"""
+    if not compact:
+        return PROMPT_VERSION
+    return f"compact-{COMPACT_PROMPT_VERSION}" + ("" if explanations else "-scores")
+
+def validate_result(item, expected_ids):
+    """
+    Returns a normalized result dict if the item is a well-formed analysis for one of
+    the expected ids, otherwise None.
+    """
+    if not isinstance(item, dict):
+        return None
+
+    tweet_id = str(item.get('id', '')).strip()
+    if tweet_id not in expected_ids:
+        return None
+
     try:
-        response = model.generate_content(prompt)
-        result = response.text
-        print(f"Gemini Response: {result}")
-        return result
-    except Exception as e:
-        print(f"Error calling Gemini API: {str(e)}")
+        score = int(item.get('stance_score'))
+    except (TypeError, ValueError):
         return None
+    if not 1 <= score <= 5:
+        return None
+
+    return {
+        'id': tweet_id,
+        'stance_score': score,
+        'explanation': str(item.get('explanation', ''))
+    }
+
+def parse_batch_response(response, expected_ids):
+    """
+    Parses a batch response into validated results.
+    Returns (results, missing_ids) where missing_ids are the expected ids that did not
+    come back or came back malformed.
+    """
+    expected_ids = {str(tweet_id) for tweet_id in expected_ids}
+    results = {}
 
-def clean_json_response(response):
+    data = []
+    if response:
+        try:
+            # Structured output (compact mode) is plain JSON
+            data = json.loads(response)
+        except json.JSONDecodeError:
+            cleaned = clean_json_response(response, array=True)
+            try:
+                data = json.loads(cleaned) if cleaned else []
+            except json.JSONDecodeError as e:
+                print(f"Error parsing batch JSON: {str(e)}")
+
+    if isinstance(data, dict):
+        data = [data]
+    if isinstance(data, list):
+        for item in data:
+            result = validate_result(item, expected_ids)
+            if result and result['id'] not in results:
+                results[result['id']] = result
+
+    missing_ids = expected_ids - set(results)
+    return list(results.values()), missing_ids
+
+def clean_json_response(response, array=False):
     """
-    Cleans the Gemini response by removing markdown formatting
+    Cleans the Gemini response by removing markdown formatting.
+    With array=True the outermost JSON array is extracted instead of an object.
     """
     if not response:
         return None
@@ -106,157 +231,630 @@ def clean_json_response(response):
     # Remove any leading/trailing whitespace and newlines
     response = response.strip()
     
-    # Find the JSON object within the response
-    start_idx = response.find('{')
-    end_idx = response.rfind('}')
+    # Find the JSON object (or array) within the response
+    open_char, close_char = ('[', ']') if array else ('{', '}')
+    start_idx = response.find(open_char)
+    end_idx = response.rfind(close_char)
     
     if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
         response = response[start_idx:end_idx+1]
     
     return response
 
-def save_to_json(analysis_result, json_filename='gpt_analysis.json'):
+def save_result(result, result_log):
     """
-    Saves the GPT-4 analysis results to a JSON file
+    Appends one parsed analysis result to the result log (constant cost per tweet)
     """
-    if not analysis_result:
-        print("No analysis result to save")
-        return False
-        
     try:
-        # Clean the response before parsing
-        cleaned_result = clean_json_response(analysis_result)
-        if not cleaned_result:
-            print("Failed to clean JSON response")
-            return False
-            
-        # Parse the JSON result
-        result = json.loads(cleaned_result)
-        print(f"Parsed JSON result: {result}")
-        
-        # Read existing JSON file if it exists
-        if os.path.exists(json_filename):
-            with open(json_filename, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-            print(f"Existing JSON data length: {len(data)}")
-        else:
-            data = []
-            print("No existing JSON file found, creating new one")
-        
-        # Add new result
-        data.append(result)
-        
-        # Write back to JSON file
-        with open(json_filename, 'w', encoding='utf-8') as file:
-            json.dump(data, file, indent=2)
-            
-        print(f"Successfully saved analysis for tweet {result['id']} to {json_filename}")
+        result_log.append(result)
         return True
-        
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON: {cleaned_result}")
-        print(f"JSONDecodeError details: {str(e)}")
-        return False
     except Exception as e:
-        print(f"Error saving to {json_filename}: {str(e)}")
-        print(f"Analysis result that caused error: {analysis_result}")
+        print(f"Error saving to {result_log.path}: {str(e)}")
+        print(f"Analysis result that caused error: {result}")
         return False
 
-def convert_json_to_csv(json_filename='gpt_analysis.json', csv_filename='03_sentiment_labels.csv'):
+def iter_labels(json_filename=FILE_PATHS["raw_json"]):
+    """
+    Streams (id, score, explanation) label records from the result log.
+    Only the first record for each tweet id is kept.
+    """
+    seen_ids = set()
+    for item in read_results(json_filename):
+        tweet_id = str(item.get('id', ''))
+        if tweet_id in seen_ids:
+            continue
+        seen_ids.add(tweet_id)
+        yield {
+            'id': tweet_id,
+            'score': item.get('stance_score', ''),
+            'explanation': item.get('explanation', '')
+        }
+
+def convert_json_to_csv(json_filename=FILE_PATHS["raw_json"], csv_filename=FILE_PATHS["sentiment_labels"]):
     """
-    Converts the JSON analysis results to CSV format
+    Streams the JSONL result log into the CSV format used by the later steps.
     """
+    if not os.path.exists(json_filename):
+        print(f"Result log {json_filename} not found")
+        return False
+    
     try:
-        # Read JSON file
-        with open(json_filename, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        
-        if not data:
-            print(f"No data found in {json_filename}")
-            return False
-            
-        # Write to CSV
+        row_count = 0
         with open(csv_filename, 'w', newline='', encoding='utf-8') as file:
             writer = csv.writer(file)
             writer.writerow(['id', 'score', 'explanation'])  # Write header
             
-            for item in data:
-                writer.writerow([
-                    item.get('id', ''),
-                    item.get('stance_score', ''),
-                    item.get('explanation', '')
-                ])
+            for label in iter_labels(json_filename):
+                writer.writerow([label['id'], label['score'], label['explanation']])
+                row_count += 1
+        
+        if not row_count:
+            print(f"No data found in {json_filename}")
+            return False
         
         print(f"Successfully converted {json_filename} to {csv_filename}")
         return True
         
-    except FileNotFoundError:
-        print(f"JSON file {json_filename} not found")
-        return False
     except Exception as e:
-        print(f"Error converting JSON to CSV: {str(e)}")
+        print(f"Error converting results to CSV: {str(e)}")
         return False
 
+def export_labels(json_filename=FILE_PATHS["raw_json"]):
+    """Writes the sentiment labels artifact in the configured storage format"""
+    if not use_parquet():
+        return convert_json_to_csv(json_filename)
+    
+    with TableWriter('sentiment_labels', ['id', 'score', 'explanation']) as writer:
+        for label in iter_labels(json_filename):
+            writer.write_row([label['id'], label['score'], label['explanation']])
+    print(f"Successfully converted {json_filename} to {artifact_path('sentiment_labels')}")
+    return True
+
+def is_rate_limit_error(error):
+    """True if the exception is Gemini telling us we exceeded our quota (HTTP 429)"""
+    from google.api_core import exceptions as google_exceptions
+    return isinstance(error, google_exceptions.ResourceExhausted) or '429' in str(error)
+
+class TokenUsage:
+    """Request and token totals of a run, taken from each response's usage_metadata"""
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+    def add(self, response):
+        self.requests += 1
+        metadata = getattr(response, 'usage_metadata', None)
+        if metadata:
+            self.prompt_tokens += getattr(metadata, 'prompt_token_count', 0) or 0
+            self.output_tokens += getattr(metadata, 'candidates_token_count', 0) or 0
+
+    def as_dict(self):
+        return {'requests': self.requests, 'prompt_tokens': self.prompt_tokens, 'output_tokens': self.output_tokens}
+
+    def summary(self, tweet_count):
+        text = f"{self.prompt_tokens} input / {self.output_tokens} output tokens over {self.requests} requests"
+        if tweet_count:
+            text += (f" ({self.prompt_tokens * 1000 / tweet_count:.0f} input / "
+                     f"{self.output_tokens * 1000 / tweet_count:.0f} output per 1k tweets)")
+        return text
+
+async def analyze_concurrent(tweets, model, limiter, batch_size=1, concurrency=1, pbar=None, on_result=None,
+                             max_queued=0, compact=None, usage=None):
+    """
+    Scores tweets with up to `concurrency` Gemini requests in flight, each carrying up to
+    `batch_size` tweets and paced by `limiter`.
+    `tweets` may be a list or an async iterator of (id, text) pairs; with an iterator,
+    scoring starts as soon as the first tweet arrives and at most `max_queued` tweets
+    (0 = unbounded) are buffered ahead of the workers.
+    Ids that are missing/malformed in a response, or whose request failed, are re-queued
+    after an exponential backoff with jitter until they have been tried max_retries extra
+    times; 429s additionally pause every worker.
+    on_result is called with every successful analysis as soon as it arrives.
+    compact selects the compact prompt (the model must then be a create_model(compact=True)
+    model); token counts of every response are added to `usage` (a TokenUsage) if given.
+    Results are not kept (callers get every one through on_result), so memory stays
+    bounded however many tweets stream through.
+    Returns (number of successful analyses, failed_ids).
+    """
+    max_retries = ANALYSIS_CONFIG["max_retries"]
+    compact = ANALYSIS_CONFIG["compact_prompt"] if compact is None else compact
+    build_prompt = build_compact_prompt if compact else build_batch_prompt
+    queue = asyncio.Queue(maxsize=max_queued)
+
+    success_count = 0
+    failed_ids = set()
+
+    async def feed():
+        if hasattr(tweets, '__aiter__'):
+            async for tweet_id, tweet_text in tweets:
+                await queue.put((str(tweet_id), tweet_text, 0))
+        else:
+            for tweet_id, tweet_text in tweets:
+                await queue.put((str(tweet_id), tweet_text, 0))
+
+    async def requeue(item, delay):
+        await asyncio.sleep(delay)
+        await queue.put(item)
+        # Only now release the old item, so queue.join() can't finish while a retry is pending
+        queue.task_done()
+
+    def finish(item, ok):
+        """Records the outcome of one queue item, re-queueing it if it may be retried"""
+        tweet_id, tweet_text, attempts = item
+        if not ok and attempts < max_retries:
+            metrics.count('gemini_retries')
+            task = asyncio.create_task(requeue((tweet_id, tweet_text, attempts + 1), backoff_delay(attempts)))
+            retries.add(task)
+            task.add_done_callback(retries.discard)
+            return
+        if not ok:
+            print(f"Giving up on tweet {tweet_id} after {attempts + 1} attempts")
+            failed_ids.add(tweet_id)
+        if pbar:
+            pbar.update(1)
+        queue.task_done()
+
+    async def score_batch(batch, finished):
+        prompt = build_prompt([(tweet_id, text) for tweet_id, text, _ in batch])
+        await limiter.acquire(estimate_tokens(prompt))
+        metrics.count('gemini_requests')
+        try:
+            with metrics.timer('generate_content'):
+                response = await model.generate_content_async(prompt)
+            if usage is not None:
+                usage.add(response)
+            response_text = response.text
+        except Exception as e:
+            if is_rate_limit_error(e):
+                metrics.count('gemini_rate_limited')
+                attempt = max(attempts for _, _, attempts in batch)
+                limiter.penalize(backoff_delay(attempt, base=2.0))
+                print(f"Rate limited by Gemini API, backing off: {str(e)}")
+            else:
+                metrics.count('gemini_errors')
+                print(f"Error calling Gemini API: {str(e)}")
+            response_text = None
+
+        batch_results, missing_ids = parse_batch_response(response_text, [tweet_id for tweet_id, _, _ in batch])
+        nonlocal success_count
+        for result in batch_results:
+            success_count += 1
+            if on_result:
+                on_result(result)
+
+        for item in batch:
+            finished.add(item[0])
+            finish(item, item[0] not in missing_ids)
+
+    async def worker():
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            # Every item taken from the queue must be finished, or queue.join() never returns
+            finished = set()
+            try:
+                await score_batch(batch, finished)
+            except Exception as e:
+                metrics.count('batch_errors')
+                print(f"Error processing batch: {type(e).__name__}: {str(e)}")
+                for item in batch:
+                    if item[0] not in finished:
+                        finish(item, False)
+            if pbar:
+                pbar.set_postfix({"Success": success_count, "Failed": len(failed_ids), "Queued": queue.qsize()})
+
+    async def drain():
+        # Everything must be queued before join() can tell that all work is done
+        await feed()
+        await queue.join()
+
+    retries = set()
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+    done_task = asyncio.create_task(drain())
+    try:
+        # A worker only stops on an error finish() could not absorb: raise it instead of waiting forever
+        await asyncio.wait([done_task] + workers, return_when=asyncio.FIRST_COMPLETED)
+        if not done_task.done():
+            for task in workers:
+                if task.done():
+                    task.result()
+        await done_task
+    finally:
+        for task in [done_task] + workers + list(retries):
+            task.cancel()
+        await asyncio.gather(done_task, *workers, *retries, return_exceptions=True)
+
+    return success_count, failed_ids
+
+def create_model(fake_model=False, compact=None, explanations=None):
+    """
+    The Gemini model, or a local fake with the same interface for offline runs
+    (fake_model may be a dict of FakeGenerativeModel options such as latency,
+    error_rate, requests_per_minute and seed).
+    In compact mode the model carries the rubric as system instruction and answers
+    in JSON following response_schema (defaults from ANALYSIS_CONFIG).
+    """
+    compact = ANALYSIS_CONFIG["compact_prompt"] if compact is None else compact
+    explanations = ANALYSIS_CONFIG["explanations"] if explanations is None else explanations
+    if fake_model:
+        from fakes import FakeGenerativeModel
+        options = fake_model if isinstance(fake_model, dict) else {}
+        if not compact:
+            return FakeGenerativeModel(**options)
+        return FakeGenerativeModel(system_instruction=system_instruction(explanations), explanations=explanations,
+                                   **options)
+    if not compact:
+        return get_model()
+    genai = genai_module()
+    return genai.GenerativeModel(
+        MODEL_NAME,
+        system_instruction=system_instruction(explanations),
+        generation_config=genai.GenerationConfig(
+            response_mime_type='application/json',
+            response_schema=response_schema(explanations)
+        )
+    )
+
+def create_limiter(requests_per_minute=None, tokens_per_minute=None):
+    """Rate limiter configured from the Gemini quota in ANALYSIS_CONFIG (tokens_per_minute=0: no token limit)"""
+    tokens_per_minute = ANALYSIS_CONFIG["tokens_per_minute"] if tokens_per_minute is None else tokens_per_minute
+    return RateLimiter(requests_per_minute or ANALYSIS_CONFIG["requests_per_minute"], tokens_per_minute)
+
+def load_completed_ids(json_filename=FILE_PATHS["raw_json"]):
+    """Returns the ids that already have a result in the result log"""
+    return {str(record['id']) for record in read_results(json_filename) if 'id' in record}
+
+def save_checkpoint(checkpoint, checkpoint_file=FILE_PATHS["checkpoint"]):
+    """Atomically writes the run's progress manifest"""
+    checkpoint['updated_at'] = datetime.now().isoformat(timespec='seconds')
+    temp_file = checkpoint_file + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        json.dump(checkpoint, file, indent=2)
+    os.replace(temp_file, checkpoint_file)
+
+def plan_with_cache(tweets, cache, model_name, version=PROMPT_VERSION, near_duplicates=False):
+    """
+    Splits tweets into the ones that still need scoring and the ones that can be answered
+    locally. Returns (pending, cached, duplicates, keys):
+      pending    - (id, text) pairs to send to Gemini, one per distinct text
+                   (one per near-duplicate cluster with near_duplicates=True)
+      cached     - results served from the persistent cache
+      duplicates - id of the scored copy -> ids of identical tweets in this run
+      keys       - id -> cache key, for storing new results
+    """
+    pending, cached, keys = [], [], {}
+    duplicates = {}
+    first_id_for_key = {}
+    
+    representative_of = {}
+    if near_duplicates:
+        for representative, members in group_near_duplicates(tweets).items():
+            for member in members:
+                representative_of[member] = representative
+    
+    for tweet_id, tweet_text in tweets:
+        tweet_id = str(tweet_id)
+        key = make_cache_key(model_name, version, tweet_text)
+        keys[tweet_id] = key
+        
+        # Near-duplicates (quote variants, copy-paste campaigns) take their cluster's label
+        if tweet_id in representative_of:
+            duplicates[representative_of[tweet_id]].append(tweet_id)
+            continue
+        
+        # Retweets / reposted text within this run share one request
+        if key in first_id_for_key:
+            duplicates[first_id_for_key[key]].append(tweet_id)
+            continue
+        first_id_for_key[key] = tweet_id
+        duplicates[tweet_id] = []
+        
+        hit = cache.get(key) if cache is not None else None
+        if hit:
+            cached.append(dict(hit, id=tweet_id))
+        else:
+            pending.append((tweet_id, tweet_text))
+    
+    return pending, cached, duplicates, keys
+
+def load_labeled_tweets(tweets, json_filename=FILE_PATHS["raw_json"]):
+    """
+    Pairs (id, text) tweets with their Gemini score from the result log, leaving out
+    tweets without a label and labels produced by the local tier.
+    Returns (texts, scores).
+    """
+    gemini_scores = {
+        label['id']: label['score'] for label in iter_labels(json_filename)
+        if not str(label['explanation']).startswith(LOCAL_EXPLANATION_PREFIX)
+    }
+    texts, scores = [], []
+    for tweet_id, text in tweets:
+        if str(tweet_id) in gemini_scores:
+            texts.append(text)
+            scores.append(int(gemini_scores[str(tweet_id)]))
+    return texts, scores
+
+def train_local_model(tweets):
+    """
+    Trains the sklearn local scorer on the Gemini labels collected so far, reports its
+    agreement with Gemini on a held-out fifth of them and saves it. Returns 0 or 1.
+    """
+    texts, scores = load_labeled_tweets(tweets)
+    if len(set(scores)) < 2:
+        print("Not enough Gemini labels to train a local model yet (run the analysis first)")
+        return 1
+    train = [i for i in range(len(texts)) if i % 5]
+    held_out = [i for i in range(len(texts)) if not i % 5]
+    scorer = SklearnScorer().train([texts[i] for i in train], [scores[i] for i in train])
+    report_agreement(scorer, [texts[i] for i in held_out], [scores[i] for i in held_out])
+    scorer.save()
+    print(f"💾 Local model saved to {FILE_PATHS['local_model']} ({len(train)} training tweets)")
+    return 0
+
+def report_agreement(scorer, texts, scores):
+    """Prints how well a local scorer agrees with the Gemini labels of the same tweets"""
+    agreement = evaluate(scorer, texts, scores)
+    threshold = LOCAL_SCORER_CONFIG["confidence_threshold"]
+    print(f"\n🏠 Local {scorer.name} scorer vs. Gemini:")
+    print(f"  All tweets:       {format_metrics(agreement['all'])}")
+    print(f"  Confident tweets: {format_metrics(agreement['confident'])}")
+    print(f"  {agreement['coverage']:.0%} of tweets would skip Gemini at confidence >= {threshold}")
+    return agreement
+
+def score_tweets(tweets, input_file='', batch_size=ANALYSIS_CONFIG["batch_size"],
+                 concurrency=ANALYSIS_CONFIG["concurrency"], fake_model=False, use_cache=True, resume=False,
+                 compact=None, explanations=None, local_filter=None, near_duplicates=None,
+                 requests_per_minute=None, tokens_per_minute=None, limiter=None):
+    """
+    Scores (id, text) pairs into the result log, using the cache, the checkpoint manifest
+    and the concurrent engine. With resume=True ids already in the log are skipped.
+    compact / explanations choose the prompt mode (defaults from ANALYSIS_CONFIG).
+    With local_filter (default LOCAL_SCORER_CONFIG["enabled"]) tweets the local scorer
+    is confident about are labelled without calling Gemini.
+    With near_duplicates (default DEDUP_CONFIG["enabled"]) only one tweet per cluster
+    of near-identical texts is scored and its label is copied to the others.
+    requests_per_minute / tokens_per_minute override the Gemini quota (e.g. for a fake model);
+    a limiter passed in (e.g. a SharedRateLimiter of a multi-dataset run) replaces it.
+    Returns (success_count, failed_ids) for this run.
+    """
+    near_duplicates = DEDUP_CONFIG["enabled"] if near_duplicates is None else near_duplicates
+    local_filter = LOCAL_SCORER_CONFIG["enabled"] if local_filter is None else local_filter
+    compact = ANALYSIS_CONFIG["compact_prompt"] if compact is None else compact
+    explanations = ANALYSIS_CONFIG["explanations"] if explanations is None else explanations
+    version = prompt_version(compact, explanations)
+    total_tweets = len(tweets)
+    
+    if resume:
+        completed_ids = load_completed_ids()
+        tweets = [(tweet_id, text) for tweet_id, text in tweets if str(tweet_id) not in completed_ids]
+        print(f"⏯️  Resuming: {total_tweets - len(tweets)} tweets already scored, {len(tweets)} remaining")
+    
+    # Start a fresh result log (overwrite if exists) unless resuming
+    result_log = ResultLog(FILE_PATHS["raw_json"], fsync_every=ANALYSIS_CONFIG["fsync_every"], truncate=not resume)
+    
+    checkpoint = {
+        'input_file': input_file,
+        'model': 'fake' if fake_model else MODEL_NAME,
+        'prompt_version': version,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'status': 'running',
+        'total_tweets': total_tweets,
+        'already_scored': total_tweets - len(tweets),
+        'scored_this_run': 0,
+        'failed_ids': []
+    }
+    save_checkpoint(checkpoint)
+    
+    print(f"\n🤖 Starting Gemini AI analysis...")
+    print(f"📦 {batch_size} tweets per request, up to {concurrency} requests in flight")
+    print(f"📝 {'Compact' if compact else 'Full'} prompt, {'with' if explanations else 'without'} explanations")
+    
+    scoring_model = create_model(fake_model, compact=compact, explanations=explanations)
+    model_name = 'fake' if fake_model else MODEL_NAME
+    limiter = limiter or create_limiter(requests_per_minute, tokens_per_minute)
+    
+    cache = None
+    if CACHE_CONFIG["enabled"] and use_cache:
+        cache = ResponseCache(
+            FILE_PATHS["response_cache"],
+            max_entries=CACHE_CONFIG["max_entries"],
+            max_age_days=CACHE_CONFIG["max_age_days"]
+        )
+    
+    pending, cached, duplicates, keys = plan_with_cache(tweets, cache, model_name, version, near_duplicates)
+    print(f"♻️  {len(cached)} served from cache, {len(tweets) - len(pending) - len(cached)} "
+          f"{'(near-)' if near_duplicates else ''}duplicates in this run, {len(pending)} to send to Gemini")
+    
+    local_results = []
+    if local_filter:
+        scorer = load_scorer()
+        local_results, pending = split_confident(scorer, pending)
+        checkpoint['scored_locally'] = len(local_results)
+        print(f"🏠 {len(local_results)} scored locally ({scorer.name} scorer), {len(pending)} left for Gemini")
+    
+    success_count = 0
+    
+    def record(result, from_cache=False):
+        """Saves a result for its tweet and every identical copy of it"""
+        nonlocal success_count
+        if cache is not None and not from_cache:
+            cache.put(keys[result['id']], {
+                'stance_score': result['stance_score'],
+                'explanation': result['explanation']
+            })
+        for tweet_id in [result['id']] + duplicates.get(result['id'], []):
+            if save_result(dict(result, id=tweet_id), result_log):
+                success_count += 1
+        
+        # Persist progress every time the log is flushed to disk
+        if result_log.pending == 0:
+            checkpoint['scored_this_run'] = success_count
+            save_checkpoint(checkpoint)
+    
+    for result in cached:
+        record(result, from_cache=True)
+    # Local labels are recorded like cached ones: they must not enter the Gemini response cache
+    for result in local_results:
+        record(result, from_cache=True)
+    
+    usage = TokenUsage()
+    
+    # Create progress bar
+    from tqdm import tqdm
+    with tqdm(total=len(pending), desc="Analyzing tweets", unit="tweet") as pbar:
+        _, failed_ids = asyncio.run(analyze_concurrent(
+            pending, scoring_model, limiter,
+            batch_size=max(1, batch_size),
+            concurrency=concurrency,
+            pbar=pbar,
+            on_result=record,
+            compact=compact,
+            usage=usage
+        ))
+    
+    result_log.close()
+    
+    checkpoint.update({
+        'status': 'completed' if not failed_ids else 'incomplete',
+        'scored_this_run': success_count,
+        'failed_ids': sorted(failed_ids),
+        'usage': usage.as_dict()
+    })
+    save_checkpoint(checkpoint)
+    
+    metrics.rows(rows_in=total_tweets, rows_out=success_count)
+    metrics.count('duplicates', len(tweets) - len(pending) - len(cached) - len(local_results))
+    metrics.count('scored_locally', len(local_results))
+    metrics.count('failed', len(failed_ids))
+    metrics.count('prompt_tokens', usage.prompt_tokens)
+    metrics.count('output_tokens', usage.output_tokens)
+    
+    print(f"\nSummary: Successfully analyzed {success_count} out of {len(tweets)} tweets")
+    if failed_ids:
+        print(f"⚠️  {len(failed_ids)} tweets failed; run again with --resume to retry only those")
+    print(f"🔢 Tokens: {usage.summary(success_count)}")
+    if cache is not None:
+        stats = cache.stats()
+        metrics.count('cache_hits', stats['hits'])
+        metrics.count('cache_misses', stats['misses'])
+        print(f"Cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries")
+        cache.close()
+    
+    return success_count, failed_ids
+
+def fake_options(args):
+    """FakeGenerativeModel options given on the command line ({} if none)"""
+    options = {
+        'latency': args.fake_latency,
+        'error_rate': args.fake_error_rate,
+        'requests_per_minute': args.fake_rpm,
+        'seed': args.fake_seed,
+    }
+    return {name: value for name, value in options.items() if value is not None}
+
 def main():
+    parser = argparse.ArgumentParser(description='Analyze tweet sentiment with Gemini AI')
+    parser.add_argument('--batch-size', type=int, default=ANALYSIS_CONFIG["batch_size"],
+                        help='Tweets sent per Gemini request (1 = one request per tweet)')
+    parser.add_argument('--concurrency', type=int, default=ANALYSIS_CONFIG["concurrency"],
+                        help='Maximum number of Gemini requests in flight')
+    parser.add_argument('--fake-model', action='store_true',
+                        help='Use a local fake Gemini model (no API calls) for offline runs')
+    parser.add_argument('--fake-latency', type=float, default=None,
+                        help='Seconds the fake model takes per request (implies --fake-model)')
+    parser.add_argument('--fake-error-rate', type=float, default=None,
+                        help='Fraction of fake model requests answered with a 429 (implies --fake-model)')
+    parser.add_argument('--fake-rpm', type=int, default=None,
+                        help='Requests per minute the fake model accepts before answering 429 (implies --fake-model)')
+    parser.add_argument('--fake-seed', type=int, default=None,
+                        help='Random seed of the fake model, for reproducible scores (implies --fake-model)')
+    parser.add_argument('--requests-per-minute', type=float, default=None,
+                        help='Override the Gemini request quota (ANALYSIS_CONFIG["requests_per_minute"])')
+    parser.add_argument('--tokens-per-minute', type=int, default=None,
+                        help='Override the Gemini token quota (ANALYSIS_CONFIG["tokens_per_minute"]; 0 = no limit)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Ignore the response cache and re-score every tweet')
+    parser.add_argument('--resume', action='store_true',
+                        help='Keep the existing result log and only score tweets it does not contain yet')
+    parser.add_argument('--full-prompt', action='store_true',
+                        help='Repeat the full rubric in every prompt instead of the compact system-instruction mode')
+    parser.add_argument('--no-explanations', action='store_true',
+                        help='Only ask for scores (fewer output tokens; the explanation column stays empty)')
+    parser.add_argument('--no-dedup', action='store_true',
+                        help='Score near-duplicate tweets individually instead of once per cluster')
+    parser.add_argument('--local-filter', action='store_true',
+                        help='Label tweets the local scorer is confident about without calling Gemini')
+    parser.add_argument('--train-local-model', action='store_true',
+                        help='Train the sklearn local scorer on the Gemini labels collected so far and exit')
+    parser.add_argument('--evaluate-local', action='store_true',
+                        help="Report the local scorer's agreement with the existing Gemini labels and exit")
+    args = parser.parse_args()
+
     # Find the most recent cleaned tweets file
-    cleaned_files = glob.glob('02_cleaned_tweets.csv')
-    if not cleaned_files:
+    if not artifact_exists('cleaned_tweets'):
         print("No cleaned tweets file found. Please run the cleaning step first.")
         return 1
     
-    input_file = cleaned_files[0]  # There should only be one
-    output_file = '03_sentiment_labels.csv'
+    input_file = artifact_path('cleaned_tweets')
+    output_file = artifact_path('sentiment_labels')
     
     print(f"📊 Using dataset: {input_file}")
     print(f"💾 Output will be saved to: {output_file}")
     
     print(f"Processing {input_file}...")
     
-    # Initialize empty JSON file (overwrite if exists)
-    with open('gpt_analysis.json', 'w', encoding='utf-8') as file:
-        json.dump([], file)
-    
-    # Clear the output CSV file
-    with open(output_file, 'w', newline='', encoding='utf-8') as file:
-        writer = csv.writer(file)
-        writer.writerow(['id', 'score', 'explanation'])  # Write header
-    
     # Read tweets from the CSV file
     tweets = get_tweet_texts(input_file)
     print(f"\nTotal tweets to process: {len(tweets)}")
     
-    # Process tweets one by one with progress bar
-    success_count = 0
-    print(f"\n🤖 Starting Gemini AI analysis...")
+    try:
+        if args.train_local_model:
+            return train_local_model(tweets)
+        if args.evaluate_local:
+            texts, scores = load_labeled_tweets(tweets)
+            if not texts:
+                print("No Gemini labels to compare with yet (run the analysis first)")
+                return 1
+            report_agreement(load_scorer(), texts, scores)
+            return 0
+    except (ImportError, FileNotFoundError) as e:
+        print(f"Error: {str(e)}")
+        return 1
     
-    # Create progress bar
-    with tqdm(total=len(tweets), desc="Analyzing tweets", unit="tweet") as pbar:
-        for i, (tweet_id, tweet_text) in enumerate(tweets, 1):
-            pbar.set_description(f"Analyzing tweet {tweet_id}")
-            
-            analysis = get_insights_from_gemini(tweet_id, tweet_text)
-            if analysis and save_to_json(analysis):
-                success_count += 1
-                pbar.set_postfix({"Success": success_count, "Failed": i - success_count})
-            else:
-                pbar.set_postfix({"Success": success_count, "Failed": i - success_count})
-            
-            pbar.update(1)
-            
-            # Add delay to avoid rate limiting (4 seconds between requests)
-            if i < len(tweets):  # Don't delay after the last tweet
-                pbar.set_description("Waiting for rate limit...")
-                time.sleep(4)
+    if not args.resume and not use_parquet():
+        # Clear the output CSV file
+        with open(output_file, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(['id', 'score', 'explanation'])  # Write header
     
-    print(f"\nSummary: Successfully analyzed {success_count} out of {len(tweets)} tweets")
+    success_count, failed_ids = score_tweets(
+        tweets,
+        input_file=input_file,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        fake_model=fake_options(args) or args.fake_model,
+        use_cache=not args.no_cache,
+        resume=args.resume,
+        compact=False if args.full_prompt else None,
+        explanations=False if args.no_explanations else None,
+        local_filter=True if args.local_filter else None,
+        near_duplicates=False if args.no_dedup else None,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute
+    )
     
-    # Convert JSON to CSV at the end
-    if success_count > 0:
-        convert_json_to_csv()
+    # Convert the result log to the labels file at the end
+    if success_count > 0 or args.resume:
+        export_labels()
     else:
         print("No successful analyses to convert to CSV")
     
     return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    exit(metrics.run_stage('analyze', main))
\ No newline at end of file
@@ -1,66 +1,323 @@
+import argparse
 import csv
-from datetime import datetime
-import glob
+from datetime import datetime, timezone
+from itertools import islice
 import os
+import sqlite3
+import tempfile
+import metrics
+from build import raw_tweets_file
+from config import FILE_PATHS
+from storage import TableWriter, artifact_exists, artifact_path, iter_records
 
-def create_analysis_file():
-    # Find the most recent sentiment labels file
-    sentiment_files = glob.glob('03_sentiment_labels.csv')
-    if not sentiment_files:
+TWITTER_DATE_FORMAT = '%a %b %d %H:%M:%S %z %Y'
+
+# Columns of the analysis artifact (one row per scored tweet)
+ANALYSIS_COLUMNS = ['id', 'score', 'date', 'username', 'retweets', 'likes']
+
+# Rollup buckets: every scored tweet is counted once per granularity (UTC)
+ROLLUP_GRANULARITIES = {
+    'minute': '%Y-%m-%dT%H:%M',
+    'hour': '%Y-%m-%dT%H:00',
+    'day': '%Y-%m-%d',
+}
+# Additive columns only, so rollups built from different batches of tweets can be summed
+ROLLUP_SUMS = ['count', 'score_sum', 'weighted_sum', 'weight_sum', 'n1', 'n2', 'n3', 'n4', 'n5']
+ROLLUP_COLUMNS = ['granularity', 'bucket'] + ROLLUP_SUMS + ['mean', 'weighted_mean']
+
+def parse_date(value):
+    """Parses a tweet's Created At value (Twitter or ISO format). Returns None if unparseable"""
+    value = str(value)
+    for parse in (lambda v: datetime.strptime(v, TWITTER_DATE_FORMAT), datetime.fromisoformat):
+        try:
+            return parse(value)
+        except ValueError:
+            continue
+    return None
+
+class RunningSentiment:
+    """
+    Incrementally maintained sentiment aggregates: overall and per-day count / mean
+    score, plus a histogram of scores. Memory grows with the number of days, not tweets.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.histogram = {score: 0 for score in range(1, 6)}
+        self.days = {}
+
+    def add(self, score, date):
+        score = int(score)
+        self.count += 1
+        self.total += score
+        self.histogram[score] = self.histogram.get(score, 0) + 1
+        
+        parsed = parse_date(date)
+        day = parsed.date().isoformat() if parsed else 'unknown'
+        day_count, day_total = self.days.get(day, (0, 0))
+        self.days[day] = (day_count + 1, day_total + score)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def summary(self):
+        if not self.count:
+            return "no scored tweets yet"
+        histogram = ' '.join(f"{score}:{n}" for score, n in sorted(self.histogram.items()))
+        return f"{self.count} tweets, mean score {self.mean:.2f} [{histogram}]"
+
+    def daily_rows(self):
+        """[day, count, mean score] rows in date order"""
+        return [
+            [day, count, round(total / count, 3)]
+            for day, (count, total) in sorted(self.days.items())
+        ]
+
+def to_int(value):
+    """Engagement counts as ints (missing or malformed values count as 0)"""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+def engagement_weight(retweets, likes):
+    """Weight of a tweet in the engagement-weighted mean; tweets nobody engaged with still count once"""
+    return 1 + to_int(retweets) + to_int(likes)
+
+class RollupStore:
+    """
+    Persistent per-minute/hour/day sentiment rollups in SQLite: count, score sum,
+    engagement-weighted sums and a 1-5 score histogram per bucket. The ids already
+    counted are remembered, so new scored tweets can be added to an existing store
+    without recounting (or double counting) the old ones.
+    """
+
+    def __init__(self, path=FILE_PATHS["rollup_store"], truncate=False):
+        if truncate and os.path.exists(path):
+            os.remove(path)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        sums = ', '.join(f"{column} INTEGER NOT NULL DEFAULT 0" for column in ROLLUP_SUMS)
+        self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS rollups (
+                granularity TEXT, bucket TEXT, {sums},
+                PRIMARY KEY (granularity, bucket)
+            )
+        """)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS counted (id TEXT PRIMARY KEY)")
+        self.conn.commit()
+        self.pending = {}
+        self.added = 0
+
+    def add(self, tweet_id, score, date, retweets=0, likes=0):
+        """
+        Counts one scored tweet. Returns False if its id was already counted or its
+        date does not parse (it is not marked as counted then, so it can be added later).
+        The id is committed together with its bucket sums by flush().
+        """
+        parsed = parse_date(date)
+        if parsed is None:
+            return False
+        if parsed.tzinfo:
+            parsed = parsed.astimezone(timezone.utc)
+        score = int(score)
+        weight = engagement_weight(retweets, likes)
+        cursor = self.conn.execute("INSERT OR IGNORE INTO counted (id) VALUES (?)", (str(tweet_id),))
+        if not cursor.rowcount:
+            return False
+        for granularity, bucket_format in ROLLUP_GRANULARITIES.items():
+            key = (granularity, parsed.strftime(bucket_format))
+            sums = self.pending.setdefault(key, [0] * len(ROLLUP_SUMS))
+            sums[0] += 1
+            sums[1] += score
+            sums[2] += score * weight
+            sums[3] += weight
+            sums[3 + score] += 1
+        self.added += 1
+        if len(self.pending) >= 10_000:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Adds the buffered bucket sums to the stored ones"""
+        updates = ', '.join(f"{column} = {column} + excluded.{column}" for column in ROLLUP_SUMS)
+        placeholders = ', '.join('?' * (2 + len(ROLLUP_SUMS)))
+        self.conn.executemany(f"""
+            INSERT INTO rollups (granularity, bucket, {', '.join(ROLLUP_SUMS)}) VALUES ({placeholders})
+            ON CONFLICT (granularity, bucket) DO UPDATE SET {updates}
+        """, [list(key) + sums for key, sums in self.pending.items()])
+        self.conn.commit()
+        self.pending = {}
+
+    def rows(self, granularity=None):
+        """Rollup rows (ROLLUP_COLUMNS) in bucket order, optionally for one granularity"""
+        self.flush()
+        query = f"SELECT granularity, bucket, {', '.join(ROLLUP_SUMS)} FROM rollups"
+        params = ()
+        if granularity:
+            query += " WHERE granularity = ?"
+            params = (granularity,)
+        for granularity_name, bucket, *sums in self.conn.execute(query + " ORDER BY granularity, bucket", params):
+            count, score_sum, weighted_sum, weight_sum = sums[:4]
+            yield ([granularity_name, bucket] + [int(value) for value in sums]
+                   + [round(score_sum / count, 4), round(weighted_sum / weight_sum, 4)])
+
+    def export(self):
+        """Writes the rollups artifact (small: one row per bucket and granularity)"""
+        with TableWriter('rollups', ROLLUP_COLUMNS) as writer:
+            writer.write_rows(self.rows())
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def join_sentiment(tweet_rows, sentiment_rows):
+    """
+    Joins raw tweet rows (dicts with Tweet_count / Created At / Username / Retweets /
+    Likes) with sentiment rows (dicts with id / score) on the tweet id.
+    Yields ANALYSIS_COLUMNS rows in tweet order.
+    """
+    tweets_data = {}
+    sentiment_data = {}
+    
+    for row in tweet_rows:
+        tweets_data[str(row['Tweet_count'])] = {
+            'date': row['Created At'],
+            'text': row.get('Text', ''),
+            'username': row.get('Username', ''),
+            'retweets': to_int(row.get('Retweets')),
+            'likes': to_int(row.get('Likes'))
+        }
+    
+    for row in sentiment_rows:
+        sentiment_data[str(row['id'])] = {
+            'score': row['score'],
+            'explanation': row.get('explanation', '')
+        }
+    
+    for tweet_id in tweets_data:
+        if tweet_id in sentiment_data:
+            tweet = tweets_data[tweet_id]
+            yield [
+                tweet_id,
+                sentiment_data[tweet_id]['score'],
+                tweet['date'],
+                tweet['username'],
+                tweet['retweets'],
+                tweet['likes']
+            ]
+
+def _insert_batches(conn, sql, rows, batch_size=50_000):
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        conn.executemany(sql, batch)
+
+def join_sentiment_on_disk(tweet_rows, sentiment_rows):
+    """
+    Same result as join_sentiment, but both sides are spilled to a temporary SQLite
+    database and joined there, so memory stays flat however large the inputs are.
+    Yields ANALYSIS_COLUMNS rows in tweet order.
+    """
+    fd, db_path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA temp_store=FILE")
+        # A duplicated tweet id keeps its first position but its last values, like a dict would
+        conn.execute("""
+            CREATE TABLE tweets (
+                id TEXT PRIMARY KEY, seq INTEGER, date TEXT, username TEXT, retweets INTEGER, likes INTEGER
+            )
+        """)
+        conn.execute("CREATE TABLE sentiment (id TEXT PRIMARY KEY, score TEXT)")
+        
+        _insert_batches(conn, """
+            INSERT INTO tweets (id, seq, date, username, retweets, likes) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET date = excluded.date, username = excluded.username,
+                retweets = excluded.retweets, likes = excluded.likes
+        """, ((str(row['Tweet_count']), seq, row['Created At'], row.get('Username', ''),
+               to_int(row.get('Retweets')), to_int(row.get('Likes')))
+              for seq, row in enumerate(tweet_rows)))
+        _insert_batches(conn, "INSERT OR REPLACE INTO sentiment (id, score) VALUES (?, ?)",
+                        ((str(row['id']), row['score']) for row in sentiment_rows))
+        conn.commit()
+        
+        cursor = conn.execute("""
+            SELECT tweets.id, sentiment.score, tweets.date, tweets.username, tweets.retweets, tweets.likes
+            FROM tweets JOIN sentiment ON sentiment.id = tweets.id
+            ORDER BY tweets.seq
+        """)
+        for row in cursor:
+            yield list(row)
+    finally:
+        conn.close()
+        os.remove(db_path)
+
+def counted_into(store, rows):
+    """Passes ANALYSIS_COLUMNS rows through unchanged, adding each one to the rollup store"""
+    count = 0
+    for row in rows:
+        store.add(row[0], row[1], row[2], row[4], row[5])
+        count += 1
+        yield row
+    metrics.add_rows(rows_out=count)
+
+def create_analysis_file(incremental=False, tweets_file=None):
+    """
+    Joins the raw tweets (tweets_file, default: the current raw tweets file) with their
+    sentiment labels into the analysis artifact and updates the time-bucketed rollups.
+    With incremental=True the existing rollup store is kept and only tweets it has not
+    counted yet are added.
+    """
+    # Find the sentiment labels file
+    if not artifact_exists('sentiment_labels'):
         print("No sentiment labels file found. Please run the sentiment analysis step first.")
         return 1
     
-    input_file = sentiment_files[0]  # There should only be one
-    output_file = '04_data_analysis.csv'
+    input_file = artifact_path('sentiment_labels')
+    output_file = artifact_path('analysis_results')
     
     print(f"Processing {input_file}...")
 
-    # Read data from both files
-    tweets_data = {}
-    sentiment_data = {}
-
-    # Read tweets
-    tweet_files = glob.glob('01_tweets_*.csv')
-    if not tweet_files:
+    # Find the raw tweets
+    tweets_file = raw_tweets_file(tweets_file)
+    if not tweets_file:
         print("No tweet files found. Please run the scraping step first.")
         return 1
     
-    tweets_file = max(tweet_files, key=os.path.getctime)
-    with open(tweets_file, 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            tweets_data[row['Tweet_count']] = {
-                'date': row['Created At'],
-                'text': row['Text']
-            }
-
-    # Read sentiment scores
-    with open(input_file, 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        # Print the header to debug
-        print("Columns in sentiment file:", reader.fieldnames)
-        for row in reader:
-            sentiment_data[row['id']] = {
-                'score': row['score'],  # Changed from stance_score to score
-                'explanation': row['explanation']
-            }
-
-    # Create the combined analysis file
-    with open(output_file, 'w', newline='', encoding='utf-8') as file:
-        writer = csv.writer(file)
-        writer.writerow(['id', 'score', 'date'])  # Write header
-        
-        # Combine data and write to new file
-        for tweet_id in tweets_data:
-            if tweet_id in sentiment_data:
-                writer.writerow([
-                    tweet_id,
-                    sentiment_data[tweet_id]['score'],
-                    tweets_data[tweet_id]['date']
-                ])
+    with open(tweets_file, 'r', encoding='utf-8') as tweets, \
+         TableWriter('analysis_results', ANALYSIS_COLUMNS) as writer, \
+         RollupStore(truncate=not incremental) as store:
+        # Create the combined analysis file, counting every row into the rollups on the way
+        rows = join_sentiment_on_disk(csv.DictReader(tweets), iter_records('sentiment_labels'))
+        writer.write_rows(counted_into(store, rows))
+        store.export()
+        added = store.added
 
     print(f"Analysis complete. Results saved to {output_file}")
+    print(f"Rollups: {added} tweets added, saved to {artifact_path('rollups')}")
     return 0
 
+def main():
+    parser = argparse.ArgumentParser(description='Combine tweets with their sentiment labels')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Add newly scored tweets to the existing rollups instead of rebuilding them')
+    parser.add_argument('--input', type=str,
+                        help='Raw tweets file to combine (default: the current one, see build.raw_tweets_file)')
+    args = parser.parse_args()
+    return create_analysis_file(incremental=args.incremental, tweets_file=args.input)
+
 if __name__ == "__main__":
-    exit(create_analysis_file()) 
\ No newline at end of file
+    exit(metrics.run_stage('combine', main))
\ No newline at end of file
@@ -1,32 +1,171 @@
+import argparse
 import pandas as pd
+import numpy as np
+import matplotlib
+# Render to files only: no GUI backend has to be found or started
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-import seaborn as sns
 from datetime import datetime
-import glob
 import os
+import metrics
+from config import FILE_PATHS, VISUALIZATION_CONFIG
+from storage import artifact_exists, artifact_path, read_table, to_timestamps
 
-def generate_visualization():
-    # Find the most recent analysis file
-    analysis_files = glob.glob('04_data_analysis.csv')
-    if not analysis_files:
+# Time buckets tried from finest to coarsest in fast mode: (rollup granularity, pandas frequency)
+BUCKET_SIZES = [('minute', 'min'), ('hour', 'h'), ('day', 'D')]
+# z value of a two-sided 95% confidence interval (what seaborn's bootstrap CI estimates)
+Z_95 = 1.96
+
+def generate_visualization(mode=None):
+    """
+    Plots the sentiment over time. mode is "exact" (seaborn over every tweet), "fast"
+    (time-bucket means with analytic confidence intervals, read from the step 4 rollups
+    when they exist) or "auto" (fast above VISUALIZATION_CONFIG["fast_threshold"] tweets).
+    """
+    mode = mode or VISUALIZATION_CONFIG["mode"]
+    output_file = FILE_PATHS["visualization"]
+    
+    # Fast mode straight from the rollups never touches the per-tweet rows
+    if mode != 'exact' and artifact_exists('rollups'):
+        rollups = read_table('rollups')
+        tweet_count = rollups.loc[rollups['granularity'] == 'day', 'count'].sum()
+        if mode == 'fast' or tweet_count > VISUALIZATION_CONFIG["fast_threshold"]:
+            print(f"Processing {artifact_path('rollups')} ({tweet_count} tweets)...")
+            metrics.rows(rows_in=int(tweet_count))
+            plot_buckets(buckets_from_rollups(rollups), output_file)
+            return 0
+    
+    # Find the analysis file
+    if not artifact_exists('analysis_results'):
         print("No analysis file found. Please run the analysis step first.")
         return 1
     
-    input_file = analysis_files[0]  # There should only be one
-    output_file = '05_sentiment_analysis.png'
+    input_file = artifact_path('analysis_results')
     
     print(f"Processing {input_file}...")
 
-    # Read the data
-    df = pd.read_csv(input_file)
+    # Read the data (Parquet dates arrive already typed as timestamps)
+    df = read_table('analysis_results', columns=['date', 'score'])
+    metrics.rows(rows_in=len(df))
+    
+    render_sentiment(df, output_file, mode)
+    return 0
+
+def render_sentiment(df, output_file, mode=None):
+    """Plots a date / score DataFrame in the given mode (see generate_visualization)"""
+    mode = mode or VISUALIZATION_CONFIG["mode"]
+    if mode == 'exact' or (mode == 'auto' and len(df) <= VISUALIZATION_CONFIG["fast_threshold"]):
+        plot_sentiment(df, output_file)
+    else:
+        plot_buckets(bucket_means(df), output_file)
+
+def choose_bucket(start, end, max_points):
+    """Finest bucket size (rollup granularity, pandas frequency) giving at most max_points buckets"""
+    span = end - start
+    for granularity, frequency in BUCKET_SIZES:
+        if span / pd.Timedelta(1, frequency) < max_points:
+            return granularity, frequency
+    return BUCKET_SIZES[-1]
+
+def bucket_means(df, max_points=None):
+    """
+    Per-time-bucket mean score, tweet count and 95% confidence half-width
+    (1.96 * standard error) from per-tweet date / score rows.
+    """
+    max_points = max_points or VISUALIZATION_CONFIG["max_points"]
+    dates = to_timestamps(df['date'])
+    scores = pd.to_numeric(df['score'], errors='coerce')
+    valid = dates.notna() & scores.notna()
+    dates, scores = dates[valid], scores[valid]
+    if dates.empty:
+        return pd.DataFrame(columns=['date', 'mean', 'count', 'ci'])
+    
+    _, frequency = choose_bucket(dates.min(), dates.max(), max_points)
+    grouped = scores.groupby(dates.dt.floor(frequency).rename(None))
+    buckets = pd.DataFrame({'mean': grouped.mean(), 'count': grouped.count(), 'std': grouped.std(ddof=1)})
+    buckets['ci'] = (Z_95 * buckets['std'] / np.sqrt(buckets['count'])).fillna(0)
+    return buckets.rename_axis('date').reset_index()[['date', 'mean', 'count', 'ci']]
+
+def buckets_from_rollups(rollups, max_points=None):
+    """
+    Same as bucket_means, computed from the step 4 rollups instead of per-tweet rows:
+    the score histogram gives each bucket's exact variance.
+    """
+    max_points = max_points or VISUALIZATION_CONFIG["max_points"]
+    days = to_timestamps(rollups.loc[rollups['granularity'] == 'day', 'bucket'])
+    granularity, _ = choose_bucket(days.min(), days.max() + pd.Timedelta(1, 'D'), max_points)
+    
+    rows = rollups[rollups['granularity'] == granularity]
+    count = rows['count'].to_numpy(dtype=float)
+    histogram = rows[['n1', 'n2', 'n3', 'n4', 'n5']].to_numpy(dtype=float)
+    mean = rows['score_sum'].to_numpy(dtype=float) / count
+    squares = histogram @ np.arange(1, 6) ** 2
+    variance = np.where(count > 1, (squares - count * mean ** 2) / np.maximum(count - 1, 1), 0)
+    return pd.DataFrame({
+        'date': to_timestamps(rows['bucket']).to_numpy(),
+        'mean': mean,
+        'count': count.astype(int),
+        'ci': Z_95 * np.sqrt(np.clip(variance, 0, None) / count)
+    }).sort_values('date', ignore_index=True)
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling: indices of `threshold` points of the
+    series (x, y) that preserve its visual shape. x must be sorted.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = [0]
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket (or the last point) is the triangle's third corner
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        previous = selected[-1]
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        selected.append(start + int(areas.argmax()))
+    selected.append(n - 1)
+    return np.array(selected)
+
+def plot_buckets(buckets, output_file, max_points=None):
+    """Plots bucket means with their confidence band (LTTB-downsampled beyond max_points)"""
+    draw_buckets(buckets, max_points)
+    finish_plot(output_file)
+
+def draw_buckets(buckets, max_points=None):
+    """Draws bucket means and their confidence band on a new figure"""
+    max_points = max_points or VISUALIZATION_CONFIG["max_points"]
+    if len(buckets) > max_points:
+        dates = buckets['date'].to_numpy().astype('datetime64[ns]').astype('int64')
+        buckets = buckets.iloc[lttb(dates, buckets['mean'].to_numpy(), max_points)]
+    
+    plt.figure(figsize=(12, 6))
+    plt.plot(buckets['date'], buckets['mean'])
+    plt.fill_between(buckets['date'], buckets['mean'] - buckets['ci'], buckets['mean'] + buckets['ci'], alpha=0.2)
+    add_score_guides()
+
+def plot_sentiment(df, output_file):
+    """Plots the sentiment score over time from a DataFrame with date / score columns"""
+    # Seaborn is only needed (and imported) for the exact per-tweet plot
+    import seaborn as sns
     
     # Convert date column to datetime
-    df['date'] = pd.to_datetime(df['date'])
+    df = df.copy()
+    df['date'] = to_timestamps(df['date'])
     
     # Create the visualization
     plt.figure(figsize=(12, 6))
     sns.lineplot(data=df, x='date', y='score')
-    
+    add_score_guides()
+    finish_plot(output_file)
+
+def add_score_guides():
+    """Adds the score range lines, their legend and the axis labels to the current figure"""
     # Add horizontal lines for score ranges
     plt.axhline(y=1, color='red', linestyle='--', alpha=0.3)
     plt.axhline(y=2, color='orange', linestyle='--', alpha=0.3)
@@ -45,16 +184,40 @@ def generate_visualization():
     
     plt.legend(handles=legend_elements, title='Sentiment Score Range', bbox_to_anchor=(1.05, 1), loc='upper left')
     
-    plt.title('Sentiment Analysis Over Time')
     plt.xlabel('Date')
     plt.ylabel('Sentiment Score')
     plt.xticks(rotation=45)
+
+def finish_plot(output_file):
+    """Titles the current figure and saves it"""
+    plt.title('Sentiment Analysis Over Time')
     plt.tight_layout()
-    
-    # Save the plot
-    plt.savefig(output_file, bbox_inches='tight')
+    save_figure(output_file)
+
+def save_figure(output_file):
+    """Saves and closes the current figure, writing a temporary file that is then renamed into place"""
+    temp_file = output_file + '.tmp'
+    plt.savefig(temp_file, bbox_inches='tight', format=os.path.splitext(output_file)[1].lstrip('.') or 'png')
+    plt.close()
+    os.replace(temp_file, output_file)
     print(f"Visualization saved to {output_file}")
-    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Plot the sentiment over time')
+    parser.add_argument('--mode', choices=['auto', 'fast', 'exact'], default=None,
+                        help='fast: bucket means with analytic CIs; exact: seaborn over every tweet '
+                             '(default: VISUALIZATION_CONFIG["mode"])')
+    parser.add_argument('--report', action='store_true',
+                        help='Also render the multi-chart report (time series, score distribution, '
+                             f'engagement, user volume) into {FILE_PATHS["report_dir"]}/')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processes rendering report charts in parallel (default: REPORT_CONFIG["workers"])')
+    args = parser.parse_args()
+    result = generate_visualization(args.mode)
+    if result == 0 and args.report:
+        from report import generate_report
+        metrics.rows(rows_out=len(generate_report(workers=args.workers)))
+    return result
 
 if __name__ == "__main__":
-    exit(generate_visualization()) 
\ No newline at end of file
+    exit(metrics.run_stage('visualize', main)) 
\ No newline at end of file
@@ -4,12 +4,14 @@ Script to help users add their own datasets to the sentiment analysis pipeline
 """
 
 import os
-import pandas as pd
 import shutil
+from build import use_raw_tweets
 from config import DATASET_CONFIG
 
 def validate_dataset(file_path):
     """Validate that the dataset has the required columns"""
+    # pandas is only imported by the options that read or show a table
+    import pandas as pd
     try:
         df = pd.read_csv(file_path)
         required_columns = ['Tweet_count', 'Username', 'Text', 'Created At', 'Retweets', 'Likes']
@@ -60,6 +62,8 @@ def add_dataset():
     try:
         shutil.copy2(file_path, target_path)
         print(f"✅ Dataset copied to: {target_path}")
+        # Steps 2 and 4 read this dataset from now on (copy2 keeps the old modification time)
+        use_raw_tweets(target_filename)
         
         # Update config (in memory, user needs to manually update config.py)
         print(f"\n📝 To use this dataset, add this line to config.py:")
@@ -84,6 +88,7 @@ def show_example_format():
         'Likes': [50, 25, 100]
     }
     
+    import pandas as pd
     df = pd.DataFrame(example_data)
     print(df.to_string(index=False))
     print("\n💡 Make sure your CSV has these exact column names!")
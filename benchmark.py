@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# Offline throughput benchmark for steps 2-5
+#
+# Generates reproducible synthetic tweet CSVs (the add_dataset.validate_dataset
+# schema) at several sizes, runs 02_clean_tweets, 03_analyze_sentiment (against the
+# fake Gemini model, with configurable latency, error rate and rate limit),
+# 04_create_analysis and 05_generate_visualization on each of them as separate
+# processes, and reads every step's metrics report (metrics.py) to compare rows/sec
+# and peak memory per stage with a stored baseline. No network access is needed.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import BENCHMARK_CONFIG
+from metrics import METRICS_DIR_ENV, write_json
+from storage import TWITTER_DATE_FORMAT
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Benchmarked steps: (metrics stage name, script)
+STAGES = [
+    ('clean', '02_clean_tweets.py'),
+    ('analyze', '03_analyze_sentiment.py'),
+    ('combine', '04_create_analysis.py'),
+    ('visualize', '05_generate_visualization.py'),
+]
+
+TEMPLATES = [
+    "Just paid {price} for {product} at {store}, this is {feeling}",
+    "{product} prices at {store} are {feeling} right now",
+    "Can't believe {product} costs {price} now. {feeling}",
+    "Found {product} for {price} at {store} today, {feeling}",
+    "Grocery bill this week: {price}. {product} alone was {feeling}",
+    "Why is {product} {price} at {store}?? {feeling}",
+    "{store} dropped the price of {product} to {price}, {feeling}",
+    "Inflation is making {product} {feeling}, {price} at {store}",
+]
+PRODUCTS = ['eggs', 'milk', 'bread', 'butter', 'coffee', 'beef', 'chicken', 'rice', 'cheese', 'bananas',
+            'avocados', 'cereal', 'olive oil', 'orange juice', 'baby formula', 'pasta', 'apples', 'bacon']
+STORES = ['Walmart', 'Costco', 'Kroger', 'Aldi', 'Target', 'Safeway', 'Whole Foods', 'Trader Joes', 'Publix']
+FEELINGS = ['ridiculous', 'insane', 'not bad', 'a great deal', 'outrageous', 'finally affordable', 'painful',
+            'honestly fine', 'highway robbery', 'cheaper than last month', 'so frustrating', 'a nice surprise']
+EXTRAS = ['', '', '', ' #inflation', ' #groceries', ' @CostcoNews', ' https://t.co/abc123', ' 😡', ' 😍', ' 💸💸']
+
+
+def parse_size(text):
+    """'1k' -> 1000, '1m' -> 1000000, '2500' -> 2500"""
+    text = text.strip().lower()
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * multiplier)
+
+
+def generate_dataset(path, rows, seed=0):
+    """
+    Writes `rows` synthetic tweets with the scraper's columns to `path`. Texts combine
+    templates, products, stores, prices and noise (hashtags, mentions, URLs, emoji);
+    BENCHMARK_CONFIG["duplicate_rate"] of them repeat an earlier text, like retweets.
+    """
+    rng = np.random.default_rng(seed)
+    pick = lambda options: np.array(options, dtype=object)[rng.integers(0, len(options), rows)]
+    prices = rng.gamma(2.0, 3.0, rows).round(2)
+    texts = [
+        template.format(product=product, store=store, feeling=feeling, price=f"${price:.2f}") + extra
+        for template, product, store, feeling, price, extra in zip(
+            pick(TEMPLATES), pick(PRODUCTS), pick(STORES), pick(FEELINGS), prices, pick(EXTRAS))
+    ]
+    texts = np.array(texts, dtype=object)
+    duplicates = np.flatnonzero(rng.random(rows) < BENCHMARK_CONFIG["duplicate_rate"])
+    duplicates = duplicates[duplicates > 0]
+    texts[duplicates] = texts[rng.integers(0, duplicates)]
+
+    # A few prolific accounts and a long tail, spread over 30 days
+    users = rng.zipf(1.5, rows) % max(1, rows // 10)
+    seconds = np.sort(rng.integers(0, 30 * 86400, rows))
+    dates = (pd.Timestamp('2025-01-01', tz='UTC') + pd.to_timedelta(seconds, unit='s')).strftime(TWITTER_DATE_FORMAT)
+    pd.DataFrame({
+        'Tweet_count': np.arange(1, rows + 1),
+        'Username': [f'user{user}' for user in users],
+        'Text': texts,
+        'Created At': dates,
+        'Retweets': rng.geometric(0.3, rows) - 1,
+        'Likes': rng.geometric(0.1, rows) - 1,
+    }).to_csv(path, index=False)
+
+
+def stage_args(stage, options):
+    """Command line of a benchmarked step"""
+    if stage != 'analyze':
+        return []
+    args = ['--fake-model', '--no-cache',
+            '--fake-latency', str(options.latency),
+            '--fake-error-rate', str(options.error_rate),
+            '--fake-seed', str(options.seed),
+            '--batch-size', str(options.batch_size),
+            '--concurrency', str(options.concurrency),
+            # The fake backend's quota (if any) replaces Gemini's; no token quota
+            '--requests-per-minute', str(options.fake_rpm or 1_000_000),
+            '--tokens-per-minute', '0']
+    if options.fake_rpm:
+        args += ['--fake-rpm', str(options.fake_rpm)]
+    return args
+
+
+def run_stage(work_dir, stage, script, args):
+    """Runs one step in work_dir and returns its measurements"""
+    metrics_dir = os.path.join(work_dir, 'metrics')
+    env = dict(os.environ, **{METRICS_DIR_ENV: os.path.abspath(metrics_dir)})
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, os.path.join(PROJECT_DIR, script)] + args,
+                            cwd=work_dir, env=env, capture_output=True, text=True)
+    process_wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise Exception(f"{script} failed:\n{result.stderr[-2000:] or result.stdout[-2000:]}")
+    with open(os.path.join(metrics_dir, f'{stage}.json'), encoding='utf-8') as file:
+        report = json.load(file)
+    return {
+        'wall_seconds': report['wall_seconds'],
+        'process_wall_seconds': round(process_wall, 3),
+        'peak_rss_mb': report['peak_rss_mb'],
+        'rows_in': report['rows_in'],
+        'rows_out': report['rows_out'],
+        'counters': report['counters'],
+    }
+
+
+def run_size(size, options):
+    """Generates (once) and benchmarks the dataset of `size` rows. Returns {stage: measurements}"""
+    rows = parse_size(size)
+    work_dir = os.path.join(options.work_dir, size)
+    os.makedirs(work_dir, exist_ok=True)
+    dataset = os.path.join(work_dir, f'01_tweets_benchmark_{size}.csv')
+    if not os.path.exists(dataset):
+        print(f"\n🧪 Generating {rows} synthetic tweets -> {dataset}")
+        generate_dataset(dataset, rows, options.seed)
+
+    print(f"\n{'='*50}\n⏱️  Benchmark {size} ({rows} tweets)\n{'='*50}")
+    results = {}
+    for stage, script in STAGES:
+        measured = run_stage(work_dir, stage, script, stage_args(stage, options))
+        measured['rows_per_second'] = round(rows / measured['wall_seconds'], 1) if measured['wall_seconds'] else None
+        results[stage] = measured
+        print(f"  {stage:<10} {measured['wall_seconds']:>8.2f}s  {measured['rows_per_second'] or 0:>12,.0f} rows/s  "
+              f"{measured['peak_rss_mb'] or 0:>7.0f} MB peak")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints every stage's rows/sec and peak memory next to the baseline.
+    Returns the (size, stage, what) regressions beyond `tolerance` (a fraction).
+    """
+    regressions = []
+    print(f"\n📊 Compared with the baseline (tolerance {tolerance:.0%}):")
+    for size, stages in results.items():
+        for stage, measured in stages.items():
+            before = baseline.get(size, {}).get(stage)
+            if not before:
+                print(f"  {size:<6} {stage:<10} (no baseline)")
+                continue
+            speed = (measured['rows_per_second'] or 0) / before['rows_per_second'] - 1 if before.get('rows_per_second') else 0.0
+            memory = (measured['peak_rss_mb'] or 0) / before['peak_rss_mb'] - 1 if before.get('peak_rss_mb') else 0.0
+            flags = []
+            if speed < -tolerance:
+                flags.append('slower')
+                regressions.append((size, stage, 'rows/sec'))
+            if memory > tolerance:
+                flags.append('more memory')
+                regressions.append((size, stage, 'memory'))
+            print(f"  {size:<6} {stage:<10} rows/s {speed:+7.1%}  memory {memory:+7.1%}"
+                  f"{'  ⚠️  ' + ', '.join(flags) if flags else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark steps 2-5 offline on synthetic datasets')
+    parser.add_argument('--sizes', default=','.join(BENCHMARK_CONFIG["sizes"]),
+                        help='Comma-separated dataset sizes, e.g. 1k,100k,1m')
+    parser.add_argument('--latency', type=float, default=BENCHMARK_CONFIG["fake_latency"],
+                        help='Seconds the fake Gemini model takes per request')
+    parser.add_argument('--error-rate', type=float, default=BENCHMARK_CONFIG["fake_error_rate"],
+                        help='Fraction of fake Gemini requests answered with a 429')
+    parser.add_argument('--fake-rpm', type=int, default=BENCHMARK_CONFIG["fake_requests_per_minute"],
+                        help='Request quota of the fake Gemini model (default: unlimited)')
+    parser.add_argument('--batch-size', type=int, default=BENCHMARK_CONFIG["batch_size"],
+                        help='Tweets per fake Gemini request')
+    parser.add_argument('--concurrency', type=int, default=BENCHMARK_CONFIG["concurrency"],
+                        help='Fake Gemini requests in flight')
+    parser.add_argument('--seed', type=int, default=BENCHMARK_CONFIG["seed"],
+                        help='Seed of the synthetic datasets and fake scores')
+    parser.add_argument('--work-dir', default=BENCHMARK_CONFIG["work_dir"],
+                        help='Where datasets and step outputs are kept')
+    parser.add_argument('--baseline', default=BENCHMARK_CONFIG["baseline"],
+                        help='Baseline JSON to compare with')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store this run as the new baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=BENCHMARK_CONFIG["tolerance"],
+                        help='Allowed slowdown / memory growth before a stage counts as a regression')
+    options = parser.parse_args()
+
+    results = {}
+    try:
+        for size in [size for size in options.sizes.split(',') if size.strip()]:
+            results[size.strip()] = run_size(size.strip(), options)
+    except Exception as e:
+        print(f"\n✗ Benchmark failed: {str(e)}")
+        return 1
+
+    write_json(os.path.join(options.work_dir, 'benchmark_results.json'), results)
+    if options.save_baseline:
+        # Sizes that were not run this time keep their old baseline
+        baseline = {}
+        if os.path.exists(options.baseline):
+            with open(options.baseline, encoding='utf-8') as file:
+                baseline = json.load(file)
+        write_json(options.baseline, dict(baseline, **results))
+        print(f"\n💾 Baseline saved to {options.baseline}")
+        return 0
+    if not os.path.exists(options.baseline):
+        print(f"\nNo baseline at {options.baseline} yet; run with --save-baseline to create one")
+        return 0
+    with open(options.baseline, encoding='utf-8') as file:
+        regressions = compare(results, json.load(file), options.tolerance)
+    if regressions:
+        print(f"\n✗ {len(regressions)} regressions")
+        return 1
+    print("\n✓ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,232 @@
+# Build graph and manifest for incremental runs (main.py --build)
+#
+# Every numbered step declares the files it reads and writes and the parameters its
+# output depends on (query, model, prompt version, storage format, the step's own
+# code). After a step succeeds, the content hashes of its inputs and outputs are stored
+# with those parameters in the build manifest. On the next run a step whose inputs,
+# parameters and outputs are all unchanged is skipped, like make. If the only change is
+# that inputs grew at the end (an incremental scrape appending to 01_tweets_<query>.csv,
+# step 2 appending to the cleaned tweets, ...) the step runs in its append mode and
+# only processes the new rows. The manifest also remembers which raw tweets file is
+# current, so the steps no longer guess it from file creation times.
+
+import glob
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from config import (ANALYSIS_CONFIG, DEDUP_CONFIG, FILE_PATHS, LOCAL_SCORER_CONFIG, REPORT_CONFIG,
+                    STORAGE_CONFIG, VISUALIZATION_CONFIG)
+from metrics import write_json
+from storage import artifact_path
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_VERSION = 1
+HASH_CHUNK = 1 << 20
+
+# (path, size, mtime_ns) -> sha256 of the files hashed by this process
+_digests = {}
+
+
+def hash_file(path, prefix_size=None):
+    """
+    sha256 of a file, plus the sha256 of its first prefix_size bytes (None if the file
+    is shorter or no prefix_size is given), computed in one pass
+    """
+    digest = hashlib.sha256()
+    prefix_digest = digest.hexdigest() if prefix_size == 0 else None
+    position = 0
+    with open(path, 'rb') as file:
+        while True:
+            size = HASH_CHUNK
+            if prefix_size and position < prefix_size:
+                size = min(size, prefix_size - position)
+            chunk = file.read(size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            position += len(chunk)
+            if position == prefix_size:
+                prefix_digest = digest.hexdigest()
+    return digest.hexdigest(), prefix_digest
+
+
+def file_state(path):
+    """{'sha256', 'size'} of a file, or None if it does not exist"""
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _digests:
+        _digests[key] = hash_file(path)[0]
+    return {'sha256': _digests[key], 'size': stat.st_size}
+
+
+def grew_from(path, recorded):
+    """True if the file at `path` still starts with the recorded content (it was only appended to)"""
+    if not os.path.exists(path) or os.path.getsize(path) < recorded['size']:
+        return False
+    return hash_file(path, recorded['size'])[1] == recorded['sha256']
+
+
+def load_manifest(path=None):
+    path = path or FILE_PATHS["build_manifest"]
+    if not os.path.exists(path):
+        return {'version': MANIFEST_VERSION, 'steps': {}}
+    with open(path, encoding='utf-8') as file:
+        manifest = json.load(file)
+    if manifest.get('version') != MANIFEST_VERSION:
+        # Written by an older layout: rebuild everything once
+        return {'version': MANIFEST_VERSION, 'steps': {}, 'raw_tweets': manifest.get('raw_tweets')}
+    return manifest
+
+
+def save_manifest(manifest, path=None):
+    write_json(path or FILE_PATHS["build_manifest"], manifest)
+
+
+def scraped_file(query_file):
+    """The raw tweets file step 1 writes for a query file"""
+    return f"01_tweets_{os.path.splitext(os.path.basename(query_file))[0]}.csv"
+
+
+def delta_file(raw_file):
+    """The file an incremental scrape writes the new rows of raw_file to"""
+    directory, name = os.path.split(raw_file)
+    return os.path.join(directory, name.replace('01_tweets_', '01_delta_', 1))
+
+
+def use_raw_tweets(path):
+    """Records `path` as the current raw tweets file (after a scrape or adding a dataset)"""
+    manifest = load_manifest()
+    manifest['raw_tweets'] = path
+    save_manifest(manifest)
+
+
+def raw_tweets_file(explicit=None):
+    """
+    The raw tweets file steps 2 and 4 read: `explicit` if given, else the one recorded
+    by the last scrape or added dataset, else the most recently modified 01_tweets_*.csv
+    (ties broken by name). None if there is none.
+    """
+    if explicit:
+        return explicit
+    recorded = load_manifest().get('raw_tweets')
+    if recorded and os.path.exists(recorded):
+        return recorded
+    tweet_files = glob.glob(FILE_PATHS["raw_tweets"])
+    return max(tweet_files, key=lambda path: (os.path.getmtime(path), path)) if tweet_files else None
+
+
+def code_digest(script):
+    return file_state(os.path.join(PROJECT_DIR, script))['sha256']
+
+
+def plan_steps(raw_file, query_file=None, incremental=False, fake_model=False, report=False):
+    """
+    The build graph: one dict per step with its script, inputs, outputs, parameters,
+    command line ('args') and, for steps that can process just appended rows, a
+    function returning the command line of that append run ('append_args', given the
+    {input: previous size} of the inputs that grew)
+    """
+    from pipeline import load_stage
+    analyzer = load_stage(3)
+    compact, explanations = ANALYSIS_CONFIG["compact_prompt"], ANALYSIS_CONFIG["explanations"]
+    rollups = [artifact_path('rollups'), FILE_PATHS["rollup_store"]]
+    steps = []
+    if query_file:
+        with open(query_file, encoding='utf-8') as file:
+            query = file.read().strip()
+        steps.append({
+            'step': 1, 'stage': 'scrape', 'name': "Twitter Scraping", 'script': "01_scrape_tweets.py",
+            'inputs': [query_file], 'outputs': [raw_file],
+            'params': {'query': query},
+            'args': ['--query-file', query_file] + (['--incremental'] if incremental else []),
+            # Live data: an incremental scrape always looks for new tweets
+            'always': incremental,
+        })
+    steps += [{
+        'step': 2, 'stage': 'clean', 'name': "Tweet Cleaning", 'script': "02_clean_tweets.py",
+        'inputs': [raw_file], 'outputs': [artifact_path('cleaned_tweets')],
+        'params': {'storage': STORAGE_CONFIG["format"]},
+        'args': ['--input', raw_file],
+        'append_args': lambda grown: ['--input', raw_file, '--append-from', str(grown[raw_file])],
+    }, {
+        'step': 3, 'stage': 'analyze', 'name': "Gemini AI Analysis", 'script': "03_analyze_sentiment.py",
+        'inputs': [artifact_path('cleaned_tweets')],
+        'outputs': [artifact_path('sentiment_labels'), FILE_PATHS["raw_json"]],
+        'params': {
+            'model': 'fake' if fake_model else analyzer.MODEL_NAME,
+            'prompt_version': analyzer.prompt_version(compact, explanations),
+            'dedup': DEDUP_CONFIG,
+            'local_filter': LOCAL_SCORER_CONFIG,
+            'storage': STORAGE_CONFIG["format"],
+        },
+        'args': ['--fake-model'] if fake_model else [],
+        # Ids already in the result log are not scored again
+        'append_args': lambda grown: ['--resume'] + (['--fake-model'] if fake_model else []),
+    }, {
+        'step': 4, 'stage': 'combine', 'name': "Data Analysis", 'script': "04_create_analysis.py",
+        'inputs': [raw_file, artifact_path('sentiment_labels')],
+        'outputs': [artifact_path('analysis_results')] + rollups,
+        'params': {'storage': STORAGE_CONFIG["format"]},
+        'args': ['--input', raw_file],
+        # Only tweets the rollup store has not counted yet are added to it
+        'append_args': lambda grown: ['--input', raw_file, '--incremental'],
+    }, {
+        'step': 5, 'stage': 'visualize', 'name': "Data Visualization", 'script': "05_generate_visualization.py",
+        'inputs': [artifact_path('analysis_results'), artifact_path('rollups')],
+        'outputs': [FILE_PATHS["visualization"]]
+                   + ([os.path.join(FILE_PATHS["report_dir"], 'report.json')] if report else []),
+        'params': {'visualization': VISUALIZATION_CONFIG, 'report': REPORT_CONFIG if report else None},
+        'args': ['--report'] if report else [],
+    }]
+    for step in steps:
+        step['params']['code'] = code_digest(step['script'])
+    return steps
+
+
+def check_step(step, manifest, force=False):
+    """
+    Decides how a step has to run: ('skip', reason), ('run', reason) or
+    ('append', reason, {input: previous size}) when its inputs only grew
+    """
+    previous = manifest['steps'].get(step['stage'])
+    if force:
+        return 'run', 'forced'
+    if previous is None:
+        return 'run', 'never built'
+    if step.get('always'):
+        return 'run', 'always runs'
+    if previous['params'] != step['params']:
+        changed = sorted(name for name in set(step['params']) | set(previous['params'])
+                         if step['params'].get(name) != previous['params'].get(name))
+        return 'run', f"{', '.join(changed)} changed"
+    for path in step['outputs']:
+        if file_state(path) != previous['outputs'].get(path):
+            return 'run', f"{path} is missing or was modified"
+    grown = {}
+    for path in step['inputs']:
+        recorded = previous['inputs'].get(path)
+        state = file_state(path)
+        if state == recorded:
+            continue
+        if recorded and 'append_args' in step and grew_from(path, recorded):
+            grown[path] = recorded['size']
+            continue
+        return 'run', f"{path} changed"
+    if grown:
+        return 'append', f"{', '.join(grown)} grew", grown
+    return 'skip', 'up to date'
+
+
+def record_step(step, manifest):
+    """Stores the current state of a step that has just run successfully"""
+    manifest['steps'][step['stage']] = {
+        'inputs': {path: file_state(path) for path in step['inputs']},
+        'outputs': {path: file_state(path) for path in step['outputs']},
+        'params': step['params'],
+        'built_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    save_manifest(manifest)
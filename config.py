@@ -11,11 +11,99 @@ DATASET_CONFIG = {
     # "large_dataset": "data/large_twitter_dataset.csv",
 }
 
+# Multi-dataset runs (main.py --datasets): each dataset gets its own runs/<name>/ directory
+DATASET_RUN_CONFIG = {
+    "workers": None,  # datasets processed in parallel (None: one per CPU, at most one per dataset)
+}
+
 # Analysis Settings
 ANALYSIS_CONFIG = {
-    "rate_limit_delay": 4,  # seconds between API calls
-    "batch_size": 20,       # tweets to process in one batch
-    "max_retries": 3,       # retry failed API calls
+    "requests_per_minute": 15,       # Gemini request quota (free tier: 15 RPM)
+    "tokens_per_minute": 1_000_000,  # Gemini token quota (free tier: 1M TPM)
+    "concurrency": 4,                # Gemini requests kept in flight at once
+    "batch_size": 20,                # tweets to process in one batch
+    "max_retries": 3,                # retry failed API calls
+    "fsync_every": 100,              # results buffered before the result log is fsync'd
+    "stream_queue_size": 200,        # tweets buffered between scraper and scorer in --stream mode
+    "stream_summary_seconds": 5,     # running averages printed at most this often in --stream mode
+    "compact_prompt": True,          # rubric sent once as system instruction, JSON output via response schema
+    "explanations": True,            # ask for a short explanation per tweet (False = scores only, fewer output tokens)
+}
+
+# Twitter Scraping Configuration (the request budget is shared by every query of a run)
+SCRAPE_CONFIG = {
+    "requests_per_minute": 50 / 15,  # search requests per account (Twitter allows ~50 per 15 minutes)
+    "max_concurrent_queries": 4,     # query files scraped at the same time in batch mode
+    "max_retries": 3,                # retries of a request answered with 429 before giving up
+    "backoff_base": 30,              # seconds to back off after a 429 without a reset time (doubles per retry)
+    "backoff_cap": 900,              # longest single backoff in seconds
+    "pacing": "jittered",            # gap between requests: "fixed", "jittered" or "adaptive"
+    "pacing_delay": 5,               # seconds between requests (mean for jittered, start for adaptive)
+    "pacing_jitter": 2,              # jittered: +/- seconds around pacing_delay
+    "pacing_min_delay": 1,           # adaptive: shortest gap after a run of successful requests
+    "pacing_max_delay": 60,          # adaptive: longest gap after repeated 429s
+}
+
+# Response Cache (re-runs never re-score a tweet text they have already seen)
+CACHE_CONFIG = {
+    "enabled": True,
+    "max_entries": 500_000,  # least recently used entries are evicted beyond this
+    "max_age_days": 30,      # entries older than this are re-scored
+}
+
+# Local pre-filter: tweets a cheap local scorer is confident about skip Gemini
+LOCAL_SCORER_CONFIG = {
+    "enabled": False,              # also enabled per run with --local-filter
+    "model": "lexicon",            # "lexicon" (built in) or "sklearn" (trained with --train-local-model)
+    "confidence_threshold": 0.8,   # tweets scored below this confidence still go to Gemini
+    "min_words": 3,                # shorter tweets are treated as neutral
+}
+
+# Near-duplicate clustering: only one tweet per cluster of near-identical texts is scored
+DEDUP_CONFIG = {
+    "enabled": True,    # disable per run with --no-dedup
+    "max_distance": 3,  # max differing bits (of 64) between SimHashes of near-duplicate texts
+}
+
+# Step 5 rendering
+VISUALIZATION_CONFIG = {
+    "mode": "auto",          # "exact" (seaborn bootstrap CI over every tweet), "fast" or "auto"
+    "fast_threshold": 20_000,  # auto mode renders time-bucket means above this many tweets
+    "max_points": 2_000,     # most points drawn in fast mode (finer buckets are LTTB-downsampled)
+}
+
+# Multi-chart report (05_generate_visualization.py --report)
+REPORT_CONFIG = {
+    "workers": None,   # processes rendering charts in parallel (None: one per CPU)
+    "top_users": 20,   # users shown in the volume chart
+    "user_charts": 8,  # busiest users that get their own time series chart
+}
+
+# Run metrics (metrics.py)
+METRICS_CONFIG = {
+    "enabled": True,               # write a JSON report per stage run
+    "dir": "metrics",              # stage reports; main.py runs use a run_<timestamp>/ subdirectory
+    "prometheus_textfile": None,   # e.g. "/var/lib/node_exporter/textfile/tweet_pipeline.prom"
+}
+
+# Offline benchmark (benchmark.py)
+BENCHMARK_CONFIG = {
+    "sizes": ["1k", "100k", "1m"],           # synthetic dataset sizes
+    "work_dir": "benchmark_runs",            # datasets and step outputs, one subdirectory per size
+    "baseline": "benchmark_baseline.json",   # stored results compared against (--save-baseline)
+    "tolerance": 0.2,                        # slowdown / memory growth flagged as a regression
+    "seed": 0,
+    "duplicate_rate": 0.1,                   # share of synthetic tweets repeating an earlier text
+    "fake_latency": 0.05,                    # seconds per fake Gemini request
+    "fake_error_rate": 0.0,                  # share of fake Gemini requests answered with a 429
+    "fake_requests_per_minute": None,        # fake Gemini quota (None: unlimited)
+    "batch_size": 100,
+    "concurrency": 32,
+}
+
+# Storage format for the intermediate 02_/03_/04_ artifacts
+STORAGE_CONFIG = {
+    "format": "csv",  # "csv" or "parquet" (typed columns, memory-mapped reads; requires pyarrow)
 }
 
 # File Paths
@@ -24,8 +112,17 @@ FILE_PATHS = {
     "cleaned_tweets": "02_cleaned_tweets.csv", 
     "sentiment_labels": "03_sentiment_labels.csv",
     "analysis_results": "04_data_analysis.csv",
+    "rollups": "04_rollups.csv",
+    "rollup_store": "04_rollups.sqlite",
+    "report_dir": "05_report",
+    "build_manifest": "build_manifest.json",
+    "applied_deltas": "02_applied_deltas.json",
+    "runs_dir": "runs",
     "visualization": "05_sentiment_analysis.png",
-    "raw_json": "gpt_analysis.json"
+    "raw_json": "gpt_analysis.jsonl",
+    "response_cache": "gemini_cache.sqlite",
+    "checkpoint": "03_checkpoint.json",
+    "local_model": "03_local_model.pkl"
 }
 
 def get_dataset_path(dataset_name="default"):
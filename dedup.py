@@ -0,0 +1,128 @@
+# Near-duplicate clustering of cleaned tweets
+#
+# Retweets, quote variants and copy-paste campaigns often differ only in a word or two
+# once URLs and mentions are stripped. Every text gets a 64-bit SimHash over its words
+# and word pairs; texts whose SimHashes differ in at most `max_distance` bits are
+# near-duplicates. Candidate pairs come from LSH banding (the hash is cut into
+# max_distance + 1 bands, so any two such hashes share at least one band exactly),
+# and confirmed pairs are merged with union-find. Cost grows roughly linearly with the
+# number of tweets.
+
+import hashlib
+import re
+from collections import defaultdict
+
+from config import DEDUP_CONFIG
+from lazy_imports import lazy_import
+from response_cache import normalize_text
+
+np = lazy_import('numpy')
+
+# Buckets larger than this only compare each hash with its nearest neighbours (in sorted
+# order), so one huge bucket can't make the clustering quadratic
+MAX_BUCKET_COMPARISONS = 64
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def features(text):
+    """Words (punctuation ignored) and adjacent word pairs of the normalized text"""
+    words = WORD_PATTERN.findall(normalize_text(text))
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+class SimHasher:
+    """Computes 64-bit SimHashes, remembering the hash of every feature it has seen"""
+
+    def __init__(self):
+        self.feature_hashes = {}
+
+    def _feature_hash(self, feature):
+        value = self.feature_hashes.get(feature)
+        if value is None:
+            value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+            self.feature_hashes[feature] = value
+        return value
+
+    def simhash(self, text):
+        hashes = [self._feature_hash(feature) for feature in features(text)]
+        if not hashes:
+            return 0
+        bits = np.unpackbits(np.array(hashes, dtype='<u8').view(np.uint8), bitorder='little').reshape(-1, 64)
+        majority = bits.sum(axis=0) * 2 > len(hashes)
+        return int.from_bytes(np.packbits(majority, bitorder='little').tobytes(), 'little')
+
+
+class UnionFind:
+    """Disjoint sets over 0..n-1; the smallest index of a set is its root"""
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parent[max(first, second)] = min(first, second)
+
+
+def cluster_texts(texts, max_distance=None):
+    """
+    Clusters texts whose SimHashes are within max_distance bits of each other.
+    Returns a list giving, for every text, the index of the first text of its cluster.
+    """
+    max_distance = DEDUP_CONFIG["max_distance"] if max_distance is None else max_distance
+    hasher = SimHasher()
+    hashes = [hasher.simhash(text) for text in texts]
+    clusters = UnionFind(len(hashes))
+
+    # Identical hashes are merged directly; only distinct hashes go through LSH
+    first_with_hash = {}
+    for index, value in enumerate(hashes):
+        if value in first_with_hash:
+            clusters.union(first_with_hash[value], index)
+        else:
+            first_with_hash[value] = index
+
+    if max_distance > 0:
+        bands = max_distance + 1
+        band_bits = 64 // bands
+        mask = (1 << band_bits) - 1
+        distinct = sorted(first_with_hash)
+        for band in range(bands):
+            shift = band * band_bits
+            buckets = defaultdict(list)
+            for value in distinct:
+                buckets[(value >> shift) & mask].append(value)
+            for bucket in buckets.values():
+                for position, value in enumerate(bucket):
+                    for other in bucket[position + 1:position + 1 + MAX_BUCKET_COMPARISONS]:
+                        if (value ^ other).bit_count() <= max_distance:
+                            clusters.union(first_with_hash[value], first_with_hash[other])
+
+    return [clusters.find(index) for index in range(len(hashes))]
+
+
+def group_near_duplicates(tweets, max_distance=None):
+    """
+    Groups (id, text) pairs into near-duplicate clusters.
+    Returns {representative id: [ids of the other members]}; the representative is
+    the first tweet of each cluster, and every tweet id appears exactly once.
+    """
+    tweets = list(tweets)
+    roots = cluster_texts([text for _, text in tweets], max_distance)
+    groups = {}
+    for (tweet_id, _), root in zip(tweets, roots):
+        representative = str(tweets[root][0])
+        if representative == str(tweet_id):
+            groups.setdefault(representative, [])
+        else:
+            groups.setdefault(representative, []).append(str(tweet_id))
+    return groups
@@ -0,0 +1,181 @@
+# Local stand-ins for external services (Gemini, Twitter), used to exercise the pipeline offline
+#
+# The real client libraries are only imported for their exception types, when a fake
+# actually raises one, so offline runs don't pay for loading them.
+
+import asyncio
+import json
+import random
+import re
+import time
+
+from rate_limiter import estimate_tokens
+
+ID_PATTERN = re.compile(r'"id":\s*"([^"<]+)"')
+SINCE_ID_PATTERN = re.compile(r'\s*since_id:(\d+)')
+
+
+class FakeUsageMetadata:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class FakeResponse:
+    """Mimics the parts of a Gemini response the pipeline reads"""
+
+    def __init__(self, text, prompt_tokens=0):
+        self.text = text
+        self.usage_metadata = FakeUsageMetadata(prompt_tokens, estimate_tokens(text))
+
+
+class FakeGenerativeModel:
+    """
+    Drop-in replacement for genai.GenerativeModel.
+    Answers every prompt with a valid JSON array for the tweet ids it contains, after
+    `latency` seconds. A fraction `error_rate` of calls raise a 429 (ResourceExhausted),
+    and more than `requests_per_minute` calls in any 60 s window do as well.
+    Token counts are estimated and include the system instruction, like Gemini's
+    usage_metadata; explanations=False leaves the explanation out of the answers.
+    """
+
+    def __init__(self, latency=0.05, error_rate=0.0, requests_per_minute=None, seed=None,
+                 system_instruction=None, explanations=True):
+        self.latency = latency
+        self.system_instruction = system_instruction
+        self.explanations = explanations
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.rate_limited = 0
+        self._call_times = []
+
+    def _check_limits(self):
+        self.calls += 1
+        now = time.monotonic()
+        self._call_times = [t for t in self._call_times if now - t < 60]
+        self._call_times.append(now)
+        over_quota = self.requests_per_minute and len(self._call_times) > self.requests_per_minute
+        if over_quota or self.random.random() < self.error_rate:
+            self.rate_limited += 1
+            from google.api_core import exceptions as google_exceptions
+            raise google_exceptions.ResourceExhausted("429 Resource has been exhausted (fake)")
+
+    def _answer(self, prompt):
+        results = []
+        for tweet_id in dict.fromkeys(ID_PATTERN.findall(prompt)):
+            result = {"id": tweet_id, "stance_score": self.random.randint(1, 5)}
+            if self.explanations:
+                result["explanation"] = "fake model response"
+            results.append(result)
+        prompt_tokens = estimate_tokens(prompt) + (estimate_tokens(self.system_instruction)
+                                                   if self.system_instruction else 0)
+        return FakeResponse(json.dumps(results), prompt_tokens)
+
+    def generate_content(self, prompt, **kwargs):
+        self._check_limits()
+        time.sleep(self.latency)
+        return self._answer(prompt)
+
+    async def generate_content_async(self, prompt, **kwargs):
+        self._check_limits()
+        await asyncio.sleep(self.latency)
+        return self._answer(prompt)
+
+
+class FakeUser:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeTweet:
+    """Mimics the twikit Tweet attributes the scraper reads"""
+
+    def __init__(self, tweet_id, text, created_at, user_name, retweet_count, favorite_count):
+        self.id = tweet_id
+        self.text = text
+        self.created_at = created_at
+        self.user = FakeUser(user_name)
+        self.retweet_count = retweet_count
+        self.favorite_count = favorite_count
+
+
+class FakeTweetPage(list):
+    """A page of search results; next() fetches the following page from the client"""
+
+    def __init__(self, client, query, product, tweets, offset):
+        super().__init__(tweets)
+        self.client = client
+        self.query = query
+        self.product = product
+        self.offset = offset
+
+    async def next(self):
+        return await self.client._page(self.query, self.product, self.offset + len(self))
+
+
+class FakeTwitterClient:
+    """
+    Drop-in replacement for twikit.Client's search_tweet.
+    Every query has `tweets_per_query` tweets with stable, newest-first ids (so
+    since_id:<id> in the query works), served `page_size` at a time after `latency`
+    seconds. More than `requests_per_minute` requests in any 60 s window, and a
+    fraction `error_rate` of requests, raise TooManyRequests with an
+    x-rate-limit-reset header `reset_after` seconds in the future.
+    """
+
+    def __init__(self, tweets_per_query=100, page_size=20, latency=0.01, requests_per_minute=None,
+                 error_rate=0.0, reset_after=1, seed=None):
+        self.tweets_per_query = tweets_per_query
+        self.page_size = page_size
+        self.latency = latency
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.reset_after = reset_after
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.rate_limited = 0
+        self._call_times = []
+
+    def _check_limits(self):
+        self.calls += 1
+        now = time.monotonic()
+        self._call_times = [t for t in self._call_times if now - t < 60]
+        self._call_times.append(now)
+        over_quota = self.requests_per_minute and len(self._call_times) > self.requests_per_minute
+        if over_quota or self.random.random() < self.error_rate:
+            self.rate_limited += 1
+            reset = str(int(time.time() + self.reset_after))
+            from twikit import TooManyRequests
+            raise TooManyRequests("status: 429, message: Rate limit exceeded (fake)",
+                                  headers={'x-rate-limit-reset': reset})
+
+    def _tweets(self, query):
+        since = SINCE_ID_PATTERN.search(query)
+        base_query = SINCE_ID_PATTERN.sub('', query)
+        # Ids are stable per query text and newest first, like the Latest timeline
+        base_id = (sum(map(ord, base_query)) % 1000 + 1) * 10 ** 9
+        tweets = []
+        for index in range(self.tweets_per_query, 0, -1):
+            tweet_id = base_id + index
+            if since and tweet_id <= int(since.group(1)):
+                break
+            tweets.append(FakeTweet(
+                str(tweet_id),
+                f"Fake tweet {index} about {base_query} https://t.co/fake #{index % 7}",
+                time.strftime('%a %b %d %H:%M:%S +0000 %Y', time.gmtime(1_700_000_000 + index * 60)),
+                f"user{index % 13}",
+                index % 11,
+                index % 17
+            ))
+        return tweets
+
+    async def _page(self, query, product, offset):
+        self._check_limits()
+        await asyncio.sleep(self.latency)
+        tweets = self._tweets(query)[offset:offset + self.page_size]
+        return FakeTweetPage(self, query, product, tweets, offset)
+
+    async def search_tweet(self, query, product='Top', count=20, cursor=None):
+        return await self._page(query, product, 0)
@@ -0,0 +1,24 @@
+# Deferred imports of heavy dependencies
+#
+# `pd = lazy_import('pandas')` at the top of a module registers pandas without running
+# it; the real import happens on the first attribute access (pd.DataFrame, ...). Code
+# paths that never touch the module - main.py deciding which step to run, step 4
+# streaming CSV rows, `--help` - no longer pay for loading it.
+
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """The module `name`, loaded on first attribute access (the already imported module if there is one)"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,188 @@
+# Cheap local scoring tier in front of Gemini
+#
+# A scorer returns (stance_score, confidence) per cleaned tweet text. Tweets it is
+# confident about (confidence >= LOCAL_SCORER_CONFIG["confidence_threshold"]) are
+# labelled locally; only the uncertain ones are sent to Gemini. Two scorers exist: a
+# price-sentiment lexicon (no dependencies) and an optional scikit-learn model trained
+# on the Gemini labels we have already paid for.
+
+import pickle
+import re
+
+from config import FILE_PATHS, LOCAL_SCORER_CONFIG
+
+# Prefix of the explanation stored for locally scored tweets, so they can be told
+# apart from Gemini labels (and are never used to train or evaluate the local tier)
+LOCAL_EXPLANATION_PREFIX = "[local]"
+
+WORD_PATTERN = re.compile(r"[a-z']+")
+
+NEGATIVE_WORDS = {
+    'expensive', 'overpriced', 'pricey', 'ridiculous', 'outrageous', 'insane', 'crazy', 'absurd',
+    'robbery', 'ripoff', 'rip', 'gouging', 'gouge', 'greed', 'greedy', 'greedflation', 'scam',
+    'skyrocketing', 'skyrocketed', 'soaring', 'soared', 'hike', 'hikes', 'hiked', 'unaffordable',
+    'broke', 'struggling', 'struggle', 'sucks', 'terrible', 'awful', 'angry', 'furious', 'disgusting',
+    'shameful', 'criminal', 'worse', 'worst', 'painful', 'shocking', 'shocked', 'cant',
+}
+POSITIVE_WORDS = {
+    'cheap', 'cheaper', 'cheapest', 'affordable', 'deal', 'deals', 'bargain', 'discount', 'discounts',
+    'sale', 'savings', 'saved', 'reasonable', 'great', 'love', 'happy', 'glad', 'finally', 'relief',
+    'dropped', 'dropping', 'lower', 'lowered', 'decreased', 'better', 'best', 'nice', 'good', 'thankful',
+}
+# Cleaned text has no apostrophes ("isn't" -> "isnt"), so both spellings are listed
+NEGATIONS = {'not', 'no', 'never', 'hardly', 'without', "isn't", 'isnt', "aren't", 'arent',
+             "wasn't", 'wasnt', "don't", 'dont', "doesn't", 'doesnt'}
+TOPIC_WORDS = {
+    'price', 'prices', 'priced', 'pricing', 'cost', 'costs', 'grocery', 'groceries', 'food', 'inflation',
+    'egg', 'eggs', 'milk', 'bread', 'meat', 'beef', 'chicken', 'butter', 'store', 'supermarket',
+    'walmart', 'costco', 'kroger', 'aldi', 'bill', 'receipt', 'paid', 'pay', 'spent', 'dollar', 'dollars',
+}
+
+
+class LexiconScorer:
+    """
+    Counts positive and negative price words (a preceding negation flips a word).
+    Very short tweets and tweets without any price/food word are neutral (3); clear
+    one-sided tweets get a confidence that grows with the number of sentiment words.
+    Mixed tweets are never confident.
+    """
+
+    name = 'lexicon'
+
+    def __init__(self, min_words=LOCAL_SCORER_CONFIG["min_words"]):
+        self.min_words = min_words
+
+    def score(self, text):
+        words = WORD_PATTERN.findall(str(text).lower())
+        if len(words) < self.min_words:
+            return 3, 0.9
+        positive = negative = 0
+        for index, word in enumerate(words):
+            flipped = index > 0 and words[index - 1] in NEGATIONS
+            if word in NEGATIVE_WORDS:
+                positive, negative = (positive + 1, negative) if flipped else (positive, negative + 1)
+            elif word in POSITIVE_WORDS:
+                positive, negative = (positive, negative + 1) if flipped else (positive + 1, negative)
+        if not positive and not negative:
+            if TOPIC_WORDS.isdisjoint(words):
+                # Off-topic: nothing about prices to be satisfied or unsatisfied with
+                return 3, 0.85
+            return 3, 0.4
+        if positive and negative:
+            return 3, 0.3
+        net = positive - negative
+        score = {-1: 2, 1: 4}.get(net, 1 if net < 0 else 5)
+        return score, min(0.95, 0.5 + 0.15 * abs(net))
+
+    def predict(self, texts):
+        return [self.score(text) for text in texts]
+
+
+def _sklearn():
+    try:
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import make_pipeline
+        return TfidfVectorizer, LogisticRegression, make_pipeline
+    except ImportError:
+        raise ImportError('LOCAL_SCORER_CONFIG["model"] is "sklearn" but scikit-learn is not installed. '
+                          'Run: pip install scikit-learn')
+
+
+class SklearnScorer:
+    """TF-IDF + logistic regression trained on Gemini labels; confidence is the top class probability"""
+
+    name = 'sklearn'
+
+    def __init__(self, pipeline=None):
+        self.pipeline = pipeline
+
+    def train(self, texts, scores):
+        TfidfVectorizer, LogisticRegression, make_pipeline = _sklearn()
+        self.pipeline = make_pipeline(
+            TfidfVectorizer(ngram_range=(1, 2), min_df=2, sublinear_tf=True),
+            LogisticRegression(max_iter=1000)
+        )
+        self.pipeline.fit(list(texts), [int(score) for score in scores])
+        return self
+
+    def predict(self, texts):
+        probabilities = self.pipeline.predict_proba(list(texts))
+        classes = self.pipeline.classes_
+        return [(int(classes[row.argmax()]), float(row.max())) for row in probabilities]
+
+    def save(self, path=FILE_PATHS["local_model"]):
+        with open(path, 'wb') as file:
+            pickle.dump(self.pipeline, file)
+
+    @classmethod
+    def load(cls, path=FILE_PATHS["local_model"]):
+        _sklearn()
+        with open(path, 'rb') as file:
+            return cls(pickle.load(file))
+
+
+def load_scorer(kind=None):
+    """The scorer named in LOCAL_SCORER_CONFIG["model"] ("lexicon" or "sklearn")"""
+    kind = kind or LOCAL_SCORER_CONFIG["model"]
+    if kind == 'lexicon':
+        return LexiconScorer()
+    if kind == 'sklearn':
+        return SklearnScorer.load()
+    raise ValueError(f"Unknown local scorer: {kind!r} (expected lexicon or sklearn)")
+
+
+def split_confident(scorer, tweets, threshold=None):
+    """
+    Scores (id, text) pairs locally. Returns (results, forwarded): result dicts for the
+    tweets scored with confidence >= threshold, and the (id, text) pairs left for Gemini.
+    """
+    threshold = LOCAL_SCORER_CONFIG["confidence_threshold"] if threshold is None else threshold
+    tweets = list(tweets)
+    results, forwarded = [], []
+    for (tweet_id, text), (score, confidence) in zip(tweets, scorer.predict(text for _, text in tweets)):
+        if confidence >= threshold:
+            results.append({
+                'id': str(tweet_id),
+                'stance_score': score,
+                'explanation': f"{LOCAL_EXPLANATION_PREFIX} {scorer.name}, confidence {confidence:.2f}"
+            })
+        else:
+            forwarded.append((tweet_id, text))
+    return results, forwarded
+
+
+def agreement(predicted, actual):
+    """Exact-match rate, within-one rate and mean absolute error of predicted vs. actual scores"""
+    pairs = [(int(p), int(a)) for p, a in zip(predicted, actual)]
+    if not pairs:
+        return {'n': 0, 'exact': 0.0, 'within_one': 0.0, 'mae': 0.0}
+    return {
+        'n': len(pairs),
+        'exact': sum(p == a for p, a in pairs) / len(pairs),
+        'within_one': sum(abs(p - a) <= 1 for p, a in pairs) / len(pairs),
+        'mae': sum(abs(p - a) for p, a in pairs) / len(pairs),
+    }
+
+
+def evaluate(scorer, texts, gemini_scores, threshold=None):
+    """
+    Compares the scorer with Gemini labels on the same texts.
+    Returns the agreement on all tweets, on the confident ones (those the tier would
+    answer itself), and the share of tweets it would divert from Gemini.
+    """
+    threshold = LOCAL_SCORER_CONFIG["confidence_threshold"] if threshold is None else threshold
+    texts, gemini_scores = list(texts), list(gemini_scores)
+    predictions = scorer.predict(texts)
+    confident = [(score, actual) for (score, confidence), actual in zip(predictions, gemini_scores)
+                 if confidence >= threshold]
+    return {
+        'all': agreement([score for score, _ in predictions], gemini_scores),
+        'confident': agreement([p for p, _ in confident], [a for _, a in confident]),
+        'coverage': len(confident) / len(texts) if texts else 0.0,
+    }
+
+
+def format_metrics(metrics):
+    return (f"exact {metrics['exact']:.0%}, within one {metrics['within_one']:.0%}, "
+            f"MAE {metrics['mae']:.2f} (n={metrics['n']})")
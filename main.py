@@ -5,6 +5,19 @@ import argparse
 from datetime import datetime
 from dotenv import load_dotenv
 import glob
+import metrics
+from config import METRICS_CONFIG
+from storage import artifact_path
+import time
+
+# Metrics stage name of every step script (the scripts report under the same names)
+STAGE_NAMES = {
+    "01_scrape_tweets.py": "scrape",
+    "02_clean_tweets.py": "clean",
+    "03_analyze_sentiment.py": "analyze",
+    "04_create_analysis.py": "combine",
+    "05_generate_visualization.py": "visualize",
+}
 
 load_dotenv(dotenv_path='api_keys.env')  # This loads the variables from a custom .env file
 
@@ -29,8 +42,11 @@ def install_requirements():
             return False
     return True
 
-def run_step(step_name, script_name, expected_output_pattern=None, args=None):
-    """Run a Python script and check for successful execution"""
+def run_step(step_name, script_name, expected_output_pattern=None, args=None, measurements=None):
+    """
+    Run a Python script and check for successful execution. The step's wall time and
+    CPU time (including interpreter start-up) are appended to `measurements` if given.
+    """
     print(f"\n{'='*50}")
     print(f"Starting {step_name}...")
     print(f"{'='*50}")
@@ -40,10 +56,20 @@ def run_step(step_name, script_name, expected_output_pattern=None, args=None):
     if args:
         cmd.extend(args)
     
+    started = time.perf_counter()
+    cpu_started = metrics.children_cpu_seconds()
     result = subprocess.run(cmd, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if measurements is not None:
+        measurements.append({
+            'stage': STAGE_NAMES.get(script_name, script_name),
+            'status': 'ok' if result.returncode == 0 else 'failed',
+            'process_wall_seconds': round(elapsed, 3),
+            'process_cpu_seconds': round(metrics.children_cpu_seconds() - cpu_started, 3),
+        })
     
     if result.returncode == 0:
-        print(f"✓ {step_name} completed successfully")
+        print(f"✓ {step_name} completed successfully in {elapsed:.2f}s")
         if result.stdout:
             print("Output:")
             print(result.stdout)
@@ -61,6 +87,102 @@ def check_file_exists(filename_pattern, step_name):
         return False
     return True
 
+def profile_imports(top=5):
+    """
+    Prints the import-time profile (python -X importtime) of main.py and every step
+    script: total import time, and the top-level modules that take longest to load.
+    """
+    print("\n📦 Import-time profile (python -X importtime):")
+    targets = [("main.py", "import main")] + [
+        (script, "import importlib.util as u; spec = u.spec_from_file_location('stage', %r); "
+                 "spec.loader.exec_module(u.module_from_spec(spec))" % script)
+        for script in STAGE_NAMES
+    ]
+    for name, code in targets:
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        modules = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, module = line[len('import time:'):].split('|')
+            # Nested imports are indented; only top-level ones add up to the total
+            if not module.startswith('  '):
+                modules.append((int(cumulative) / 1e6, module.strip()))
+        total = sum(seconds for seconds, _ in modules)
+        slowest = ', '.join(f"{module} {seconds:.2f}s" for seconds, module in sorted(modules, reverse=True)[:top])
+        status = '' if result.returncode == 0 else '  ✗ import failed'
+        print(f"  {name:<30} {total:>6.2f}s imports  {elapsed:>6.2f}s process{status}")
+        print(f"    {slowest}")
+
+def run_build(args, measurements):
+    """
+    Build mode: runs the steps from --start-step on through the build graph (build.py),
+    skipping the ones that are up to date and running the ones whose inputs only grew
+    in their append mode. Returns 0 on success, 1 on failure.
+    """
+    import build
+    if args.start_step <= 1 and not args.query_file:
+        print("✗ --build needs --query-file to scrape (or --start-step 2 to use existing tweets)")
+        return 1
+    raw_file = build.scraped_file(args.query_file) if args.query_file else build.raw_tweets_file()
+    if not raw_file:
+        print("✗ No raw tweets file found. Please run the scraping step first.")
+        return 1
+    manifest = build.load_manifest()
+    manifest['raw_tweets'] = raw_file
+    steps = build.plan_steps(raw_file, query_file=args.query_file if args.start_step <= 1 else None,
+                             incremental=args.incremental, fake_model=args.fake_model, report=args.report)
+    print(f"\n🧱 Build mode: {raw_file} (manifest {build.FILE_PATHS['build_manifest']})")
+
+    for step in [step for step in steps if step['step'] >= args.start_step]:
+        action, reason, *grown = build.check_step(step, manifest, force=args.force)
+        if action == 'skip':
+            print(f"\n⏭️  {step['name']}: {reason}, skipped")
+            measurements.append({'stage': step['stage'], 'status': 'skipped'})
+            continue
+        print(f"\n🔨 {step['name']}: {reason}" + (", processing only the new rows" if action == 'append' else ""))
+        step_args = step['append_args'](*grown) if action == 'append' else step['args']
+        if not run_step(step['name'], step['script'], args=step_args, measurements=measurements):
+            print(f"\n✗ Workflow failed: Failed at {step['name']}")
+            return 1
+        build.record_step(step, manifest)
+    return 0
+
+def run_datasets(args, run_dir, run_id):
+    """
+    Runs steps 2-5 on every dataset named by --datasets in parallel (pipeline.run_datasets)
+    and writes one run report per dataset. Returns 0 if all of them succeeded, else 1.
+    """
+    from config import list_available_datasets
+    from pipeline import run_datasets as run_in_parallel
+    names = list_available_datasets() if args.datasets == 'all' else [
+        name.strip() for name in args.datasets.split(',') if name.strip()]
+    try:
+        results = run_in_parallel(names, workers=args.workers, metrics_dir=run_dir, report=args.report,
+                                  resume=args.resume, fake_model=args.fake_model)
+    except Exception as e:
+        print(f"\n✗ Workflow failed: {str(e)}")
+        return 1
+    for name, result in results.items():
+        finish_run(os.path.join(run_dir, name) if run_dir else None, f"{run_id}/{name}", result)
+    failed = [name for name, result in results.items() if result != 0]
+    if failed:
+        print(f"\n✗ {len(failed)} of {len(results)} datasets failed: {', '.join(failed)}")
+        return 1
+    print(f"\n✓ Workflow completed successfully for {len(results)} datasets!")
+    return 0
+
+def finish_run(run_dir, run_id, result, measurements=()):
+    """Writes and prints the run report of a workflow run (when metrics are enabled)"""
+    if not run_dir:
+        return result
+    report = metrics.write_run_report(run_dir, run_id, 'ok' if result == 0 else 'failed', measurements)
+    print(metrics.format_run_report(report))
+    print(f"Run report saved to {os.path.join(run_dir, 'run_report.json')}")
+    return result
+
 def check_env_variables():
     """Check if required environment variables are set"""
     required_vars = ['GEMINI_API_KEY']
@@ -82,14 +204,60 @@ def main():
                       help='Skip installing requirements')
     parser.add_argument('--query-file', type=str,
                       help='Name of the query file to use for scraping')
+    parser.add_argument('--resume', action='store_true',
+                      help='Resume an interrupted Gemini analysis instead of starting over')
+    parser.add_argument('--incremental', action='store_true',
+                      help='Scrape only new tweets (appending to earlier runs) and analyze just those')
+    parser.add_argument('--fake-model', action='store_true',
+                      help='Use a local fake Gemini model instead of the API (offline runs)')
+    parser.add_argument('--in-process', action='store_true',
+                      help='Run all steps inside this process, passing data between them in memory')
+    parser.add_argument('--no-materialize', action='store_true',
+                      help='With --in-process, skip writing the intermediate CSV files')
+    parser.add_argument('--stream', action='store_true',
+                      help='Scrape, clean, score and aggregate tweets as a stream instead of step by step')
+    parser.add_argument('--fake-client', action='store_true',
+                      help='With --stream, scrape from a local fake Twitter client instead of the cookies (offline runs)')
+    parser.add_argument('--import-profile', action='store_true',
+                      help='Print how long main.py and every step script take to import, then exit')
+    parser.add_argument('--report', action='store_true',
+                      help='Also render the multi-chart report (05_report/) after the visualization')
+    parser.add_argument('--build', action='store_true',
+                      help='Skip steps whose inputs and parameters are unchanged since the last run (build_manifest.json)')
+    parser.add_argument('--force', action='store_true',
+                      help='With --build, run every step even if it is up to date')
+    parser.add_argument('--datasets', type=str,
+                      help='Run steps 2-5 on these datasets from DATASET_CONFIG in parallel '
+                           '(comma-separated names, or "all"), each in runs/<name>/')
+    parser.add_argument('--workers', type=int, default=None,
+                      help='With --datasets, how many datasets run at once (default: DATASET_RUN_CONFIG["workers"])')
     args = parser.parse_args()
+    if args.build and (args.in_process or args.stream):
+        parser.error('--build runs the steps as separate processes; it cannot be combined with --in-process or --stream')
+    if args.datasets and (args.build or args.stream):
+        parser.error('--datasets cannot be combined with --build or --stream')
+    if args.fake_client and not args.stream:
+        parser.error('--fake-client requires --stream (step 1 on its own: 01_scrape_tweets.py --fake-client)')
+
+    if args.import_profile:
+        profile_imports()
+        return 0
 
     # Create timestamp for this run
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     print(f"Starting workflow run at {timestamp}")
     
+    # Every step (subprocess or in-process) writes its metrics into this run's directory
+    run_id = f"run_{timestamp}"
+    run_dir = os.path.join(METRICS_CONFIG["dir"], run_id) if METRICS_CONFIG["enabled"] else None
+    if run_dir:
+        os.environ[metrics.METRICS_DIR_ENV] = run_dir
+    measurements = []
+    
     # Show workflow mode
-    if args.start_step == 1:
+    if args.datasets:
+        print(f"\n🔄 MODE: Registered datasets ({args.datasets}) + Gemini AI analysis, in parallel")
+    elif args.start_step == 1:
         print("\n🔄 MODE: Scraping fresh Twitter data + Gemini AI analysis")
         print("This will scrape live tweets and analyze them with Gemini AI")
     else:
@@ -99,9 +267,9 @@ def main():
     # Define workflow steps with their expected output patterns
     workflow_steps = [
         ("Twitter Scraping", "01_scrape_tweets.py", "01_tweets_*.csv"),
-        ("Tweet Cleaning", "02_clean_tweets.py", "02_cleaned_tweets.csv"),
-        ("Gemini AI Analysis", "03_analyze_sentiment.py", "03_sentiment_labels.csv"),
-        ("Data Analysis", "04_create_analysis.py", "04_data_analysis.csv"),
+        ("Tweet Cleaning", "02_clean_tweets.py", artifact_path("cleaned_tweets")),
+        ("Gemini AI Analysis", "03_analyze_sentiment.py", artifact_path("sentiment_labels")),
+        ("Data Analysis", "04_create_analysis.py", artifact_path("analysis_results")),
         ("Data Visualization", "05_generate_visualization.py", "05_sentiment_analysis.png")
     ]
     
@@ -112,10 +280,41 @@ def main():
             return 1
         
     # Check environment variables
-    if not check_env_variables():
+    if not args.fake_model and not check_env_variables():
         print("✗ Please set up required environment variables in .env file")
         return 1
     
+    if args.datasets:
+        return run_datasets(args, run_dir, run_id)
+    
+    if args.build:
+        result = run_build(args, measurements)
+        if result == 0:
+            print("\n✓ Workflow completed successfully!")
+        return finish_run(run_dir, run_id, result, measurements)
+    
+    if args.stream:
+        from pipeline import run_streaming
+        result = run_streaming(query_file=args.query_file, fake_model=args.fake_model, report=args.report,
+                               fake_client=args.fake_client)
+        if result == 0:
+            print("\n✓ Workflow completed successfully!")
+        return finish_run(run_dir, run_id, result)
+    
+    if args.in_process:
+        from pipeline import run_pipeline
+        result = run_pipeline(
+            start_step=args.start_step,
+            query_file=args.query_file,
+            materialize=not args.no_materialize,
+            report=args.report,
+            resume=args.resume,
+            fake_model=args.fake_model
+        )
+        if result == 0:
+            print("\n✓ Workflow completed successfully!")
+        return finish_run(run_dir, run_id, result)
+    
     try:
         # Check if starting file exists when not starting from beginning
         if args.start_step > 1:
@@ -131,10 +330,14 @@ def main():
                 if i == 1:  # First step is scrape.py
                     if args.query_file:
                         step_args = ['--query-file', args.query_file]
+                        if args.incremental:
+                            step_args.append('--incremental')
                     else:
                         print("\nNo query file specified. Please select a query file:")
                         # Run the script directly without capturing output to show interactive menu
-                        query_selection = subprocess.run([sys.executable, script_name])
+                        query_selection = subprocess.run(
+                            [sys.executable, script_name] + (['--incremental'] if args.incremental else [])
+                        )
                         if query_selection.returncode != 0:
                             raise Exception("Failed to select query file")
                         # After selection, get the selected file
@@ -144,8 +347,15 @@ def main():
                         print(f"\nContinuing with selected query file...")
                         # Skip running the step again since we already ran it
                         continue
+                if i in (2, 4) and args.incremental:
+                    step_args = ['--incremental']
+                if i == 3:
+                    # Incremental runs resume from the existing results so only new tweets are sent to Gemini
+                    step_args = (['--resume'] if args.resume or args.incremental else []) + (['--fake-model'] if args.fake_model else [])
+                if i == 5 and args.report:
+                    step_args = ['--report']
                 
-                if not run_step(step_name, script_name, args=step_args):
+                if not run_step(step_name, script_name, args=step_args, measurements=measurements):
                     raise Exception(f"Failed at {step_name}")
                 if not check_file_exists(output_pattern, step_name):
                     raise Exception(f"No files matching {output_pattern} generated")
@@ -159,9 +369,9 @@ def main():
         
     except Exception as e:
         print(f"\n✗ Workflow failed: {str(e)}")
-        return 1
+        return finish_run(run_dir, run_id, 1, measurements)
     
-    return 0
+    return finish_run(run_dir, run_id, 0, measurements)
 
 if __name__ == "__main__":
     exit(main()) 
\ No newline at end of file
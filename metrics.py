@@ -0,0 +1,289 @@
+# Run metrics for the numbered stages
+#
+# A stage runs inside metrics.stage(name) (or metrics.run_stage for a script's main),
+# which measures wall time, CPU time and peak RSS, and collects the rows in/out,
+# counters (retries, 429s, cache hits, ...) and request latencies recorded through the
+# module-level helpers below while it runs. When a metrics directory is configured
+# (PIPELINE_METRICS_DIR, set by main.py for its child processes, or METRICS_CONFIG) each
+# stage writes `<dir>/<stage>.json`; main.py merges them into one run report and an
+# optional Prometheus textfile.
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import METRICS_CONFIG
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Environment variable through which main.py hands its run directory to the stages
+METRICS_DIR_ENV = 'PIPELINE_METRICS_DIR'
+PERCENTILES = (50, 95, 99)
+PROMETHEUS_PREFIX = 'tweet_pipeline'
+
+
+def peak_rss_mb(who='self'):
+    """Peak resident set size of this process (or of its finished children) in MB, None if unknown"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if os.uname().sysname == 'Darwin' else 1024
+    return round(usage.ru_maxrss * scale / 2**20, 1)
+
+
+def children_cpu_seconds():
+    """User + system CPU time of all finished child processes"""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank q-th percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-q * len(sorted_values) // 100))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class StageMetrics:
+    """Measurements of one stage run"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.status = 'running'
+        self.started_at = None
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.rows_in = None
+        self.rows_out = None
+        self.counters = {}
+        self.latencies = {}
+        self._wall_start = self._cpu_start = None
+
+    def start(self):
+        self.started_at = datetime.now().isoformat(timespec='milliseconds')
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        return self
+
+    def stop(self, status='ok'):
+        self.status = status
+        self.wall_seconds = round(time.perf_counter() - self._wall_start, 3)
+        self.cpu_seconds = round(time.process_time() - self._cpu_start, 3)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        self.latencies.setdefault(name, []).append(seconds)
+
+    def as_dict(self):
+        latencies = {}
+        for name, values in self.latencies.items():
+            values = sorted(values)
+            latencies[name] = {'count': len(values), 'mean': round(sum(values) / len(values), 4)}
+            latencies[name].update({f'p{q}': round(percentile(values, q), 4) for q in PERCENTILES})
+        report = {
+            'stage': self.stage,
+            'status': self.status,
+            'started_at': self.started_at,
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            # Peak of the whole process so far (for in-process runs: up to the end of this stage)
+            'peak_rss_mb': peak_rss_mb(),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'counters': dict(self.counters),
+            'latency_seconds': latencies,
+        }
+        hits, misses = self.counters.get('cache_hits'), self.counters.get('cache_misses')
+        if hits is not None or misses is not None:
+            lookups = (hits or 0) + (misses or 0)
+            report['cache_hit_rate'] = round((hits or 0) / lookups, 4) if lookups else None
+        if self.rows_out is not None and self.wall_seconds:
+            report['rows_per_second'] = round(self.rows_out / self.wall_seconds, 1)
+        return report
+
+
+# Metrics recorded outside of any stage go here and are never written
+_current = StageMetrics('unstaged').start()
+
+
+def current():
+    return _current
+
+
+def count(name, amount=1):
+    """Adds `amount` to the counter `name` of the running stage"""
+    _current.count(name, amount)
+
+
+def observe(name, seconds):
+    """Records one latency sample (seconds) of the call `name`"""
+    _current.observe(name, seconds)
+
+
+@contextmanager
+def timer(name):
+    """Times the enclosed block as one latency sample of `name` (also around an await)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current.observe(name, time.perf_counter() - started)
+
+
+def rows(rows_in=None, rows_out=None):
+    """Sets the row counts of the running stage"""
+    if rows_in is not None:
+        _current.rows_in = rows_in
+    if rows_out is not None:
+        _current.rows_out = rows_out
+
+
+def add_rows(rows_in=0, rows_out=0):
+    """Adds to the row counts of the running stage (for stages that process several inputs)"""
+    _current.rows_in = (_current.rows_in or 0) + rows_in if rows_in else _current.rows_in
+    _current.rows_out = (_current.rows_out or 0) + rows_out if rows_out else _current.rows_out
+
+
+def metrics_dir():
+    """Directory stage reports are written to, or None when metrics are off"""
+    directory = os.environ.get(METRICS_DIR_ENV)
+    if directory:
+        return directory
+    return METRICS_CONFIG["dir"] if METRICS_CONFIG["enabled"] else None
+
+
+def write_json(path, data):
+    """Writes JSON through a temporary file that is then renamed into place"""
+    temp_file = path + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=2)
+    os.replace(temp_file, path)
+
+
+@contextmanager
+def stage(name):
+    """Measures the enclosed block as stage `name` and writes its report on exit"""
+    global _current
+    previous, _current = _current, StageMetrics(name).start()
+    metrics = _current
+    try:
+        yield metrics
+    except BaseException:
+        metrics.stop('failed')
+        raise
+    else:
+        if metrics.status == 'running':
+            metrics.stop()
+    finally:
+        _current = previous
+        directory = metrics_dir()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            write_json(os.path.join(directory, f'{name}.json'), metrics.as_dict())
+
+
+def run_stage(name, main):
+    """Runs a stage script's main() as stage `name`; a non-zero return code marks it failed"""
+    with stage(name) as metrics:
+        result = main()
+        metrics.stop('ok' if not result else 'failed')
+    return result
+
+
+def load_stage_reports(directory):
+    """Stage reports written to `directory`, ordered by start time"""
+    reports = []
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.json') and file_name != 'run_report.json':
+            with open(os.path.join(directory, file_name), encoding='utf-8') as file:
+                reports.append(json.load(file))
+    return sorted(reports, key=lambda report: report.get('started_at') or '')
+
+
+def prometheus_text(report):
+    """Renders a run report in the Prometheus text exposition format (for node_exporter's textfile collector)"""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {PROMETHEUS_PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{name} {kind}')
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+            lines.append(f'{PROMETHEUS_PREFIX}_{name}{{{label_text}}} {value}')
+
+    stages = [stage for stage in report['stages'] if stage.get('wall_seconds') is not None]
+    metric('run_success', 'gauge', 'Whether the last run succeeded', [({'run': report['run_id']}, int(report['status'] == 'ok'))])
+    metric('stage_wall_seconds', 'gauge', 'Wall time of the stage', [({'stage': s['stage']}, s['wall_seconds']) for s in stages])
+    metric('stage_cpu_seconds', 'gauge', 'CPU time of the stage', [({'stage': s['stage']}, s['cpu_seconds']) for s in stages])
+    metric('stage_peak_rss_megabytes', 'gauge', 'Peak resident memory of the stage process',
+           [({'stage': s['stage']}, s['peak_rss_mb']) for s in stages if s.get('peak_rss_mb') is not None])
+    for field in ('rows_in', 'rows_out'):
+        metric(f'stage_{field}', 'gauge', f'Rows {field[5:]} of the stage',
+               [({'stage': s['stage']}, s[field]) for s in stages if s.get(field) is not None])
+    metric('stage_events', 'gauge', 'Event counters of the stage (requests, retries, 429s, cache hits, ...)',
+           [({'stage': s['stage'], 'event': name}, value)
+            for s in stages for name, value in s.get('counters', {}).items()])
+    metric('request_latency_seconds', 'summary', 'Latency of external API calls',
+           [({'stage': s['stage'], 'call': call, 'quantile': str(q / 100)}, values[f'p{q}'])
+            for s in stages for call, values in s.get('latency_seconds', {}).items() for q in PERCENTILES])
+    return '\n'.join(lines) + '\n'
+
+
+def write_run_report(directory, run_id, status, steps=(), prometheus_file=None):
+    """
+    Merges the stage reports in `directory` with main.py's own per-step measurements
+    (`steps`: dicts with stage, status, process_wall_seconds and process_cpu_seconds,
+    which include interpreter start-up and imports) into run_report.json,
+    and into a Prometheus textfile when one is given. Returns the report.
+    """
+    stages = load_stage_reports(directory) if os.path.isdir(directory) else []
+    measured = {step['stage']: step for step in steps}
+    for report in stages:
+        report.update(measured.pop(report['stage'], {}))
+    # Steps that wrote no report of their own (crashed early, metrics disabled in the script)
+    for step in measured.values():
+        stages.append(dict(step, wall_seconds=step.get('process_wall_seconds'),
+                           cpu_seconds=step.get('process_cpu_seconds')))
+    report = {
+        'run_id': run_id,
+        'status': status,
+        'wall_seconds': round(sum(stage.get('process_wall_seconds') or stage.get('wall_seconds') or 0
+                                  for stage in stages), 3),
+        'stages': stages,
+    }
+    os.makedirs(directory, exist_ok=True)
+    write_json(os.path.join(directory, 'run_report.json'), report)
+    prometheus_file = prometheus_file or METRICS_CONFIG["prometheus_textfile"]
+    if prometheus_file:
+        temp_file = prometheus_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            file.write(prometheus_text(report))
+        os.replace(temp_file, prometheus_file)
+    return report
+
+
+def format_run_report(report):
+    lines = [f"\n📏 Run metrics ({report['run_id']}, {report['status']}):"]
+    for stage in report['stages']:
+        rss = f"{stage['peak_rss_mb']:.0f} MB" if stage.get('peak_rss_mb') is not None else '-'
+        rows_out = stage.get('rows_out')
+        lines.append(f"  {stage['stage']:<12} {stage.get('wall_seconds') or 0:>8.2f}s wall "
+                     f"{stage.get('cpu_seconds') or 0:>8.2f}s CPU  {rss:>8} peak"
+                     + (f"  {rows_out} rows out" if rows_out is not None else ''))
+        for call, values in stage.get('latency_seconds', {}).items():
+            lines.append(f"    {call}: {values['count']} calls, p50 {values['p50']:.3f}s / "
+                         f"p95 {values['p95']:.3f}s / p99 {values['p99']:.3f}s")
+        if stage.get('counters'):
+            lines.append('    ' + ', '.join(f"{name} {value}" for name, value in stage['counters'].items()))
+    return '\n'.join(lines)
@@ -0,0 +1,162 @@
+# Pacing of Twitter requests
+#
+# Delays are only ever applied before a network call (search_tweet / next()), never
+# while handling tweets that are already in memory. A RequestScheduler combines the
+# account's request budget (token bucket), a pacing policy for the gap between
+# consecutive requests, and 429 handling, and reports the request rate it observed.
+
+import asyncio
+import random
+import time
+
+from twikit import TooManyRequests
+
+import metrics
+from config import SCRAPE_CONFIG
+from rate_limiter import RateLimiter, backoff_delay
+
+
+class FixedPacing:
+    """Waits the same number of seconds between requests"""
+
+    def __init__(self, delay):
+        self.delay_seconds = delay
+
+    def delay(self):
+        return self.delay_seconds
+
+    def on_success(self):
+        pass
+
+    def on_rate_limited(self, error):
+        pass
+
+
+class JitteredPacing(FixedPacing):
+    """Waits delay ± jitter seconds (uniformly) so requests don't look machine-timed"""
+
+    def __init__(self, delay, jitter):
+        super().__init__(delay)
+        self.jitter = jitter
+
+    def delay(self):
+        return max(0.0, random.uniform(self.delay_seconds - self.jitter, self.delay_seconds + self.jitter))
+
+
+class AdaptivePacing(FixedPacing):
+    """
+    Starts at `delay`, shrinks the gap by 10% after every successful request (down to
+    min_delay) and doubles it after a 429 (up to max_delay). When the error carries
+    x-rate-limit-remaining / x-rate-limit-reset headers, the remaining requests are
+    spread evenly over the time left in the window instead.
+    """
+
+    def __init__(self, delay, min_delay=0.0, max_delay=60.0):
+        super().__init__(delay)
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+    def _clamp(self, seconds):
+        return min(self.max_delay, max(self.min_delay, seconds))
+
+    def on_success(self):
+        self.delay_seconds = self._clamp(self.delay_seconds * 0.9)
+
+    def on_rate_limited(self, error):
+        headers = getattr(error, 'headers', None) or {}
+        remaining = headers.get('x-rate-limit-remaining')
+        reset = headers.get('x-rate-limit-reset')
+        if remaining is not None and reset is not None:
+            window_left = int(reset) - time.time()
+            self.delay_seconds = self._clamp(window_left / max(1, int(remaining)))
+        else:
+            self.delay_seconds = self._clamp(max(self.delay_seconds, 1.0) * 2)
+
+
+def make_pacing(policy=None):
+    """Builds the pacing policy named in SCRAPE_CONFIG["pacing"] (fixed, jittered or adaptive)"""
+    policy = policy or SCRAPE_CONFIG["pacing"]
+    delay = SCRAPE_CONFIG["pacing_delay"]
+    if policy == "fixed":
+        return FixedPacing(delay)
+    if policy == "jittered":
+        return JitteredPacing(delay, SCRAPE_CONFIG["pacing_jitter"])
+    if policy == "adaptive":
+        return AdaptivePacing(delay, SCRAPE_CONFIG["pacing_min_delay"], SCRAPE_CONFIG["pacing_max_delay"])
+    raise ValueError(f"Unknown pacing policy: {policy!r} (expected fixed, jittered or adaptive)")
+
+
+class RequestScheduler:
+    """
+    Central pacing for every Twitter request of a run, shared by all queries scraped
+    over the same account. Requests wait for a slot in the account's request budget and
+    for the pacing policy's gap after the previous request; a 429 pauses all of them
+    until Twitter's x-rate-limit-reset time (or an exponential backoff when none is
+    sent) and the request is retried instead of aborting the scrape.
+    """
+
+    def __init__(self, requests_per_minute=None, max_retries=None, pacing=None, clock=time.monotonic):
+        self.limiter = RateLimiter(requests_per_minute or SCRAPE_CONFIG["requests_per_minute"], clock=clock)
+        self.max_retries = SCRAPE_CONFIG["max_retries"] if max_retries is None else max_retries
+        self.pacing = pacing or make_pacing()
+        self.clock = clock
+        self.requests = 0
+        self.rate_limited = 0
+        self.first_request = None
+        self.last_request = None
+        self._turn = None
+
+    def backoff(self, error, attempt):
+        """Seconds to pause after the TooManyRequests `error` on the given retry attempt"""
+        reset = getattr(error, 'rate_limit_reset', None)
+        if reset:
+            return max(1.0, reset - time.time() + 1)
+        return backoff_delay(attempt, base=SCRAPE_CONFIG["backoff_base"], cap=SCRAPE_CONFIG["backoff_cap"])
+
+    async def _wait_turn(self):
+        await self.limiter.acquire()
+        if self._turn is None:
+            self._turn = asyncio.Lock()
+        # One request at a time claims the next slot so the pacing gap holds across queries
+        async with self._turn:
+            if self.last_request is not None:
+                wait = self.last_request + self.pacing.delay() - self.clock()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            self.last_request = self.clock()
+            if self.first_request is None:
+                self.first_request = self.last_request
+
+    async def call(self, request, *args, **kwargs):
+        """Awaits request(*args, **kwargs) within the budget, retrying on 429"""
+        for attempt in range(self.max_retries + 1):
+            await self._wait_turn()
+            self.requests += 1
+            metrics.count('twitter_requests')
+            try:
+                with metrics.timer('twitter_request'):
+                    result = await request(*args, **kwargs)
+            except TooManyRequests as e:
+                self.rate_limited += 1
+                metrics.count('twitter_rate_limited')
+                self.pacing.on_rate_limited(e)
+                if attempt >= self.max_retries:
+                    raise
+                metrics.count('twitter_retries')
+                wait = self.backoff(e, attempt)
+                print(f"\n⏳ Rate limited by Twitter, pausing all queries for {wait:.0f}s...")
+                self.limiter.penalize(wait)
+                continue
+            self.pacing.on_success()
+            return result
+
+    def observed_rate(self):
+        """Requests per minute actually sent so far"""
+        if self.first_request is None:
+            return 0.0
+        elapsed = self.clock() - self.first_request
+        return self.requests * 60 / elapsed if elapsed > 0 else float(self.requests)
+
+    def summary(self):
+        return (f"{self.requests} requests, {self.rate_limited} rate limited, "
+                f"{self.observed_rate():.1f} requests/min observed")
@@ -0,0 +1,369 @@
+# In-process runner for the numbered pipeline stages
+#
+# Instead of launching every stage as its own Python process and handing data over
+# through CSV files, the stage scripts are imported once and their functions are
+# called directly, passing DataFrames / row iterators from one stage to the next.
+
+import asyncio
+import importlib.util
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stderr, redirect_stdout
+
+import metrics
+from build import raw_tweets_file, use_raw_tweets
+from config import ANALYSIS_CONFIG, DATASET_CONFIG, DATASET_RUN_CONFIG, FILE_PATHS, get_dataset_path
+from rate_limiter import SharedRateLimiter
+from lazy_imports import lazy_import
+from result_log import ResultLog
+from sinks import CsvSink
+from storage import TableWriter, iter_records, read_table, write_table
+
+pd = lazy_import('pandas')
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STAGE_SCRIPTS = {
+    1: "01_scrape_tweets.py",
+    2: "02_clean_tweets.py",
+    3: "03_analyze_sentiment.py",
+    4: "04_create_analysis.py",
+    5: "05_generate_visualization.py",
+}
+
+_loaded_stages = {}
+
+# Gemini rate limiter shared by the workers of a multi-dataset run (set per worker process)
+_shared_limiter = None
+
+
+def load_stage(step):
+    """Imports a numbered stage script as a module (once per process)"""
+    if step not in _loaded_stages:
+        script = STAGE_SCRIPTS[step]
+        module_name = "stage_" + os.path.splitext(script)[0]
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(PROJECT_DIR, script))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+        _loaded_stages[step] = module
+    return _loaded_stages[step]
+
+
+class StageTimer:
+    """
+    Collects wall time and row counts for every stage that runs; each stage is also
+    recorded as a metrics stage named after its function
+    """
+
+    def __init__(self):
+        self.timings = []
+
+    def run(self, name, func, *args, **kwargs):
+        print(f"\n{'='*50}")
+        print(f"Starting {name}...")
+        print(f"{'='*50}")
+        started = time.perf_counter()
+        with metrics.stage(func.__name__) as stage_metrics:
+            result = func(*args, **kwargs)
+            rows = len(result) if hasattr(result, '__len__') else None
+            if stage_metrics.rows_out is None:
+                stage_metrics.rows_out = rows
+        elapsed = time.perf_counter() - started
+        self.timings.append((name, elapsed, rows))
+        print(f"✓ {name} completed in {elapsed:.2f}s")
+        return result
+
+    def report(self):
+        print("\n⏱️  Stage timings:")
+        for name, elapsed, rows in self.timings:
+            rows_text = f"{rows} rows" if rows is not None else ""
+            print(f"  {name:<22} {elapsed:>8.2f}s  {rows_text}")
+        print(f"  {'Total':<22} {sum(t[1] for t in self.timings):>8.2f}s")
+
+
+def scrape(query_file):
+    scraper = load_stage(1)
+    if not query_file:
+        query_file = scraper.select_query_file()
+        if not query_file:
+            raise Exception("No query file was selected")
+    output_file = asyncio.run(scraper.scrape_tweets(query_file))
+    if not output_file:
+        raise Exception("Scraping produced no tweets")
+    return load_stage(2).load_tweets(output_file)
+
+
+def clean(raw_df, materialize=True):
+    cleaned_df = load_stage(2).clean_tweets(raw_df)
+    if materialize:
+        write_table(cleaned_df, 'cleaned_tweets')
+    return cleaned_df
+
+
+def analyze(cleaned_df, materialize=True, **options):
+    """Scores the cleaned tweets and returns their labels as a list of dicts"""
+    analyzer = load_stage(3)
+    tweets = list(zip(cleaned_df['Tweet_count'].astype(str), cleaned_df['Text'].astype(str)))
+    analyzer.score_tweets(tweets, input_file="(in-process)", **options)
+    if materialize:
+        analyzer.export_labels()
+    return list(analyzer.iter_labels())
+
+
+def combine(raw_df, labels, materialize=True):
+    analysis = load_stage(4)
+    tweet_rows = raw_df.astype({'Tweet_count': str}).to_dict('records')
+    rows = analysis.join_sentiment(tweet_rows, labels)
+    analysis_df = pd.DataFrame(rows, columns=analysis.ANALYSIS_COLUMNS)
+    if materialize:
+        write_table(analysis_df, 'analysis_results')
+        with analysis.RollupStore(truncate=True) as store:
+            for row in analysis_df.itertuples(index=False):
+                store.add(row.id, row.score, row.date, row.retweets, row.likes)
+            store.export()
+    return analysis_df
+
+
+def visualize(analysis_df):
+    load_stage(5).render_sentiment(analysis_df, FILE_PATHS["visualization"])
+    return analysis_df
+
+
+def build_report(analysis_df):
+    from report import generate_report
+    return generate_report(analysis_df)
+
+
+def run_pipeline(start_step=1, query_file=None, materialize=True, report=False, **analysis_options):
+    """
+    Runs stages start_step..5 in this process. Inputs of the first stage that runs are
+    read from the files of a previous run; everything after that is passed in memory.
+    Intermediate CSVs are only written when materialize is True; with report=True the
+    multi-chart report is rendered after the visualization.
+    Returns 0 on success, 1 on failure.
+    """
+    timer = StageTimer()
+    try:
+        if start_step <= 1:
+            raw_df = timer.run("Twitter Scraping", scrape, query_file)
+        else:
+            raw_file = raw_tweets_file()
+            if not raw_file:
+                raise Exception(f"No files matching {FILE_PATHS['raw_tweets']} found")
+            raw_df = load_stage(2).load_tweets(raw_file)
+
+        if start_step <= 2:
+            cleaned_df = timer.run("Tweet Cleaning", clean, raw_df, materialize)
+        elif start_step == 3:
+            cleaned_df = read_table('cleaned_tweets')
+
+        if start_step <= 3:
+            labels = timer.run("Gemini AI Analysis", analyze, cleaned_df, materialize, **analysis_options)
+        elif start_step == 4:
+            labels = list(iter_records('sentiment_labels'))
+
+        if start_step <= 4:
+            analysis_df = timer.run("Data Analysis", combine, raw_df, labels, materialize)
+        else:
+            analysis_df = read_table('analysis_results')
+
+        timer.run("Data Visualization", visualize, analysis_df)
+        if report:
+            timer.run("Report", build_report, analysis_df)
+    except Exception as e:
+        print(f"\n✗ Workflow failed: {str(e)}")
+        timer.report()
+        return 1
+
+    timer.report()
+    return 0
+
+
+async def stream_tweets(query_file, minimum_tweets=None, batch_size=ANALYSIS_CONFIG["batch_size"],
+                        concurrency=ANALYSIS_CONFIG["concurrency"], fake_model=False, client=None):
+    """
+    Streaming end-to-end run: every tweet is cleaned as it arrives from the scraper,
+    queued (at most ANALYSIS_CONFIG["stream_queue_size"] at a time) for scoring, and
+    folded into running aggregates as soon as its score comes back; the running
+    averages are printed every ANALYSIS_CONFIG["stream_summary_seconds"]. The usual
+    01-04 files are written as the data flows. Returns the final RunningSentiment.
+    """
+    from text_cleaning import clean_text
+    scraper, analyzer, analysis = (load_stage(step) for step in (1, 3, 4))
+    minimum_tweets = minimum_tweets or scraper.MINIMUM_TWEETS
+    query = scraper.load_query(query_file)
+    client = client or scraper.load_client()
+    if not client:
+        raise Exception("Could not create a Twitter client")
+
+    raw_file = f"01_tweets_{os.path.splitext(os.path.basename(query_file))[0]}.csv"
+    aggregate = analysis.RunningSentiment()
+    # Raw fields of tweets that are waiting to be scored; entries leave once scored
+    waiting = {}
+    last_summary = None
+
+    with CsvSink(raw_file, scraper.CSV_HEADER) as raw_sink, \
+         TableWriter('cleaned_tweets', scraper.CSV_HEADER) as cleaned_writer, \
+         TableWriter('analysis_results', analysis.ANALYSIS_COLUMNS) as combined_writer, \
+         analysis.RollupStore(truncate=True) as rollups, \
+         ResultLog(FILE_PATHS["raw_json"], fsync_every=ANALYSIS_CONFIG["fsync_every"], truncate=True) as result_log:
+        async def cleaned_tweets():
+            try:
+                async for row in scraper.iter_tweets(client, query, minimum_tweets):
+                    raw_sink.write_row(row)
+                    text = clean_text(row[2])
+                    if not text:
+                        continue
+                    cleaned_writer.write_row(row[:2] + [text] + row[3:])
+                    waiting[str(row[0])] = (row[3], row[1], row[4], row[5])
+                    yield str(row[0]), text
+            except Exception as e:
+                # Stop scraping but let the tweets already queued finish scoring
+                print(f"\nScraping stopped early: {type(e).__name__}: {str(e)}")
+
+        def on_result(result):
+            nonlocal last_summary
+            result_log.append(result)
+            date, username, retweets, likes = waiting.pop(result['id'], ('', '', 0, 0))
+            aggregate.add(result['stance_score'], date)
+            rollups.add(result['id'], result['stance_score'], date, retweets, likes)
+            combined_writer.write_row([result['id'], result['stance_score'], date, username, retweets, likes])
+            # Printing every result would slow down (and flood) a fast stream
+            now = time.monotonic()
+            if last_summary is None or now - last_summary >= ANALYSIS_CONFIG["stream_summary_seconds"]:
+                print(f"\n📈 {aggregate.summary()}")
+                last_summary = now
+
+        _, failed_ids = await analyzer.analyze_concurrent(
+            cleaned_tweets(), analyzer.create_model(fake_model), analyzer.create_limiter(),
+            batch_size=max(1, batch_size),
+            concurrency=concurrency,
+            on_result=on_result,
+            max_queued=ANALYSIS_CONFIG["stream_queue_size"]
+        )
+        if failed_ids:
+            print(f"⚠️  {len(failed_ids)} tweets could not be scored")
+        rollups.export()
+
+    analyzer.export_labels()
+    use_raw_tweets(raw_file)
+    metrics.rows(rows_out=aggregate.count)
+    return aggregate
+
+
+def run_streaming(query_file=None, fake_model=False, report=False, fake_client=False):
+    """
+    Runs the streaming mode followed by the visualization (fake_client: scrape from a
+    local fakes.FakeTwitterClient). Returns 0 on success, 1 on failure
+    """
+    timer = StageTimer()
+    try:
+        if not query_file:
+            query_file = load_stage(1).select_query_file()
+            if not query_file:
+                raise Exception("No query file was selected")
+        client = None
+        if fake_client:
+            from fakes import FakeTwitterClient
+            client = FakeTwitterClient()
+        def stream():
+            return asyncio.run(stream_tweets(query_file, fake_model=fake_model, client=client))
+        aggregate = timer.run("Streaming Analysis", stream)
+        print(f"\n📊 Final: {aggregate.summary()}")
+        for day, count, mean in aggregate.daily_rows():
+            print(f"  {day}: {count} tweets, mean score {mean}")
+        if not aggregate.count:
+            raise Exception("No tweets were scored")
+        analysis_df = read_table('analysis_results')
+        timer.run("Data Visualization", visualize, analysis_df)
+        if report:
+            timer.run("Report", build_report, analysis_df)
+    except Exception as e:
+        print(f"\n✗ Workflow failed: {str(e)}")
+        timer.report()
+        return 1
+
+    timer.report()
+    return 0
+
+
+def dataset_dir(name):
+    """Directory holding every file of a registered dataset's runs"""
+    return os.path.join(FILE_PATHS["runs_dir"], name)
+
+
+def _init_dataset_worker(limiter):
+    global _shared_limiter
+    _shared_limiter = limiter
+
+
+def run_dataset(name, source, directory, metrics_dir=None, **options):
+    """
+    Worker task: runs steps 2-5 in-process on one dataset inside its own directory, so
+    its 02_-05_ files, caches and manifest never clash with those of other datasets.
+    Everything the steps print goes to <directory>/run.log.
+    Returns (name, 0 on success / 1 on failure, seconds).
+    Pool workers are reused across datasets, so the metrics directory is set (or
+    cleared) for every task and the working directory is restored afterwards.
+    """
+    if metrics_dir:
+        os.environ[metrics.METRICS_DIR_ENV] = metrics_dir
+    else:
+        os.environ.pop(metrics.METRICS_DIR_ENV, None)
+    os.makedirs(directory, exist_ok=True)
+    previous_dir = os.getcwd()
+    os.chdir(directory)
+    try:
+        started = time.perf_counter()
+        with open('run.log', 'w', encoding='utf-8') as log, redirect_stdout(log), redirect_stderr(log):
+            use_raw_tweets(source)
+            result = run_pipeline(start_step=2, limiter=_shared_limiter, **options)
+        return name, result, time.perf_counter() - started
+    finally:
+        os.chdir(previous_dir)
+
+
+def run_datasets(names, workers=None, metrics_dir=None, **options):
+    """
+    Runs steps 2-5 on several datasets registered in config.DATASET_CONFIG, in parallel
+    worker processes and each in FILE_PATHS["runs_dir"]/<name>. All workers draw from
+    one Gemini request/token budget (ANALYSIS_CONFIG), so together they stay within the
+    quota of a single run. Stage metrics go to metrics_dir/<name> if given; options are
+    passed on to run_pipeline. Returns {name: 0 on success / 1 on failure}.
+    """
+    unknown = [name for name in names if name not in DATASET_CONFIG]
+    if unknown:
+        raise Exception(f"Unknown datasets: {', '.join(unknown)} (available: {', '.join(DATASET_CONFIG)})")
+    sources = {name: os.path.abspath(get_dataset_path(name)) for name in names}
+    missing = [source for source in sources.values() if not os.path.exists(source)]
+    if missing:
+        raise Exception(f"Dataset files not found: {', '.join(missing)}")
+
+    workers = min(len(names), workers or DATASET_RUN_CONFIG["workers"] or os.cpu_count() or 1)
+    limiter = SharedRateLimiter(ANALYSIS_CONFIG["requests_per_minute"], ANALYSIS_CONFIG["tokens_per_minute"] or None)
+    print(f"\n🗂️  Running {len(names)} datasets with {workers} workers "
+          f"(shared Gemini budget: {ANALYSIS_CONFIG['requests_per_minute']} requests/min)")
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_dataset_worker, initargs=(limiter,)) as executor:
+        futures = {
+            executor.submit(run_dataset, name, sources[name], os.path.abspath(dataset_dir(name)),
+                            os.path.abspath(os.path.join(metrics_dir, name)) if metrics_dir else None,
+                            **options): name
+            for name in names
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                _, result, elapsed = future.result()
+            except Exception as e:
+                print(f"  ✗ {name}: {type(e).__name__}: {str(e)}")
+                results[name] = 1
+                continue
+            log_file = os.path.join(dataset_dir(name), 'run.log')
+            print(f"  {'✓' if result == 0 else '✗'} {name}: {elapsed:.1f}s (log: {log_file})")
+            results[name] = result
+    return results
@@ -0,0 +1,153 @@
+# Token-bucket rate limiting shared by the API-calling stages
+
+import asyncio
+import multiprocessing
+import random
+import time
+
+
+class TokenBucket:
+    """Classic token bucket: refills at rate_per_minute, holds at most capacity tokens"""
+
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        # Default burst: a quarter of a minute's allowance, never less than one token
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_minute / 4)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, amount=1):
+        """
+        Takes amount tokens if available. Returns 0 on success, otherwise the number of
+        seconds to wait before the tokens will be available.
+        Requests larger than the bucket are clamped so they can still go through.
+        """
+        amount = min(amount, self.capacity)
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Paces API calls by requests-per-minute and (estimated) tokens-per-minute"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None, clock=time.monotonic):
+        self.clock = clock
+        self.requests = TokenBucket(requests_per_minute, clock=clock)
+        self.tokens = TokenBucket(tokens_per_minute, clock=clock) if tokens_per_minute else None
+        self.blocked_until = 0.0
+        self._lock = self._lock_loop = None
+
+    def _wait_time(self, tokens):
+        blocked = self.blocked_until - self.clock()
+        if blocked > 0:
+            return blocked
+        wait = self.requests.try_acquire(1)
+        if wait:
+            return wait
+        if self.tokens:
+            wait = self.tokens.try_acquire(tokens)
+            if wait:
+                # Give the request slot back; we will retry both together
+                self.requests.tokens += 1
+                return wait
+        return 0.0
+
+    async def acquire(self, tokens=1):
+        """Waits until one request carrying `tokens` tokens may be sent"""
+        # An asyncio lock only works in the event loop it was first used in; a limiter that
+        # outlives one asyncio.run (a pool worker running several datasets) needs a new one
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock, self._lock_loop = asyncio.Lock(), loop
+        # The lock keeps waiters in FIFO order so one caller can't starve the others
+        async with self._lock:
+            while True:
+                wait = self._wait_time(tokens)
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+
+    def penalize(self, seconds):
+        """Pauses every caller for `seconds`, e.g. after the API answered 429"""
+        self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket whose level lives in shared memory, so several processes draw from one budget"""
+
+    def __init__(self, rate_per_minute, capacity=None, clock=time.time, context=multiprocessing):
+        self._state = context.RawArray('d', 2)  # tokens, last refill
+        super().__init__(rate_per_minute, capacity, clock)
+
+    @property
+    def tokens(self):
+        return self._state[0]
+
+    @tokens.setter
+    def tokens(self, value):
+        self._state[0] = value
+
+    @property
+    def updated(self):
+        return self._state[1]
+
+    @updated.setter
+    def updated(self, value):
+        self._state[1] = value
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter for several worker processes sharing one API quota. The buckets and the
+    429 pause are kept in shared memory and updated under a multiprocessing lock; the
+    clock is wall time, which (unlike time.monotonic) every process reads the same.
+    Hand it to the workers when they are started (e.g. a process pool initializer),
+    not through a task queue.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None, clock=time.time, context=multiprocessing):
+        self.clock = clock
+        self.requests = SharedTokenBucket(requests_per_minute, clock=clock, context=context)
+        self.tokens = SharedTokenBucket(tokens_per_minute, clock=clock, context=context) if tokens_per_minute else None
+        self._blocked = context.RawValue('d', 0.0)
+        self._shared_lock = context.Lock()
+        self._lock = self._lock_loop = None
+
+    @property
+    def blocked_until(self):
+        return self._blocked.value
+
+    @blocked_until.setter
+    def blocked_until(self, value):
+        self._blocked.value = value
+
+    def _wait_time(self, tokens):
+        with self._shared_lock:
+            return super()._wait_time(tokens)
+
+    def penalize(self, seconds):
+        with self._shared_lock:
+            super().penalize(seconds)
+
+    def __getstate__(self):
+        # The asyncio lock belongs to the process that created it
+        return dict(self.__dict__, _lock=None, _lock_loop=None)
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter for the given (0-based) attempt"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) used for tokens-per-minute pacing"""
+    return len(text) // 4 + 1
@@ -0,0 +1,204 @@
+# Multi-chart report for one analysis run
+#
+# Lives in its own (importable) module so the process-pool workers can load it
+# regardless of how the numbered stage script was started. The analysis columns are
+# saved once as .npy files in a scratch directory and every worker maps them read-only
+# (np.load(mmap_mode='r')) instead of receiving a pickled copy of the data. Each task
+# renders one figure; figures and the index are written to a temporary file and then
+# renamed into place, so an interrupted run never leaves a half-written chart.
+
+import html
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from config import FILE_PATHS, REPORT_CONFIG
+from pipeline import load_stage
+from storage import read_table, to_timestamps
+
+# Columns shared with the workers: name -> dtype of the memory-mapped array
+SHARED_COLUMNS = {
+    'date': 'int64',        # UTC nanoseconds, NaT for unparsable dates
+    'score': 'int8',        # 1-5, 0 when the tweet has no score
+    'engagement': 'int64',  # 1 + retweets + likes
+    'user': 'int32',        # index into the report's user list
+}
+SCORE_LABELS = ['Very Unsatisfied', 'Unsatisfied', 'Neutral', 'Satisfied', 'Very Satisfied']
+SCORE_COLORS = ['red', 'orange', 'gray', 'lightgreen', 'green']
+
+
+def atomic_write_text(path, text):
+    """Writes a text file through a temporary file in the same directory"""
+    temp_file = path + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(temp_file, path)
+
+
+def share_columns(df, directory):
+    """
+    Saves the analysis columns as .npy files in `directory` for the workers.
+    Returns the usernames, in the order of the 'user' codes.
+    """
+    dates = to_timestamps(df['date'])
+    scores = pd.to_numeric(df['score'], errors='coerce').fillna(0)
+    retweets = pd.to_numeric(df['retweets'], errors='coerce').fillna(0)
+    likes = pd.to_numeric(df['likes'], errors='coerce').fillna(0)
+    codes, users = pd.factorize(df['username'].fillna('').astype(str))
+    columns = {
+        'date': dates.dt.tz_convert(None).to_numpy('datetime64[ns]').view('int64'),
+        'score': scores.to_numpy(),
+        'engagement': (1 + retweets + likes).to_numpy(),
+        'user': codes,
+    }
+    for name, dtype in SHARED_COLUMNS.items():
+        np.save(os.path.join(directory, f'{name}.npy'), np.asarray(columns[name], dtype=dtype))
+    return list(users)
+
+
+def load_columns(directory):
+    """Memory-maps the columns saved by share_columns"""
+    return {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in SHARED_COLUMNS}
+
+
+def plan_charts(columns, users, top_users=None):
+    """The report's charts as (name, title, kind, params) tasks"""
+    top_users = REPORT_CONFIG["top_users"] if top_users is None else top_users
+    counts = np.bincount(np.asarray(columns['user'])[_scored(columns)], minlength=len(users))
+    busiest = [int(code) for code in np.argsort(-counts, kind='stable') if counts[code]]
+    charts = [
+        ('sentiment_over_time', 'Sentiment over time', 'timeseries', {}),
+        ('score_distribution', 'Score distribution', 'distribution', {}),
+        ('engagement_vs_score', 'Engagement vs. score', 'engagement', {}),
+        ('user_volume', f'Top {len(busiest[:top_users])} users by volume', 'users',
+         {'codes': busiest[:top_users], 'names': [users[code] for code in busiest[:top_users]]}),
+    ]
+    # One time series per busiest user
+    for rank, code in enumerate(busiest[:REPORT_CONFIG["user_charts"]], 1):
+        charts.append((f'user_{rank:02d}', f'Sentiment of @{users[code]} over time', 'timeseries', {'user': code}))
+    return charts
+
+
+def _scored(columns):
+    return np.asarray(columns['score']) > 0
+
+
+def render_timeseries(columns, params):
+    visualization = load_stage(5)
+    rows = _scored(columns)
+    if 'user' in params:
+        rows &= np.asarray(columns['user']) == params['user']
+    df = pd.DataFrame({
+        'date': pd.to_datetime(np.asarray(columns['date'])[rows], utc=True),
+        'score': np.asarray(columns['score'])[rows],
+    })
+    visualization.draw_buckets(visualization.bucket_means(df))
+
+
+def render_distribution(columns, params):
+    counts = np.bincount(np.asarray(columns['score'])[_scored(columns)], minlength=6)[1:]
+    total = max(1, counts.sum())
+    plt.figure(figsize=(10, 6))
+    bars = plt.bar([f'{score}: {label}' for score, label in enumerate(SCORE_LABELS, 1)], counts, color=SCORE_COLORS)
+    for bar, count in zip(bars, counts):
+        plt.annotate(f'{count} ({count / total:.0%})', (bar.get_x() + bar.get_width() / 2, bar.get_height()),
+                     ha='center', va='bottom')
+    plt.ylabel('Tweets')
+
+
+def render_engagement(columns, params):
+    rows = _scored(columns)
+    scores = np.asarray(columns['score'])[rows]
+    engagement = np.asarray(columns['engagement'])[rows]
+    counts = np.bincount(scores, minlength=6)[1:]
+    totals = np.bincount(scores, weights=engagement, minlength=6)[1:]
+    means = np.divide(totals, counts, out=np.zeros(5), where=counts > 0)
+    medians = [np.median(engagement[scores == score]) if count else 0 for score, count in zip(range(1, 6), counts)]
+    plt.figure(figsize=(10, 6))
+    positions = np.arange(1, 6)
+    plt.bar(positions - 0.2, means, width=0.4, color=SCORE_COLORS, label='Mean')
+    plt.bar(positions + 0.2, medians, width=0.4, color=SCORE_COLORS, alpha=0.5, label='Median')
+    plt.xticks(positions, [f'{score}: {label}' for score, label in enumerate(SCORE_LABELS, 1)])
+    plt.ylabel('Engagement (1 + retweets + likes)')
+    plt.legend()
+
+
+def render_users(columns, params):
+    rows = _scored(columns)
+    codes = np.asarray(columns['user'])[rows]
+    top = np.array(params['codes'], dtype=int)
+    size = top.max() + 1 if len(top) else 0
+    counts = np.bincount(codes, minlength=size)[:size]
+    means = np.bincount(codes, weights=np.asarray(columns['score'])[rows], minlength=size)[:size] / np.maximum(counts, 1)
+    # Busiest user at the top
+    plt.figure(figsize=(10, max(4, 0.35 * len(top))))
+    colors = plt.get_cmap('RdYlGn')((means[top][::-1] - 1) / 4)
+    plt.barh([f'@{name}' for name in params['names'][::-1]], counts[top][::-1], color=colors)
+    plt.colorbar(plt.cm.ScalarMappable(cmap='RdYlGn', norm=plt.Normalize(1, 5)), ax=plt.gca(), label='Mean score')
+    plt.xlabel('Tweets')
+
+
+RENDERERS = {
+    'timeseries': render_timeseries,
+    'distribution': render_distribution,
+    'engagement': render_engagement,
+    'users': render_users,
+}
+
+
+def render_chart(data_directory, chart, output_file):
+    """Worker task: renders one planned chart from the shared columns to output_file"""
+    name, title, kind, params = chart
+    RENDERERS[kind](load_columns(data_directory), params)
+    plt.title(title)
+    plt.tight_layout()
+    load_stage(5).save_figure(output_file)
+    return output_file
+
+
+def write_index(output_dir, charts):
+    """Writes index.html and report.json listing the charts of the report"""
+    sections = '\n'.join(
+        f'<h2>{html.escape(title)}</h2>\n<img src="{name}.png" alt="{html.escape(title)}">'
+        for name, title, _, _ in charts
+    )
+    atomic_write_text(os.path.join(output_dir, 'index.html'),
+                      f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Sentiment report</title></head>\n'
+                      f'<body>\n<h1>Sentiment report</h1>\n{sections}\n</body></html>\n')
+    atomic_write_text(os.path.join(output_dir, 'report.json'), json.dumps(
+        [{'name': name, 'title': title, 'file': f'{name}.png'} for name, title, _, _ in charts], indent=2
+    ))
+
+
+def generate_report(df=None, output_dir=None, workers=None):
+    """
+    Renders the report charts for an analysis DataFrame (default: the step 4 output)
+    into output_dir, `workers` figures at a time. Returns the written chart paths.
+    """
+    output_dir = output_dir or FILE_PATHS["report_dir"]
+    workers = workers or REPORT_CONFIG["workers"] or os.cpu_count() or 1
+    if df is None:
+        df = read_table('analysis_results')
+    os.makedirs(output_dir, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(prefix='05_report_') as data_directory:
+        users = share_columns(df, data_directory)
+        charts = plan_charts(load_columns(data_directory), users)
+        outputs = [os.path.join(output_dir, f'{name}.png') for name, _, _, _ in charts]
+        print(f"Rendering {len(charts)} charts for {len(df)} tweets with {min(workers, len(charts))} workers...")
+        if workers <= 1:
+            written = [render_chart(data_directory, chart, output) for chart, output in zip(charts, outputs)]
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(charts))) as executor:
+                written = list(executor.map(render_chart, [data_directory] * len(charts), charts, outputs))
+
+    write_index(output_dir, charts)
+    print(f"Report saved to {os.path.join(output_dir, 'index.html')}")
+    return written
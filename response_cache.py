@@ -0,0 +1,105 @@
+# Persistent, content-addressed cache of Gemini analyses
+
+import hashlib
+import json
+import re
+import sqlite3
+import time
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """Normalizes tweet text so trivially different copies share a cache entry"""
+    return WHITESPACE.sub(' ', str(text)).strip().casefold()
+
+
+def make_cache_key(model_name, prompt_version, text):
+    """Hash of model name + prompt template version + normalized tweet text"""
+    payload = f"{model_name}\x00{prompt_version}\x00{normalize_text(text)}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache mapping a cache key to an analysis result
+    ({stance_score, explanation}). Entries older than max_age_days are dropped, and
+    the least recently used entries are evicted once there are more than max_entries.
+    """
+
+    def __init__(self, path, max_entries=None, max_age_days=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.conn.commit()
+        self.evict()
+
+    def _expired(self, created_at):
+        return self.max_age_days is not None and time.time() - created_at > self.max_age_days * 86400
+
+    def get(self, key):
+        """Returns the cached result for key, or None (counting a hit or a miss)"""
+        row = self.conn.execute(
+            "SELECT result, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or self._expired(row[1]):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        """Stores a result under key, replacing any previous entry"""
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, result, created_at, last_used) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(result), now, now)
+        )
+        self.conn.commit()
+
+    def evict(self):
+        """Drops expired entries and trims the cache to max_entries. Returns rows removed"""
+        removed = 0
+        if self.max_age_days is not None:
+            cutoff = time.time() - self.max_age_days * 86400
+            removed += self.conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,)).rowcount
+        if self.max_entries is not None:
+            removed += self.conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,)).rowcount
+        self.conn.commit()
+        return removed
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self):
+        """Hit/miss counters for this session"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self)
+        }
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,76 @@
+# Append-only JSONL log of analysis results
+
+import json
+import os
+
+
+class ResultLog:
+    """
+    Appends one JSON record per line. Writes are buffered and fsync'd every
+    `fsync_every` records (and on close), so persisting a result costs the same no
+    matter how large the log already is. A crash can at worst leave a torn last line,
+    which read_results skips and the next writer terminates before appending.
+    """
+
+    def __init__(self, path, fsync_every=100, truncate=False):
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self.pending = 0
+        self.count = 0
+
+        if not truncate and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                torn_tail = file.read(1) != b'\n'
+        else:
+            torn_tail = False
+
+        self.file = open(path, 'w' if truncate else 'a', encoding='utf-8')
+        if torn_tail:
+            # Terminate the partial record from a crashed run so ours starts on a new line
+            self.file.write('\n')
+
+    def append(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.count += 1
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            self.flush()
+
+    def flush(self):
+        """Flushes buffered records and fsyncs them to disk"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_results(path):
+    """
+    Yields the records of a result log one at a time.
+    Torn or otherwise unparseable lines (e.g. from a crash mid-write) are skipped.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping unreadable record on line {line_number} of {path}")
+                continue
+            if isinstance(record, dict):
+                yield record
@@ -0,0 +1,200 @@
+# Output sinks for scraped tweet rows
+#
+# The scraper hands every row to one or more sinks instead of writing files itself.
+# File sinks keep a single buffered handle open, write to `<path>.part` and only move
+# the data into `<path>` when closed normally, so a crashed or killed run leaves a
+# `.part` file behind instead of a silently truncated output file.
+
+import csv
+import json
+import os
+import shutil
+
+from lazy_imports import lazy_import
+from storage import _pyarrow, apply_column_types
+
+pd = lazy_import('pandas')
+
+PART_SUFFIX = '.part'
+
+
+class Sink:
+    """Base class: receives rows (lists in `columns` order) until closed"""
+
+    def write_row(self, row):
+        raise NotImplementedError
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def abort(self):
+        """Stops without finalizing the output (used when the run crashed)"""
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class FileSink(Sink):
+    """
+    Writes to `<path>.part` through one buffered handle, flushing every `flush_every`
+    rows. close() renames the part file over `path`, or with append=True appends its
+    contents to an existing `path`.
+    """
+
+    def __init__(self, path, append=False, flush_every=100, binary=False):
+        self.path = path
+        self.part_path = path + PART_SUFFIX
+        self.append = append and os.path.exists(path)
+        self.flush_every = max(1, flush_every)
+        self.pending = 0
+        self.rows_written = 0
+        if binary:
+            self.file = open(self.part_path, 'wb')
+        else:
+            self.file = open(self.part_path, 'w', newline='', encoding='utf-8', buffering=1 << 16)
+
+    def _row_written(self):
+        self.rows_written += 1
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.pending = 0
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        if self.append:
+            with open(self.part_path, 'rb') as part, open(self.path, 'ab') as target:
+                shutil.copyfileobj(part, target)
+            os.remove(self.part_path)
+        else:
+            os.replace(self.part_path, self.path)
+
+    def abort(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+        print(f"\n⚠️  Incomplete output left in {self.part_path}")
+
+
+class CsvSink(FileSink):
+    """CSV rows under `header` (the header is skipped when appending to an existing file)"""
+
+    def __init__(self, path, header, append=False, flush_every=100):
+        super().__init__(path, append=append, flush_every=flush_every)
+        self.writer = csv.writer(self.file)
+        if not self.append:
+            self.writer.writerow(header)
+
+    def write_row(self, row):
+        self.writer.writerow(row)
+        self._row_written()
+
+
+class JsonlSink(FileSink):
+    """One JSON object per row, keyed by `columns`"""
+
+    def __init__(self, path, columns, append=False, flush_every=100):
+        super().__init__(path, append=append, flush_every=flush_every)
+        self.columns = columns
+
+    def write_row(self, row):
+        self.file.write(json.dumps(dict(zip(self.columns, row)), ensure_ascii=False, default=str) + '\n')
+        self._row_written()
+
+
+class ParquetSink(FileSink):
+    """Typed Parquet file, written in row groups of `buffer_rows` rows (requires pyarrow)"""
+
+    def __init__(self, path, columns, buffer_rows=10_000):
+        self.pyarrow = _pyarrow()
+        super().__init__(path, append=False, flush_every=buffer_rows, binary=True)
+        self.columns = columns
+        self.rows = []
+        self.parquet_writer = None
+
+    def write_row(self, row):
+        self.rows.append(row)
+        self._row_written()
+
+    def _write_table(self, rows):
+        table = self.pyarrow.Table.from_pandas(
+            apply_column_types(pd.DataFrame(rows, columns=self.columns)), preserve_index=False
+        )
+        if self.parquet_writer is None:
+            self.parquet_writer = self.pyarrow.parquet.ParquetWriter(self.file, table.schema)
+        else:
+            table = table.cast(self.parquet_writer.schema)
+        self.parquet_writer.write_table(table)
+
+    def flush(self):
+        if self.rows:
+            self._write_table(self.rows)
+            self.rows = []
+        self.pending = 0
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        if self.parquet_writer is None:
+            # Nothing was written: still produce a valid (empty) file
+            self._write_table([])
+        self.parquet_writer.close()
+        super().close()
+
+
+class QueueSink(Sink):
+    """Puts rows on a queue (queue.Queue or asyncio.Queue) for a consumer; None marks the end"""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def write_row(self, row):
+        self.queue.put_nowait(row)
+
+    def close(self):
+        self.queue.put_nowait(None)
+
+
+class TeeSink(Sink):
+    """Writes every row to several sinks"""
+
+    def __init__(self, *sinks):
+        self.sinks = list(sinks)
+
+    def write_row(self, row):
+        for sink in self.sinks:
+            sink.write_row(row)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def abort(self):
+        for sink in self.sinks:
+            sink.abort()
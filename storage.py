@@ -0,0 +1,191 @@
+# Storage backend for the intermediate pipeline artifacts (CSV or Parquet)
+#
+# The 02_/03_/04_ artifacts are written and read through these helpers so the format
+# can be switched in config.STORAGE_CONFIG. Parquet (requires pyarrow) stores typed
+# columns - integer ids, int8 scores, real timestamps - and is read memory-mapped.
+
+import csv
+import os
+
+from config import FILE_PATHS, STORAGE_CONFIG
+from lazy_imports import lazy_import
+
+pd = lazy_import('pandas')
+
+# Column types used for Parquet artifacts; columns not listed stay strings
+COLUMN_TYPES = {
+    'Tweet_count': 'int64',
+    'id': 'int64',
+    'Retweets': 'int64',
+    'Likes': 'int64',
+    'retweets': 'int64',
+    'likes': 'int64',
+    'score': 'int8',
+    'Created At': 'timestamp',
+    'date': 'timestamp',
+}
+
+TWITTER_DATE_FORMAT = '%a %b %d %H:%M:%S %z %Y'
+
+
+def use_parquet():
+    return STORAGE_CONFIG["format"] == "parquet"
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        raise ImportError('STORAGE_CONFIG["format"] is "parquet" but pyarrow is not installed. '
+                          'Run: pip install pyarrow')
+
+
+def artifact_path(key):
+    """File path of an artifact in the configured format (e.g. 02_cleaned_tweets.parquet)"""
+    path = FILE_PATHS[key]
+    if use_parquet() and path.endswith('.csv'):
+        return path[:-len('.csv')] + '.parquet'
+    return path
+
+
+def to_timestamps(values):
+    """Parses tweet dates (Twitter's Created At format, or anything pandas understands)"""
+    parsed = pd.to_datetime(values, format=TWITTER_DATE_FORMAT, errors='coerce', utc=True)
+    if parsed.isna().any():
+        fallback = pd.to_datetime(values[parsed.isna()], format='mixed', errors='coerce', utc=True)
+        parsed = parsed.fillna(fallback)
+    return parsed
+
+
+def apply_column_types(df):
+    """Casts known columns to their Parquet types"""
+    df = df.copy()
+    for column, column_type in COLUMN_TYPES.items():
+        if column not in df.columns:
+            continue
+        if column_type == 'timestamp':
+            df[column] = to_timestamps(df[column])
+            continue
+        numbers = pd.to_numeric(df[column], errors='coerce')
+        # Keep non-numeric ids (e.g. from custom datasets) as they are rather than losing them
+        if numbers.isna().sum() > df[column].isna().sum():
+            df[column] = df[column].astype(str)
+            continue
+        df[column] = numbers.astype('Int8' if column_type == 'int8' else 'Int64')
+    return df
+
+
+def write_table(df, key):
+    """Writes a whole DataFrame as the artifact `key`"""
+    with TableWriter(key, list(df.columns)) as writer:
+        writer.write_frame(df)
+
+
+def append_table(df, key):
+    """
+    Appends a DataFrame to the artifact `key`, creating it if needed. CSV rows are
+    appended in place; a Parquet file is rewritten with the new rows at the end.
+    """
+    if not artifact_exists(key):
+        write_table(df, key)
+        return
+    if use_parquet():
+        existing = read_table(key)
+        write_table(pd.concat([apply_column_types(existing), apply_column_types(df)], ignore_index=True), key)
+        return
+    df.to_csv(artifact_path(key), mode='a', index=False, header=False, encoding='utf-8')
+
+
+def read_table(key, columns=None):
+    """Loads the artifact `key` as a DataFrame (Parquet is read memory-mapped)"""
+    path = artifact_path(key)
+    if use_parquet():
+        return _pyarrow().parquet.read_table(path, columns=columns, memory_map=True).to_pandas()
+    return pd.read_csv(path, usecols=columns, encoding='utf-8')
+
+
+def iter_records(key, batch_size=50_000):
+    """Streams the artifact `key` as dicts without loading it all"""
+    path = artifact_path(key)
+    if use_parquet():
+        parquet_file = _pyarrow().parquet.ParquetFile(path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            yield from batch.to_pylist()
+        return
+    with open(path, 'r', encoding='utf-8') as file:
+        yield from csv.DictReader(file)
+
+
+def artifact_exists(key):
+    return os.path.exists(artifact_path(key))
+
+
+class TableWriter:
+    """
+    Incrementally writes the artifact `key` with the given columns. Rows are written
+    straight through for CSV; for Parquet they are buffered and written as row groups.
+    """
+
+    def __init__(self, key, columns, buffer_rows=50_000):
+        self.path = artifact_path(key)
+        self.columns = columns
+        self.buffer_rows = buffer_rows
+        self.rows = []
+        self.parquet_writer = None
+        if use_parquet():
+            self.pyarrow = _pyarrow()
+            self.file = None
+        else:
+            self.file = open(self.path, 'w', newline='', encoding='utf-8')
+            self.csv_writer = csv.writer(self.file)
+            self.csv_writer.writerow(columns)
+
+    def write_row(self, row):
+        if self.file:
+            self.csv_writer.writerow(row)
+            return
+        self.rows.append(row)
+        if len(self.rows) >= self.buffer_rows:
+            self.flush()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def write_frame(self, df):
+        if self.file:
+            df[self.columns].to_csv(self.file, index=False, header=False)
+            return
+        self.flush()
+        self._write_parquet(df[self.columns])
+
+    def _write_parquet(self, df):
+        table = self.pyarrow.Table.from_pandas(apply_column_types(df), preserve_index=False)
+        if self.parquet_writer is None:
+            self.parquet_writer = self.pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        else:
+            table = table.cast(self.parquet_writer.schema)
+        self.parquet_writer.write_table(table)
+
+    def flush(self):
+        if self.rows:
+            self._write_parquet(pd.DataFrame(self.rows, columns=self.columns))
+            self.rows = []
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            return
+        self.flush()
+        if self.parquet_writer is None:
+            # Nothing was written: still produce a valid (empty) file
+            self._write_parquet(pd.DataFrame(columns=self.columns))
+        self.parquet_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,165 @@
+# Gemini batch responses are validated per tweet, and analyze_concurrent retries the
+# tweets of a failed or incomplete response until it gives up on them
+
+import asyncio
+
+import pytest
+
+import pipeline
+from fakes import FakeGenerativeModel
+from rate_limiter import RateLimiter
+
+analyzer = pipeline.load_stage(3)
+
+MAX_RETRIES = analyzer.ANALYSIS_CONFIG["max_retries"]
+
+
+def test_validate_result():
+    expected = {'1', '2'}
+    assert analyzer.validate_result({'id': 1, 'stance_score': '4', 'explanation': 'ok'}, expected) == \
+        {'id': '1', 'stance_score': 4, 'explanation': 'ok'}
+    assert analyzer.validate_result({'id': '2', 'stance_score': 5}, expected)['explanation'] == ''
+    assert analyzer.validate_result({'id': '3', 'stance_score': 4}, expected) is None
+    assert analyzer.validate_result({'stance_score': 4}, expected) is None
+    assert analyzer.validate_result(['1', 4], expected) is None
+
+
+@pytest.mark.parametrize('score', [0, 6, -1, 'high', None])
+def test_validate_result_rejects_bad_scores(score):
+    assert analyzer.validate_result({'id': '1', 'stance_score': score}, {'1'}) is None
+
+
+def test_parse_batch_response():
+    response = '[{"id": "1", "stance_score": 2}, {"id": "2", "stance_score": 4}]'
+    results, missing = analyzer.parse_batch_response(response, [1, 2])
+    assert [(result['id'], result['stance_score']) for result in results] == [('1', 2), ('2', 4)]
+    assert missing == set()
+
+
+def test_parse_batch_response_in_markdown():
+    response = '```json\nHere you go: [{"id": "1", "stance_score": 3}]\n```'
+    results, missing = analyzer.parse_batch_response(response, ['1'])
+    assert [result['stance_score'] for result in results] == [3]
+    assert missing == set()
+
+
+@pytest.mark.parametrize('response', [None, '', 'not json at all', '[{"id": "1", "stance_score": 3',
+                                      '{"unexpected": true}', '42'])
+def test_parse_batch_response_malformed(response):
+    results, missing = analyzer.parse_batch_response(response, ['1', '2'])
+    assert results == []
+    assert missing == {'1', '2'}
+
+
+def test_parse_batch_response_partial():
+    # Out-of-range score, unknown id and a missing id: only the valid result is kept
+    response = ('[{"id": "1", "stance_score": 9}, {"id": "2", "stance_score": 5},'
+                ' {"id": "7", "stance_score": 1}]')
+    results, missing = analyzer.parse_batch_response(response, ['1', '2', '3'])
+    assert [result['id'] for result in results] == ['2']
+    assert missing == {'1', '3'}
+
+
+def test_parse_batch_response_duplicate_ids():
+    response = ('[{"id": "1", "stance_score": 2}, {"id": "1", "stance_score": 5},'
+                ' {"id": "2", "stance_score": 7}, {"id": "2", "stance_score": 3}]')
+    results, missing = analyzer.parse_batch_response(response, ['1', '2'])
+    # The first valid result per id wins
+    assert [(result['id'], result['stance_score']) for result in results] == [('1', 2), ('2', 3)]
+    assert missing == set()
+
+
+class DroppingModel(FakeGenerativeModel):
+    """Leaves `dropped` out of its answers, the first `times` times it is asked about it"""
+
+    def __init__(self, dropped, times, **options):
+        super().__init__(latency=0, **options)
+        self.dropped = dropped
+        self.times = times
+
+    def _answer(self, prompt):
+        response = super()._answer(prompt)
+        if f'"id": "{self.dropped}"' in prompt and self.times:
+            self.times -= 1
+            response.text = response.text.replace(f'"id": "{self.dropped}"', '"id": "dropped"')
+        return response
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(analyzer, 'backoff_delay', lambda attempt, base=1.0, cap=60.0: 0)
+
+
+def tweets(count):
+    return [(str(index), f"tweet {index} about grocery prices") for index in range(count)]
+
+
+def analyze(tweets, model, **options):
+    scored = []
+    options.setdefault('on_result', scored.append)
+    success_count, failed_ids = asyncio.run(asyncio.wait_for(
+        analyzer.analyze_concurrent(tweets, model, RateLimiter(100_000), compact=False, **options), timeout=30))
+    return scored, success_count, failed_ids
+
+
+def test_missing_ids_are_requeued():
+    model = DroppingModel('3', times=2)
+    scored, success_count, failed_ids = analyze(tweets(10), model, batch_size=5, concurrency=2)
+    assert sorted(result['id'] for result in scored) == [str(index) for index in range(10)]
+    assert success_count == 10
+    assert failed_ids == set()
+    assert model.calls == 4
+
+
+def test_gives_up_after_max_retries():
+    model = DroppingModel('3', times=MAX_RETRIES + 1)
+    scored, success_count, failed_ids = analyze(tweets(5), model, batch_size=5)
+    assert failed_ids == {'3'}
+    assert success_count == 4
+    assert '3' not in {result['id'] for result in scored}
+    assert model.calls == MAX_RETRIES + 1
+
+
+def test_rate_limited_requests_are_retried():
+    model = FakeGenerativeModel(latency=0, error_rate=0.5, seed=3)
+    scored, success_count, failed_ids = analyze(tweets(40), model, batch_size=2, concurrency=4)
+    assert model.rate_limited
+    assert len({result['id'] for result in scored}) == success_count
+    assert success_count + len(failed_ids) == 40
+    assert not failed_ids & {result['id'] for result in scored}
+
+
+def test_quota_exhausted():
+    # Only the first 4 requests fit in the fake quota; every retry of the rest is a 429 as well
+    model = FakeGenerativeModel(latency=0, requests_per_minute=4)
+    scored, success_count, failed_ids = analyze(tweets(10), model)
+    assert success_count == 4
+    assert failed_ids == {str(index) for index in range(4, 10)}
+    assert model.calls == 4 + 6 * (MAX_RETRIES + 1)
+    assert model.rate_limited == 6 * (MAX_RETRIES + 1)
+
+
+def test_failing_callback_does_not_hang():
+    scored = []
+
+    def on_result(result):
+        if result['id'] == '2':
+            raise ValueError("callback failed")
+        scored.append(result)
+
+    _, _, failed_ids = analyze(tweets(6), FakeGenerativeModel(latency=0), on_result=on_result, concurrency=2)
+    assert failed_ids == {'2'}
+    assert sorted(result['id'] for result in scored) == ['0', '1', '3', '4', '5']
+
+
+def test_async_iterator_input():
+    async def stream():
+        for tweet in tweets(7):
+            await asyncio.sleep(0)
+            yield tweet
+
+    scored, success_count, failed_ids = analyze(stream(), FakeGenerativeModel(latency=0), batch_size=3,
+                                                max_queued=2)
+    assert success_count == 7
+    assert failed_ids == set()
+    assert len(scored) == 7
@@ -0,0 +1,56 @@
+# Multi-dataset runs (main.py --datasets) share one Gemini rate limiter across the
+# worker processes; a worker must be able to run several datasets one after another
+
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUN_TWO_DATASETS = textwrap.dedent("""
+    import json, sys
+    sys.path.insert(0, {project!r})
+    import benchmark, config, pipeline
+    for name, seed in (('a', 1), ('b', 2)):
+        benchmark.generate_dataset(f'{{name}}.csv', 100, seed=seed)
+        config.DATASET_CONFIG[name] = f'{{name}}.csv'
+    # A quota small enough that the workers of the first dataset queue up on the limiter
+    config.ANALYSIS_CONFIG['requests_per_minute'] = 120
+    results = pipeline.run_datasets(['a', 'b'], workers=1, fake_model=True, batch_size=2, concurrency=4)
+    print(json.dumps(results))
+""")
+
+
+def test_two_datasets_through_one_worker(tmp_path):
+    env = dict(os.environ, PIPELINE_METRICS_DIR=str(tmp_path / 'metrics'))
+    result = subprocess.run([sys.executable, '-c', RUN_TWO_DATASETS.format(project=PROJECT_DIR)],
+                            cwd=tmp_path, env=env, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == {'a': 0, 'b': 0}
+    for name in ('a', 'b'):
+        with open(tmp_path / 'runs' / name / 'run.log', encoding='utf-8') as log:
+            assert 'Giving up' not in log.read()
+        with open(tmp_path / 'runs' / name / '03_sentiment_labels.csv', encoding='utf-8') as labels:
+            assert len(labels.read().splitlines()) == 101
+
+
+def test_run_dataset_leaves_no_state_behind(tmp_path, monkeypatch):
+    import benchmark
+    import metrics
+    import pipeline
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv(metrics.METRICS_DIR_ENV, str(tmp_path / 'inherited'))
+    source = str(tmp_path / 'a.csv')
+    benchmark.generate_dataset(source, 20, seed=1)
+
+    name, result, _ = pipeline.run_dataset('a', source, str(tmp_path / 'runs' / 'a'),
+                                           str(tmp_path / 'metrics' / 'a'), fake_model=True)
+    assert (name, result) == ('a', 0)
+    assert os.getcwd() == str(tmp_path)
+
+    # The next task on the same worker has no metrics directory: it must not reuse the last one
+    pipeline.run_dataset('b', source, str(tmp_path / 'runs' / 'b'), fake_model=True)
+    assert metrics.METRICS_DIR_ENV not in os.environ
+    assert os.getcwd() == str(tmp_path)
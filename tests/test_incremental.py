@@ -0,0 +1,87 @@
+# Incremental runs (--incremental) append only new tweets: a scrape never stores a
+# tweet twice, and cleaning the same delta again does not append its rows again
+
+import asyncio
+import csv
+import os
+
+import pytest
+
+import pipeline
+from fakes import FakeTwitterClient
+from pacing import FixedPacing, RequestScheduler
+from storage import artifact_path
+
+scraper = pipeline.load_stage(1)
+cleaner = pipeline.load_stage(2)
+
+
+@pytest.fixture
+def query_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'query_test.txt').write_text('grocery prices', encoding='utf-8')
+    return 'query_test.txt'
+
+
+def scrape(query_file, incremental, tweets_per_query=30):
+    client = FakeTwitterClient(tweets_per_query=tweets_per_query, latency=0)
+    scheduler = RequestScheduler(requests_per_minute=60_000, pacing=FixedPacing(0))
+    return asyncio.run(scraper.scrape_tweets(query_file, tweets_per_query, incremental=incremental,
+                                             client=client, scheduler=scheduler))
+
+
+def tweet_ids(path):
+    with open(path, newline='', encoding='utf-8') as file:
+        return [row[0] for row in csv.reader(file)][1:]
+
+
+def test_incremental_scrape_appends_new_tweets_once(query_file):
+    output_file = scrape(query_file, incremental=True)
+    assert len(tweet_ids(output_file)) == 30
+    assert scrape(query_file, incremental=True, tweets_per_query=50) == output_file
+    ids = tweet_ids(output_file)
+    assert len(ids) == len(set(ids)) == 50
+    assert len(tweet_ids('01_delta_query_test.csv')) == 20
+
+
+def test_incremental_scrape_does_not_append_to_full_scrape(query_file):
+    output_file = scrape(query_file, incremental=False)
+    assert tweet_ids(output_file) == [str(count) for count in range(1, 31)]
+    assert scrape(query_file, incremental=True) is None
+    assert tweet_ids(output_file) == [str(count) for count in range(1, 31)]
+
+
+def test_full_scrape_resets_seen_tweets(query_file):
+    output_file = scrape(query_file, incremental=True)
+    scrape(query_file, incremental=False)
+    # The file now holds position-keyed rows again: the old index must not be used for it
+    assert scrape(query_file, incremental=True, tweets_per_query=50) is None
+    assert tweet_ids(output_file) == [str(count) for count in range(1, 31)]
+
+
+def cleaned_ids():
+    return tweet_ids(artifact_path('cleaned_tweets'))
+
+
+def test_delta_is_cleaned_once(query_file):
+    scrape(query_file, incremental=True)
+    assert cleaner.clean_delta('01_delta_query_test.csv') == 0
+    assert cleaner.clean_delta('01_delta_query_test.csv') == 0
+    assert len(cleaned_ids()) == 30
+
+    scrape(query_file, incremental=True, tweets_per_query=50)
+    assert cleaner.clean_delta('01_delta_query_test.csv') == 0
+    assert cleaner.clean_delta('01_delta_query_test.csv') == 0
+    ids = cleaned_ids()
+    assert len(ids) == len(set(ids)) == 50
+
+
+def test_appended_rows_are_cleaned_once(query_file):
+    output_file = scrape(query_file, incremental=True)
+    assert cleaner.clean_delta(output_file) == 0
+    size = os.path.getsize(output_file)
+    scrape(query_file, incremental=True, tweets_per_query=50)
+    assert cleaner.clean_delta(output_file, size) == 0
+    assert cleaner.clean_delta(output_file, size) == 0
+    ids = cleaned_ids()
+    assert len(ids) == len(set(ids)) == 50
@@ -0,0 +1,120 @@
+# Twitter requests are paced by a RequestScheduler: a 429 pauses and retries the
+# request instead of aborting the scrape, and the observed request rate is reported
+
+import asyncio
+import time
+
+import pytest
+from twikit import TooManyRequests
+
+import pipeline
+from config import SCRAPE_CONFIG
+from fakes import FakeTwitterClient
+from pacing import AdaptivePacing, FixedPacing, JitteredPacing, RequestScheduler, make_pacing
+
+scraper = pipeline.load_stage(1)
+
+
+@pytest.fixture(autouse=True)
+def short_delays(monkeypatch):
+    for name, seconds in (('pacing_delay', 0.01), ('pacing_jitter', 0.005), ('pacing_min_delay', 0.0),
+                          ('pacing_max_delay', 0.05)):
+        monkeypatch.setitem(SCRAPE_CONFIG, name, seconds)
+
+
+def scheduler_without_backoff(**options):
+    scheduler = RequestScheduler(requests_per_minute=60_000, **options)
+    scheduler.backoff = lambda error, attempt: 0
+    return scheduler
+
+
+async def collect(client, minimum_tweets, scheduler):
+    return [row async for row in scraper.iter_tweets(client, 'grocery prices', minimum_tweets, scheduler=scheduler)]
+
+
+@pytest.mark.parametrize('policy', ['fixed', 'jittered', 'adaptive'])
+def test_rate_limited_requests_are_retried(policy):
+    client = FakeTwitterClient(tweets_per_query=100, page_size=10, latency=0, error_rate=0.3, seed=4)
+    scheduler = scheduler_without_backoff(max_retries=10, pacing=make_pacing(policy))
+    rows = asyncio.run(collect(client, 100, scheduler))
+    assert len(rows) == 100
+    assert client.rate_limited > 0
+    assert scheduler.rate_limited == client.rate_limited
+    assert scheduler.requests == client.calls == 10 + client.rate_limited
+
+
+def test_gives_up_after_max_retries():
+    client = FakeTwitterClient(latency=0, error_rate=1.0)
+    scheduler = scheduler_without_backoff(max_retries=2, pacing=FixedPacing(0))
+    with pytest.raises(TooManyRequests):
+        asyncio.run(collect(client, 10, scheduler))
+    assert client.calls == scheduler.requests == 3
+
+
+def test_backoff_waits_for_rate_limit_reset():
+    scheduler = RequestScheduler()
+    error = TooManyRequests("429", headers={'x-rate-limit-reset': str(int(time.time()) + 30)})
+    assert 29 <= scheduler.backoff(error, 0) <= 31
+    assert 0 <= scheduler.backoff(TooManyRequests("429"), 0) <= SCRAPE_CONFIG["backoff_base"]
+
+
+def test_fixed_pacing_gap():
+    scheduler = RequestScheduler(requests_per_minute=60_000, pacing=FixedPacing(0.05))
+
+    async def request():
+        return time.monotonic()
+
+    async def run():
+        return [await scheduler.call(request) for _ in range(4)]
+
+    sent = asyncio.run(run())
+    assert all(later - earlier >= 0.045 for earlier, later in zip(sent, sent[1:]))
+
+
+def test_jittered_pacing_stays_within_jitter():
+    pacing = JitteredPacing(5, 2)
+    delays = [pacing.delay() for _ in range(1000)]
+    assert all(3 <= delay <= 7 for delay in delays)
+    assert len(set(delays)) > 1
+    assert JitteredPacing(1, 2).delay() >= 0
+
+
+def test_adaptive_pacing():
+    pacing = AdaptivePacing(10, min_delay=1, max_delay=60)
+    pacing.on_success()
+    assert pacing.delay() == pytest.approx(9)
+    pacing.on_rate_limited(TooManyRequests("429"))
+    assert pacing.delay() == pytest.approx(18)
+    for _ in range(5):
+        pacing.on_rate_limited(TooManyRequests("429"))
+    assert pacing.delay() == 60
+    for _ in range(100):
+        pacing.on_success()
+    assert pacing.delay() == 1
+    # With quota headers the remaining requests are spread over the rest of the window
+    headers = {'x-rate-limit-remaining': '10', 'x-rate-limit-reset': str(int(time.time()) + 100)}
+    pacing.on_rate_limited(TooManyRequests("429", headers=headers))
+    assert 9 <= pacing.delay() <= 10
+
+
+def test_make_pacing_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        make_pacing('bursty')
+
+
+def test_observed_rate():
+    now = [1000.0]
+    scheduler = RequestScheduler(requests_per_minute=60_000, pacing=FixedPacing(0), clock=lambda: now[0])
+    assert scheduler.observed_rate() == 0.0
+
+    async def request():
+        # Every request takes one (fake) second
+        now[0] += 1
+
+    async def run():
+        for _ in range(5):
+            await scheduler.call(request)
+
+    asyncio.run(run())
+    assert scheduler.observed_rate() == pytest.approx(60)
+    assert scheduler.summary() == "5 requests, 0 rate limited, 60.0 requests/min observed"
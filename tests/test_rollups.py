@@ -0,0 +1,27 @@
+# The rollup store of step 4 counts every scored tweet exactly once, across runs
+
+import pipeline
+
+analysis = pipeline.load_stage(4)
+
+DATE = 'Tue Nov 14 22:13:20 +0000 2023'
+
+
+def test_tweet_is_counted_once(tmp_path):
+    with analysis.RollupStore(str(tmp_path / 'rollups.sqlite')) as store:
+        assert store.add('1', 3, DATE)
+        assert not store.add('1', 3, DATE)
+    with analysis.RollupStore(str(tmp_path / 'rollups.sqlite')) as store:
+        assert not store.add('1', 3, DATE)
+        assert [row[2] for row in store.rows('day')] == [1]
+
+
+def test_tweet_without_date_is_not_marked_counted(tmp_path):
+    with analysis.RollupStore(str(tmp_path / 'rollups.sqlite')) as store:
+        assert not store.add('1', 3, '')
+        assert not store.add('2', 4, 'not a date')
+        assert list(store.rows()) == []
+        # Once the date is known the tweets are still counted
+        assert store.add('1', 3, DATE)
+        assert store.add('2', 4, DATE)
+        assert [row[:4] for row in store.rows('day')] == [['day', '2023-11-14', 2, 7]]
@@ -0,0 +1,31 @@
+# Streaming mode (main.py --stream) runs offline against the fake Twitter client and
+# fake Gemini model, and prints the running averages at most every few seconds
+
+import asyncio
+
+import pipeline
+from config import ANALYSIS_CONFIG, SCRAPE_CONFIG
+from fakes import FakeTwitterClient
+
+
+def stream(tmp_path, monkeypatch, summary_seconds):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(ANALYSIS_CONFIG, 'stream_summary_seconds', summary_seconds)
+    monkeypatch.setitem(ANALYSIS_CONFIG, 'requests_per_minute', 6000)
+    monkeypatch.setitem(SCRAPE_CONFIG, 'requests_per_minute', 6000)
+    monkeypatch.setitem(SCRAPE_CONFIG, 'pacing', 'fixed')
+    monkeypatch.setitem(SCRAPE_CONFIG, 'pacing_delay', 0)
+    (tmp_path / 'query_test.txt').write_text('grocery prices', encoding='utf-8')
+    return asyncio.run(pipeline.stream_tweets('query_test.txt', minimum_tweets=40, batch_size=5, fake_model=True,
+                                              client=FakeTwitterClient(latency=0)))
+
+
+def test_summary_is_throttled(tmp_path, monkeypatch, capsys):
+    aggregate = stream(tmp_path, monkeypatch, summary_seconds=60)
+    assert aggregate.count == 40
+    assert capsys.readouterr().out.count('📈') == 1
+
+
+def test_summary_without_throttling(tmp_path, monkeypatch, capsys):
+    aggregate = stream(tmp_path, monkeypatch, summary_seconds=0)
+    assert capsys.readouterr().out.count('📈') == aggregate.count == 40
@@ -0,0 +1,87 @@
+# clean_series (vectorized, optionally chunked across worker processes) must give
+# exactly what the row-by-row clean_text gives
+
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from text_cleaning import clean_series, clean_text, find_mismatches
+
+URLS_MENTIONS_HASHTAGS = [
+    "Eggs are $7 now https://t.co/abc123 unbelievable",
+    "see www.example.com/prices?q=eggs&x=1 for more",
+    "http://a.b https://c.d/e www.f.g all gone",
+    "@Walmart why is milk so expensive?? @Costco_US is cheaper",
+    "email me at someone@example.com about #groceries",
+    "#inflation #FoodPrices are #1 topic, ## double, #",
+    "@@double @ alone @_underscore_ @123",
+    "mixed:@user#tag http://x.y@user #tag@user",
+]
+EMOJI_SEQUENCES = [
+    "Keycaps 1️⃣ 2️⃣ #️⃣ *️⃣ 0⃣ and plain 1 # *",
+    "Price went up 3️⃣0️⃣% this week",
+    "Family shop 👨‍👩‍👧‍👦 and 👩🏽‍🍳 cooking, 🧑‍🤝‍🧑 sharing",
+    "ZWJ at the edges ‍😡‍ and alone ‍",
+    "Flags 🇺🇸🇬🇧 🇫🇷 and a lone regional indicator 🇺",
+    "Tag sequences 🏴󠁧󠁢󠁳󠁣󠁴󠁿 🏴󠁧󠁢󠁥󠁮󠁧󠁿 🏴",
+    "Skin tones 👍🏻👍🏿 and variation selectors ❤️ ☺ ✔️",
+    "😡😡😡",
+    "💸💸 prices 💸",
+    "café naïve jalapeño — “quotes” … and 中文 text",
+    "Ünïcödé 💰 ümlauts ß",
+]
+NON_STRINGS = [np.nan, None, 42, 3.5, 0, True, float('inf')]
+OTHER_TEXT = ["", "   ", "\n\t spaces \r\n everywhere  ", "Just words.", "a-b, c! d? e."]
+
+
+def expected(values):
+    return [clean_text(value) for value in values]
+
+
+@pytest.mark.parametrize('text', URLS_MENTIONS_HASHTAGS + EMOJI_SEQUENCES + OTHER_TEXT)
+def test_single_text(text):
+    assert clean_series(pd.Series([text], dtype=object)).tolist() == [clean_text(text)]
+
+
+def test_non_string_cells():
+    values = NON_STRINGS + ["text after missing values 😡"]
+    assert clean_series(pd.Series(values, dtype=object)).tolist() == expected(values)
+
+
+@pytest.mark.parametrize('dtype', [object, 'string[python]', 'string[pyarrow]'])
+def test_dtypes(dtype):
+    if dtype == 'string[pyarrow]':
+        pytest.importorskip('pyarrow')
+    values = URLS_MENTIONS_HASHTAGS + EMOJI_SEQUENCES + OTHER_TEXT + [None]
+    texts = pd.Series(values, dtype=dtype)
+    assert clean_series(texts).tolist() == expected(texts)
+
+
+def test_index_is_kept():
+    texts = pd.Series(EMOJI_SEQUENCES, index=range(100, 100 + len(EMOJI_SEQUENCES)))
+    cleaned = clean_series(texts)
+    assert list(cleaned.index) == list(texts.index)
+    assert not find_mismatches(texts)
+
+
+def fuzz_texts(count, seed=0):
+    """Random tweets stitched together from all of the cases above"""
+    pieces = URLS_MENTIONS_HASHTAGS + EMOJI_SEQUENCES + OTHER_TEXT + [
+        "😡", "1️⃣", "🇺🇸", "‍", "️", "@", "#", "http", "www", " ", ".", "-", "é", "中",
+    ]
+    rng = random.Random(seed)
+    return [''.join(rng.choice(pieces) for _ in range(rng.randint(0, 6))) for _ in range(count)]
+
+
+def test_fuzz():
+    texts = pd.Series(fuzz_texts(3_000) + NON_STRINGS, dtype=object)
+    assert clean_series(texts).tolist() == expected(texts)
+
+
+def test_chunked_workers():
+    texts = pd.Series(fuzz_texts(1_000, seed=1) + NON_STRINGS, dtype=object)
+    cleaned = clean_series(texts, workers=2, chunksize=150)
+    assert cleaned.tolist() == expected(texts)
+    assert list(cleaned.index) == list(texts.index)
@@ -0,0 +1,103 @@
+# Tweet text cleaning, row by row and vectorized over pandas Series
+#
+# Lives in its own (importable) module so multiprocessing workers can load it
+# regardless of how the numbered stage script was started.
+
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import emoji
+import pandas as pd
+
+URL_PATTERN = re.compile(r'http\S+|www\S+|https\S+', flags=re.MULTILINE)
+MENTION_PATTERN = re.compile(r'@\w+')
+HASHTAG_PATTERN = re.compile(r'#')
+# Removing mentions and then '#' in one pass gives the same result as two passes:
+# '#' is never part of \w, so the set of mention matches can't change
+MENTION_OR_HASHTAG_PATTERN = re.compile(r'@\w+|#')
+SPECIAL_CHARS_PATTERN = re.compile(r'[^\w\s.,!?-]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+# Every emoji is a run of non-ASCII code points, optionally preceded by a keycap base
+# (0-9, # or *). Scanning only those runs gives the same result as scanning the
+# whole text, at a fraction of the cost for mostly-ASCII tweets
+EMOJI_CANDIDATE_PATTERN = re.compile(r'[0-9#*]?[^\x00-\x7f]+')
+
+
+def clean_text(text):
+    """Clean tweet text by removing URLs, mentions, emojis, and special characters"""
+    if pd.isna(text):
+        return ""
+
+    # Convert to string if not already
+    text = str(text)
+
+    # Remove URLs
+    text = URL_PATTERN.sub('', text)
+
+    # Remove mentions
+    text = MENTION_PATTERN.sub('', text)
+
+    # Remove hashtags but keep the text
+    text = HASHTAG_PATTERN.sub('', text)
+
+    # Remove emojis
+    text = emoji.replace_emoji(text, '')
+
+    # Remove special characters but keep basic punctuation
+    text = SPECIAL_CHARS_PATTERN.sub('', text)
+
+    # Normalize whitespace
+    text = WHITESPACE_PATTERN.sub(' ', text)
+    text = text.strip()
+
+    return text
+
+
+def remove_emojis(text):
+    """Same result as emoji.replace_emoji(text, ''), scanning only non-ASCII runs"""
+    return EMOJI_CANDIDATE_PATTERN.sub(lambda match: emoji.replace_emoji(match.group(), ''), text)
+
+
+def _clean_chunk(texts):
+    """Vectorized clean_text over one Series (runs in the caller or a worker process)"""
+    texts = texts.where(texts.notna(), '').astype(str)
+    texts = texts.str.replace(URL_PATTERN, '', regex=True)
+    texts = texts.str.replace(MENTION_OR_HASHTAG_PATTERN, '', regex=True)
+
+    # Pure-ASCII texts can't contain emojis and skip the emoji scan entirely
+    non_ascii = ~texts.map(str.isascii).astype(bool)
+    if non_ascii.any():
+        texts = texts.copy()
+        texts[non_ascii] = texts[non_ascii].map(remove_emojis)
+
+    texts = texts.str.replace(SPECIAL_CHARS_PATTERN, '', regex=True)
+    return texts.str.replace(WHITESPACE_PATTERN, ' ', regex=True).str.strip()
+
+
+def clean_series(texts, workers=1, chunksize=100_000):
+    """
+    Applies clean_text to a whole Series of tweet texts, producing identical output.
+    With workers > 1, chunks of `chunksize` rows are cleaned in parallel processes.
+    """
+    if workers <= 1 or len(texts) <= chunksize:
+        return _clean_chunk(texts)
+
+    chunks = [texts.iloc[start:start + chunksize] for start in range(0, len(texts), chunksize)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return pd.concat(list(executor.map(_clean_chunk, chunks)))
+
+
+def find_mismatches(texts, limit=10):
+    """
+    Compares clean_series against clean_text row by row.
+    Returns up to `limit` (index, original, expected, actual) tuples that differ.
+    """
+    vectorized = clean_series(texts)
+    mismatches = []
+    for index, original in texts.items():
+        expected = clean_text(original)
+        if vectorized[index] != expected:
+            mismatches.append((index, original, expected, vectorized[index]))
+            if len(mismatches) >= limit:
+                break
+    return mismatches